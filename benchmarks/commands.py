@@ -0,0 +1,106 @@
+"""
+Compare import time and memory of the generated RedisCommandsMixin with
+its table-driven alternative (gen_commands.py --lazy). Every import runs
+in a fresh interpreter.
+
+    python benchmarks/commands.py --runs 20 --use 10
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gen_commands
+
+
+PROBE = '''
+import json, sys, time
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+    tracemalloc.start()
+except ImportError:
+    tracemalloc = None
+
+start = time.time()
+module = __import__(sys.argv[1])
+imported = time.time()
+
+class Client(module.RedisCommandsMixin):
+    def send_message(self, args, callback=None):
+        pass
+
+cli = Client()
+for name in sorted(module.__dict__.get('_METHODS') or
+                   [n for n in dir(module.RedisCommandsMixin)
+                    if not n.startswith('_')])[:int(sys.argv[2])]:
+    getattr(cli, name)
+used = time.time()
+
+print(json.dumps({
+    'import': imported - start,
+    'use': used - imported,
+    'traced': tracemalloc.get_traced_memory()[0] if tracemalloc else 0,
+    'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+              if resource else 0,
+}))
+'''
+
+
+def probe(path, module, use):
+    output = subprocess.check_output(
+        [sys.executable, '-c', PROBE, module, str(use)], cwd=path)
+    return json.loads(output.decode('utf-8'))
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--use', type=int, default=10,
+                        help='number of commands looked up after import')
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp()
+    try:
+        sources = [
+            ('eager', gen_commands.get_class_source('RedisCommandsMixin')),
+            ('lazy', gen_commands.get_lazy_class_source('RedisCommandsMixin')),
+        ]
+        for name, source in sources:
+            with open(os.path.join(path, '%s_commands.py' % name), 'w') as f:
+                f.write(source)
+
+        print('%-8s %10s %12s %12s %12s %12s' % (
+            'variant', 'source KB', 'import ms', 'use ms', 'traced KB',
+            'maxrss KB'))
+        for name, source in sources:
+            module = '%s_commands' % name
+            # First run writes the bytecode cache
+            probe(path, module, args.use)
+            results = [probe(path, module, args.use)
+                       for _ in range(args.runs)]
+            print('%-8s %10.0f %12.2f %12.2f %12.0f %12.0f' % (
+                name, len(source) / 1024.0,
+                median([r['import'] for r in results]) * 1000,
+                median([r['use'] for r in results]) * 1000,
+                median([r['traced'] for r in results]) / 1024.0,
+                median([r['maxrss'] for r in results])))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Compare key to node mapping algorithms of RedisNodes.
+
+Reports ring construction time, lookup cost and key distribution skew
+(largest node load relative to the mean, and relative standard deviation).
+
+    python benchmarks/hashing.py --nodes 16 --keys 200000
+"""
+import argparse
+import math
+import timeit
+from collections import Counter
+
+from toredis.hashing import Crc32Ring, KetamaRing, JumpRing, RendezvousRing
+
+
+RINGS = [Crc32Ring, KetamaRing, JumpRing, RendezvousRing]
+
+
+def skew(counts, num_nodes, num_keys):
+    mean = float(num_keys) / num_nodes
+    loads = list(counts.values()) + [0] * (num_nodes - len(counts))
+    stddev = math.sqrt(sum((l - mean) ** 2 for l in loads) / num_nodes)
+    return max(loads) / mean, stddev / mean
+
+
+def run(ring_cls, nodes, keys):
+    start = timeit.default_timer()
+    ring = ring_cls(nodes)
+    build = timeit.default_timer() - start
+
+    get_node = ring.get_node
+    start = timeit.default_timer()
+    counts = Counter(get_node(key) for key in keys)
+    lookup = timeit.default_timer() - start
+
+    max_load, rel_stddev = skew(counts, len(nodes), len(keys))
+    return {
+        'ring': ring_cls.__name__,
+        'build_ms': build * 1000,
+        'lookup_ns': lookup * 1e9 / len(keys),
+        'max_load': max_load,
+        'rel_stddev': rel_stddev,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--nodes', type=int, default=16)
+    parser.add_argument('--keys', type=int, default=200000)
+    parser.add_argument('--replicas', type=int, default=None,
+                        help='points per node, ring default if not set')
+    args = parser.parse_args()
+
+    nodes = [{'name': '10.0.0.%d:6379' % i} for i in range(args.nodes)]
+    if args.replicas is not None:
+        for n in nodes:
+            n['replicas'] = args.replicas
+    keys = ['user:%d:profile' % i for i in range(args.keys)]
+
+    print('%-16s %10s %12s %10s %12s' % (
+        'ring', 'build ms', 'lookup ns', 'max/mean', 'rel stddev'))
+    for ring_cls in RINGS:
+        res = run(ring_cls, nodes, keys)
+        print('%(ring)-16s %(build_ms)10.2f %(lookup_ns)12.0f '
+              '%(max_load)10.3f %(rel_stddev)12.4f' % res)
+
+
+if __name__ == '__main__':
+    main()
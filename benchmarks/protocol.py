@@ -0,0 +1,202 @@
+"""
+Microbenchmarks of the protocol hot paths of Client: format_message,
+send_message (formatting, write and callback bookkeeping) and _on_read
+(reply parsing and callback dispatch), with the socket replaced by a stub.
+
+For every argument shape reports time per command and memory measured
+with tracemalloc: peak of memory allocated while one command is handled
+and memory retained per command after a batch. Results can be written as
+JSON to compare runs.
+
+    python benchmarks/protocol.py --output protocol.json
+    python benchmarks/protocol.py --shapes get,mset_1000 --repeat 5
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import hiredis
+from tornado.ioloop import IOLoop
+
+from toredis.client import Client
+
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def make_shapes():
+    # name: (arguments, encoded reply, commands per run)
+    mset = ['MSET']
+    for idx in range(1000):
+        mset.extend(['key:%d' % idx, 'value:%d' % idx])
+    zadd = ['ZADD', 'zset']
+    for idx in range(10000):
+        zadd.extend([idx * 0.5, 'member:%d' % idx])
+    return {
+        'get': (['GET', 'key:1'], b'$7\r\nvalue:1\r\n', 20000),
+        'mset_1000': (mset, b'+OK\r\n', 200),
+        'zadd_10k': (zadd, b':10000\r\n', 20),
+        'set_1mb': (['SET', 'key:1', b'x' * (1024 * 1024)], b'+OK\r\n', 50),
+    }
+
+
+class NullStream(object):
+    """
+    Stands for IOStream, drops written data
+    """
+
+    def write(self, data):
+        pass
+
+    def closed(self):
+        return False
+
+
+def make_client():
+    cli = Client(io_loop=IOLoop())
+    cli._reset()
+    cli._pid = os.getpid()
+    cli._stream = NullStream()
+    return cli
+
+
+def _noop(resp):
+    pass
+
+
+def best_time(func, count, repeat):
+    times = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func(count)
+        times.append(timeit.default_timer() - start)
+    return min(times) * 1e9 / count
+
+
+def measure_memory(func, count):
+    """
+    Return peak bytes allocated while one command runs and bytes retained
+    per command after ``count`` commands
+    """
+    if tracemalloc is None:
+        return None, None
+    func(1)
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.clear_traces()
+            base = 0
+        func(1)
+        current, peak = tracemalloc.get_traced_memory()
+        peak -= base
+
+        base = current
+        func(count)
+        retained = tracemalloc.get_traced_memory()[0] - base
+    finally:
+        tracemalloc.stop()
+    return peak, float(retained) / count
+
+
+def bench_format(args, reply, count):
+    format_message = make_client().format_message
+
+    def run(n):
+        for _ in range(n):
+            format_message(args)
+    return run
+
+
+def bench_send(args, reply, count):
+    cli = make_client()
+
+    def run(n):
+        # Replies never come: drop callbacks so they do not pile up
+        # between runs, but keep them within one run as a client does
+        cli.callbacks.clear()
+        cli._pending.clear()
+        for _ in range(n):
+            cli.send_message(args, _noop)
+    return run
+
+
+def bench_read(args, reply, count):
+    cli = make_client()
+
+    def run(n):
+        data = reply * n
+        for _ in range(n):
+            cli.callbacks.append(_noop)
+            cli._pending.append((args[0], 0.0))
+        for offset in range(0, len(data), READ_CHUNK_SIZE):
+            cli._on_read(data[offset:offset + READ_CHUNK_SIZE])
+    return run
+
+
+BENCHMARKS = [
+    ('format_message', bench_format),
+    ('send_message', bench_send),
+    ('on_read', bench_read),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--shapes', default=None,
+                        help='comma separated shapes, all by default')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of every benchmark, the best one counts')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiplier of commands per run')
+    parser.add_argument('--output', default=None,
+                        help='write results to this file as JSON')
+    args = parser.parse_args()
+
+    shapes = make_shapes()
+    names = args.shapes.split(',') if args.shapes else sorted(shapes)
+    results = []
+    print('%-16s %-10s %14s %14s %16s' % (
+        'benchmark', 'shape', 'ns/command', 'peak bytes', 'retained bytes'))
+    for bench_name, make in BENCHMARKS:
+        for name in names:
+            command, reply, count = shapes[name]
+            count = max(int(count * args.scale), 1)
+            run = make(command, reply, count)
+            ns = best_time(run, count, args.repeat)
+            peak, retained = measure_memory(run, count)
+            results.append({
+                'benchmark': bench_name,
+                'shape': name,
+                'commands': count,
+                'ns_per_command': ns,
+                'peak_bytes': peak,
+                'retained_bytes_per_command': retained,
+            })
+            print('%-16s %-10s %14.0f %14s %16s' % (
+                bench_name, name, ns,
+                '-' if peak is None else '%d' % peak,
+                '-' if retained is None else '%.1f' % retained))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'hiredis': getattr(hiredis, '__version__', None),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
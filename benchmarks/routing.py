@@ -0,0 +1,63 @@
+"""
+Measure RedisNodes key to node lookup cost on Zipfian key streams, with and
+without the route cache.
+
+    python benchmarks/routing.py --nodes 16 --keys 100000 --lookups 500000
+"""
+import argparse
+import random
+import timeit
+from bisect import bisect_left
+
+from toredis.hashing import Crc32Ring, KetamaRing
+from toredis.nodes import RedisNodes
+
+
+def zipf_stream(num_keys, num_lookups, s, seed=0):
+    """
+    Return list of key names, key of rank k drawn with probability ~ 1/k^s
+    """
+    rnd = random.Random(seed)
+    cumulative = []
+    total = 0.0
+    for rank in range(1, num_keys + 1):
+        total += 1.0 / rank ** s
+        cumulative.append(total)
+    keys = ['object:%d' % i for i in range(num_keys)]
+    return [keys[bisect_left(cumulative, rnd.random() * total)]
+            for _ in range(num_lookups)]
+
+
+def run(nodes, stream):
+    get_client = nodes.get_client
+    start = timeit.default_timer()
+    for key in stream:
+        get_client(key)
+    return (timeit.default_timer() - start) * 1e9 / len(stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--nodes', type=int, default=16)
+    parser.add_argument('--keys', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=500000)
+    parser.add_argument('--cache-sizes', default='0,1000,10000')
+    args = parser.parse_args()
+
+    config = [{'name': 'node%d' % i, 'db': 0} for i in range(args.nodes)]
+    cache_sizes = [int(size) for size in args.cache_sizes.split(',')]
+
+    print('%-12s %6s %12s %12s' % ('ring', 'zipf s', 'cache size',
+                                   'ns/lookup'))
+    for s in (0.0, 0.99, 1.2):
+        stream = zipf_stream(args.keys, args.lookups, s)
+        for ring_cls in (Crc32Ring, KetamaRing):
+            for size in cache_sizes:
+                nodes = RedisNodes(config, ring_cls=ring_cls,
+                                   route_cache_size=size)
+                print('%-12s %6.2f %12d %12.0f' % (
+                    ring_cls.__name__, s, size, run(nodes, stream)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Compare value serializers of toredis.serializers on typical payloads.
+
+Reports serialized size, dumps and loads cost per value, and cost of
+loading an MGET reply of --batch values one by one and with loads_many.
+
+    python benchmarks/serializers.py --values 20000 --batch 100
+"""
+import argparse
+import timeit
+
+from toredis.serializers import SERIALIZERS, _dump
+
+
+def make_payloads(count):
+    return [
+        ('int', [i for i in range(count)]),
+        ('short str', [u'user:%d' % i for i in range(count)]),
+        ('small dict', [{'id': i, 'name': u'user %d' % i, 'active': True}
+                        for i in range(count)]),
+        ('profile', [{'id': i, 'name': u'user %d' % i,
+                      'email': u'user%d@example.com' % i,
+                      'tags': [u'a', u'b', u'c'],
+                      'scores': [i * 0.5, i * 1.5, i * 2.5],
+                      'address': {'city': u'Springfield', 'zip': u'12345'}}
+                     for i in range(count)]),
+    ]
+
+
+def run(serializer, values, batch):
+    start = timeit.default_timer()
+    dumped = [_dump(serializer, value) for value in values]
+    dumps = timeit.default_timer() - start
+
+    load = serializer.load
+    start = timeit.default_timer()
+    for value in dumped:
+        load(value)
+    loads = timeit.default_timer() - start
+
+    batches = [dumped[idx:idx + batch]
+               for idx in range(0, len(dumped), batch)]
+    start = timeit.default_timer()
+    for chunk in batches:
+        [load(value) for value in chunk]
+    one_by_one = timeit.default_timer() - start
+    loads_many = serializer.loads_many
+    start = timeit.default_timer()
+    for chunk in batches:
+        loads_many(chunk)
+    many = timeit.default_timer() - start
+
+    return {
+        'serializer': serializer.name,
+        'bytes': float(sum(len(value) for value in dumped)) / len(values),
+        'dumps_us': dumps * 1e6 / len(values),
+        'loads_us': loads * 1e6 / len(values),
+        'batch_us': one_by_one * 1e6 / len(batches),
+        'many_us': many * 1e6 / len(batches),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--values', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=100,
+                        help='number of values in one MGET reply')
+    args = parser.parse_args()
+
+    for payload, values in make_payloads(args.values):
+        print(payload)
+        print('  %-10s %10s %10s %10s %12s %12s' % (
+            'serializer', 'bytes', 'dumps us', 'loads us', 'batch us',
+            'many us'))
+        for name in sorted(SERIALIZERS):
+            res = run(SERIALIZERS[name], values, args.batch)
+            print('  %(serializer)-10s %(bytes)10.1f %(dumps_us)10.2f '
+                  '%(loads_us)10.2f %(batch_us)12.1f %(many_us)12.1f' % res)
+
+
+if __name__ == '__main__':
+    main()
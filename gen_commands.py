@@ -2,6 +2,7 @@
 
 import json
 import os
+import sys
 
 from textwrap import TextWrapper
 
@@ -244,6 +245,228 @@ def get_class_source(class_name):
     return '\n'.join(lines)
 
 
+
+lazy_class_template = '''
+
+def _compile(name):
+    args, code = _METHODS[name]
+    source = 'def %%s(%%s):\\n    %%s\\n' %% (name, args,
+                                          code.replace('\\n', '\\n    '))
+    ctx = {}
+    exec(compile(source, '<%(class_name)s.%%s>' %% name, 'exec'), ctx)
+    return ctx[name]
+
+
+class _LazyMethod(object):
+    """
+    Stands for a method of %(class_name)s: compiles it on first access and
+    puts it on the class in its place
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, cls=None):
+        method = _compile(self.name)
+        setattr(%(class_name)s, self.name, method)
+        return method.__get__(obj, cls)
+
+
+class %(class_name)s(object):
+    """
+    Redis commands compiled from _METHODS on first use and then cached
+    on the class
+    """
+
+
+for _name in _METHODS:
+    setattr(%(class_name)s, _name, _LazyMethod(_name))
+'''
+
+
+def get_lazy_class_source(class_name):
+    """
+    Compact alternative to get_class_source: method signatures and bodies
+    are kept as a table of strings, without docstrings, and compiled when
+    a command is first used
+    """
+    lines = ['# Generated by gen_commands.py --lazy from commands.json', '',
+             '# method name: (arguments, code)', '_METHODS = {']
+    for cmd, params in sorted(get_commands().items()):
+        name = get_command_name(cmd)
+        args, doc, code = parse_arguments(cmd, params.get('arguments', []))
+        lines.append('    %s: (%s, %s),' % (repr(str(name)),
+                                            repr(str(', '.join(args))),
+                                            repr(str('\n'.join(code)))))
+    lines.append('}')
+    return '\n'.join(lines) + '\n' + lazy_class_template % {
+        'class_name': class_name}
+
+# Commands which only read data, commands.json has no such flag
+readonly_commands = set([
+    'BITCOUNT', 'DUMP', 'EXISTS', 'GET', 'GETBIT', 'GETRANGE', 'HEXISTS',
+    'HGET', 'HGETALL', 'HKEYS', 'HLEN', 'HMGET', 'HSCAN', 'HVALS', 'KEYS',
+    'LINDEX', 'LLEN', 'LRANGE', 'MGET', 'OBJECT', 'PTTL', 'RANDOMKEY',
+    'SCAN', 'SCARD', 'SDIFF', 'SINTER', 'SISMEMBER', 'SMEMBERS',
+    'SRANDMEMBER', 'SSCAN', 'STRLEN', 'SUNION', 'TTL', 'TYPE', 'ZCARD',
+    'ZCOUNT', 'ZRANGE', 'ZRANGEBYSCORE', 'ZRANK', 'ZREVRANGE',
+    'ZREVRANGEBYSCORE', 'ZREVRANK', 'ZSCAN', 'ZSCORE',
+])
+
+
+# Commands which are safe to repeat, besides read-only ones
+idempotent_commands = set([
+    'CLIENT GETNAME', 'CLIENT LIST', 'CONFIG GET', 'DBSIZE', 'DEL', 'ECHO',
+    'EXPIREAT', 'FLUSHALL', 'FLUSHDB', 'HDEL', 'HMSET', 'HSET', 'INFO',
+    'LASTSAVE', 'LSET', 'MSET', 'PERSIST', 'PEXPIREAT', 'PING', 'PSETEX',
+    'PUBSUB', 'SADD', 'SCRIPT EXISTS', 'SCRIPT LOAD', 'SELECT', 'SET',
+    'SETBIT', 'SETEX', 'SETRANGE', 'SREM', 'TIME', 'ZADD', 'ZREM',
+])
+
+admin_commands = set([
+    'BGREWRITEAOF', 'BGSAVE', 'CLIENT KILL', 'CLIENT LIST',
+    'CONFIG GET', 'CONFIG RESETSTAT', 'CONFIG SET', 'DEBUG OBJECT',
+    'DEBUG SEGFAULT', 'MONITOR', 'SAVE', 'SCRIPT KILL', 'SHUTDOWN',
+    'SLAVEOF', 'SLOWLOG', 'SYNC',
+])
+
+# Commands which change state of the connection they are sent over
+stateful_commands = set([
+    'AUTH', 'DISCARD', 'EXEC', 'MONITOR', 'MULTI', 'PSUBSCRIBE',
+    'PUNSUBSCRIBE', 'QUIT', 'SELECT', 'SUBSCRIBE', 'SYNC', 'UNSUBSCRIBE',
+    'UNWATCH', 'WATCH',
+])
+
+data_groups = set(['generic', 'hash', 'list', 'set', 'sorted_set', 'string'])
+
+write_commands = set(['EVAL', 'EVALSHA', 'FLUSHALL', 'FLUSHDB'])
+
+# Bit values of flags in COMMANDS, in order
+flag_names = ['READONLY', 'WRITE', 'BLOCKING', 'PUBSUB', 'ADMIN',
+              'IDEMPOTENT', 'STATEFUL']
+
+
+def is_blocking(params):
+    arguments = params.get('arguments', [])
+    return (params['group'] == 'list' and
+            any(arg['name'] == 'timeout' for arg in arguments))
+
+
+def get_flags(command, params):
+    """
+    Return names of flags of the command
+    """
+    readonly = command in readonly_commands
+    flags = {
+        'READONLY': readonly,
+        'WRITE': not readonly and (params['group'] in data_groups or
+                                   command in write_commands),
+        'BLOCKING': is_blocking(params),
+        'PUBSUB': params['group'] == 'pubsub',
+        'ADMIN': command in admin_commands,
+        'IDEMPOTENT': readonly or command in idempotent_commands,
+        'STATEFUL': command in stateful_commands,
+    }
+    return [name for name in flag_names if flags[name]]
+
+
+def get_key_spec(command, params):
+    """
+    Return (first, last, step, numkeys, keyword) positions of keys in the
+    argument list sent to redis, the command name included. Negative last
+    counts from the end, numkeys is the position of the number of keys
+    which follow it, keyword is the option followed by a key, like STORE
+    of SORT. None if command has no keys.
+    """
+    # Keys commands.json does not describe
+    if command == 'OBJECT':
+        # OBJECT ENCODING key
+        return 2, 2, 1, 0, ''
+    if command == 'PUBLISH':
+        # Channel routes PUBLISH to one node, as a key
+        return 1, 1, 1, 0, ''
+
+    pos = len(command.split(' '))
+    first = last = numkeys = 0
+    step = 1
+    keyword = ''
+    arguments = params.get('arguments', [])
+    for arg in arguments:
+        if arg.get('command') and arg['type'] == 'key':
+            keyword = arg['command']
+    for idx, arg in enumerate(arguments):
+        types = arg['type'] if isinstance(arg['type'], list) else [arg['type']]
+        if arg['name'] == 'numkeys':
+            numkeys = pos
+            break
+        if 'optional' in arg or 'variadic' in arg or 'command' in arg:
+            break
+        if arg.get('multiple'):
+            if 'key' in types:
+                if first and last != pos - 1:
+                    raise Exception('Keys of %s are not adjacent' % command)
+                first = first or pos
+                step = len(types)
+                fixed = [a for a in arguments[idx + 1:]
+                         if not (a.get('optional') or a.get('multiple'))]
+                last = -1 - len(fixed)
+            break
+        if 'key' in types:
+            if first and last != pos - 1:
+                raise Exception('Keys of %s are not adjacent' % command)
+            first = first or pos
+            last = pos
+        pos += 1
+
+    if not first and not numkeys and not keyword:
+        return None
+    return first, last, step, numkeys, keyword
+
+
+def get_metadata_source():
+    commands = get_commands()
+
+    for name, known in (('read-only', readonly_commands),
+                        ('idempotent', idempotent_commands),
+                        ('admin', admin_commands),
+                        ('stateful', stateful_commands),
+                        ('write', write_commands)):
+        unknown = known - set(commands)
+        if unknown:
+            raise Exception('Unknown %s commands: %s' % (name,
+                                                         sorted(unknown)))
+
+    lines = ['# Generated by gen_commands.py from commands.json', '']
+    for bit, name in enumerate(flag_names):
+        lines.append('%s = %d' % (name, 1 << bit))
+    lines.append('')
+    lines.append('# name: (flags, first, last, step, numkeys, keyword), key '
+                 'positions')
+    lines.append('# are described in toredis.keys.get_keys')
+    lines.append('COMMANDS = {')
+    for cmd, params in sorted(commands.items()):
+        flags = ' | '.join(get_flags(cmd, params)) or '0'
+        spec = get_key_spec(cmd, params) or (0, 0, 1, 0, '')
+        lines.append('    "%s": (%s, %d, %d, %d, %d, "%s"),' % (
+            (cmd, flags) + spec))
+    lines.append('}')
+    lines.append('')
+    lines.append('')
+    lines.append('def _with_flags(flags):')
+    lines.append('    return frozenset(cmd for cmd, info in COMMANDS.items()')
+    lines.append('                     if info[0] & flags == flags)')
+    lines.append('')
+    lines.append('')
+    for name in flag_names:
+        lines.append('%s_COMMANDS = _with_flags(%s)' % (name, name))
+    lines.append('SUBSCRIBE_COMMANDS = _with_flags(PUBSUB | STATEFUL)')
+    lines.append('')
+    lines.append('KEY_SPECS = dict((cmd, info[1:]) for cmd, info in '
+                 'COMMANDS.items()')
+    lines.append('                 if info[1] or info[4] or info[5])')
+    lines.append('')
+    return '\n'.join(lines)
+
+
 def compile_commands():
     ret = {}
     for cmd, params in sorted(get_commands().items()):
@@ -251,12 +474,18 @@ def compile_commands():
         lines = get_command_code(name, cmd, params)
         code = compile('\n'.join(lines), "<string>", "exec")
         ctx = {}
-        exec code in ctx
+        exec(code, ctx)
         ret[name] = ctx[name]
     return ret
 
 
 if __name__ == "__main__":
     with open(os.path.join(os.path.dirname(__file__), 'toredis/commands.py'), 'w') as f:
-        f.write(get_class_source('RedisCommandsMixin'))
-        print 'Generated commands.py'
+        if '--lazy' in sys.argv[1:]:
+            f.write(get_lazy_class_source('RedisCommandsMixin'))
+        else:
+            f.write(get_class_source('RedisCommandsMixin'))
+        print('Generated commands.py')
+    with open(os.path.join(os.path.dirname(__file__), 'toredis/metadata.py'), 'w') as f:
+        f.write(get_metadata_source())
+        print('Generated metadata.py')
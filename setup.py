@@ -31,4 +31,7 @@ setup(
     packages=['toredis'],
     test_suite='tests.all_tests',
     install_requires=['tornado', 'hiredis'],
+    entry_points={
+        'console_scripts': ['toredis-bench = toredis.bench:main'],
+    },
 )
@@ -3,11 +3,37 @@ import unittest
 from tests.test_client import TestClient
 from tests.test_handler import TestRedis
 from tests.test_pool import TestPool
+from tests.test_metrics import TestMetrics
+from tests.test_loops import TestLoopPool
+from tests.test_nodes import TestRings, TestNodes
+from tests.test_migration import TestMigration
+from tests.test_replicas import TestReplicaSet
+from tests.test_cluster import TestSlots, TestCluster
+from tests.test_backup import TestBackup
+from tests.test_chunks import TestLargeValues
+from tests.test_compression import TestCompressor
+from tests.test_serializers import TestSerialization
+from tests.test_bench import TestBench
+from tests.test_fakeserver import TestFakeServer
+from tests.test_commands import TestLazyCommands
 
 TEST_MODULES = [
     "test_client",
     "test_handler",
     "test_pool",
+    "test_metrics",
+    "test_loops",
+    "test_nodes",
+    "test_migration",
+    "test_replicas",
+    "test_cluster",
+    "test_backup",
+    "test_chunks",
+    "test_compression",
+    "test_serializers",
+    "test_bench",
+    "test_fakeserver",
+    "test_commands",
 ]
 
 def all_tests():
@@ -15,4 +41,19 @@ def all_tests():
     suite.addTest(unittest.makeSuite(TestClient))
     suite.addTest(unittest.makeSuite(TestRedis))
     suite.addTest(unittest.makeSuite(TestPool))
+    suite.addTest(unittest.makeSuite(TestMetrics))
+    suite.addTest(unittest.makeSuite(TestLoopPool))
+    suite.addTest(unittest.makeSuite(TestRings))
+    suite.addTest(unittest.makeSuite(TestNodes))
+    suite.addTest(unittest.makeSuite(TestMigration))
+    suite.addTest(unittest.makeSuite(TestReplicaSet))
+    suite.addTest(unittest.makeSuite(TestSlots))
+    suite.addTest(unittest.makeSuite(TestCluster))
+    suite.addTest(unittest.makeSuite(TestBackup))
+    suite.addTest(unittest.makeSuite(TestLargeValues))
+    suite.addTest(unittest.makeSuite(TestCompressor))
+    suite.addTest(unittest.makeSuite(TestSerialization))
+    suite.addTest(unittest.makeSuite(TestBench))
+    suite.addTest(unittest.makeSuite(TestFakeServer))
+    suite.addTest(unittest.makeSuite(TestLazyCommands))
     return suite
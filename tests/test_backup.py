@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import zlib
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncTestCase, gen_test
+
+from toredis.backup import (CHUNK_SIZE, Exporter, Importer, _Writer,
+                            _inflate_chunks, read_records)
+from toredis.client import ClientPool
+
+
+class TestBackup(AsyncTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()  # the default Client loop
+
+    def setUp(self):
+        super(TestBackup, self).setUp()
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(TestBackup, self).tearDown()
+
+    @gen.coroutine
+    def export_and_import(self, compress):
+        pool = ClientPool()
+        values = dict(('backup:%d' % i, 'value %d' % i) for i in range(50))
+        yield gen.Task(pool.mset, values)
+
+        path = os.path.join(self.path, 'backup.dump')
+        stats = yield gen.Task(Exporter(pool, path, match='backup:*', count=7,
+                                        compress=compress).start)
+        self.assertEqual(stats['exported'], 50)
+        self.assertEqual(stats['errors'], 0)
+        self.assertEqual(sorted(key for key, ttl, data in read_records(path)),
+                         sorted(key.encode() for key in values))
+
+        yield gen.Task(pool.delete, list(values))
+        stats = yield gen.Task(Importer(pool, path, window=10).start)
+        self.assertEqual(stats, {'restored': 50, 'skipped': 0, 'errors': 0})
+
+        result = yield gen.Task(pool.mget, sorted(values))
+        self.assertEqual(result, [values[key].encode()
+                                  for key in sorted(values)])
+        yield gen.Task(pool.delete, list(values))
+
+    @gen_test
+    def test_export_import(self):
+        yield self.export_and_import(False)
+
+    @gen_test
+    def test_export_import_compressed(self):
+        yield self.export_and_import(True)
+
+    def test_truncated_file(self):
+        path = os.path.join(self.path, 'broken.dump')
+        with open(path, 'wb') as f:
+            f.write(b'TRDB')
+        with self.assertRaises(ValueError):
+            list(read_records(path))
+
+    @gen_test
+    def test_import_broken_file(self):
+        pool = ClientPool()
+        path = os.path.join(self.path, 'backup.dump')
+        yield gen.Task(pool.set, 'backup:broken', 'value')
+        yield gen.Task(Exporter(pool, path, match='backup:broken').start)
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:-1])
+
+        importer = Importer(pool, path, replace=True)
+        stats = yield gen.Task(importer.start)
+        self.assertEqual(stats, {'restored': 0, 'skipped': 0, 'errors': 1})
+        self.assertTrue(isinstance(importer.error, ValueError))
+        yield gen.Task(pool.delete, 'backup:broken')
+
+    def test_large_records(self):
+        records = [(b'small', 0, b'x'), (b'large', 100, b'y' * 3000000),
+                   (b'last', 0, b'z')]
+        for compress in (False, True):
+            path = os.path.join(self.path, 'large.dump')
+            writer = _Writer(open(path, 'wb'), compress)
+            for key, ttl, data in records:
+                writer.write(key, ttl, data)
+            writer.close()
+            self.assertEqual(list(read_records(path)), records)
+
+    def test_bounded_inflate(self):
+        data = zlib.compress(b'\0' * (64 * CHUNK_SIZE))
+        chunks = list(_inflate_chunks(data, 0))
+        self.assertEqual(max(len(chunk) for chunk in chunks), CHUNK_SIZE)
+        self.assertEqual(sum(len(chunk) for chunk in chunks), 64 * CHUNK_SIZE)
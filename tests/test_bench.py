@@ -0,0 +1,63 @@
+from collections import Counter
+from unittest import TestCase
+
+from tornado import stack_context
+
+from toredis import bench
+
+
+class TestBench(TestCase):
+
+    def test_key_distribution(self):
+        uniform = bench.KeyGenerator(1000, seed=1, sample_size=10000)
+        zipf = bench.KeyGenerator(1000, 'zipf', seed=1, sample_size=10000)
+        uniform_counts = Counter(uniform.next() for _ in range(10000))
+        zipf_counts = Counter(zipf.next() for _ in range(10000))
+        self.assertTrue(uniform_counts.most_common(1)[0][1] < 40)
+        # The hottest key gets about 1 / H(1000) of requests
+        self.assertTrue(zipf_counts.most_common(1)[0][1] > 800)
+        self.assertTrue(zipf.next('hash:').startswith('hash:'))
+
+    def test_parse_mix(self):
+        self.assertEqual(bench.parse_mix('get:80, SET:20,ping'),
+                         [('get', 80.0), ('set', 20.0), ('ping', 1.0)])
+        self.assertRaises(ValueError, bench.parse_mix, 'get,flushall')
+
+    def test_run_fake(self):
+        for target in ['client', 'pool', 'nodes']:
+            options = bench.get_parser().parse_args([
+                '--fake', '--target', target, '-n', '500', '-c', '5',
+                '-P', '3', '-r', '100', '--distribution', 'zipf',
+                '-t', 'get,set,incr,hset,hget,lpush,rpop,sadd,zadd,mget,mset,'
+                'del,ping'])
+            result = bench.run(options)
+            self.assertEqual(result['errors'], 0)
+            self.assertEqual(result['requests'], 500)
+            self.assertTrue(result['ops_per_sec'] > 0)
+            self.assertTrue(result['p50_ms'] <= result['p99_ms'] <=
+                            result['p999_ms'])
+
+    def test_context_depth(self):
+        depths = []
+
+        def probe(target, keys, value, callback):
+            # Length of the chain of exception contexts
+            depth = 0
+            head = stack_context._state.contexts[1]
+            while head is not None:
+                depth += 1
+                head = head.old_contexts[1]
+            depths.append(depth)
+            target.ping(callback=callback)
+
+        bench.COMMANDS['probe'] = probe
+        try:
+            options = bench.get_parser().parse_args([
+                '--fake', '--target', 'client', '-n', '400', '-c', '2',
+                '-t', 'probe'])
+            result = bench.run(options)
+        finally:
+            del bench.COMMANDS['probe']
+        self.assertEqual(result['errors'], 0)
+        # Every batch runs in its own context only
+        self.assertEqual(max(depths), min(depths))
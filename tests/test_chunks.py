@@ -0,0 +1,104 @@
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from toredis.chunks import LargeValues, _get_manifest
+from toredis.client import ClientPool
+from toredis.fakeserver import FakeServer
+from toredis.serializers import Serialization
+
+
+class TestLargeValues(AsyncTestCase):
+
+    def setUp(self):
+        super(TestLargeValues, self).setUp()
+        self.server = FakeServer(io_loop=self.io_loop)
+        self.port = self.server.bind_unused_port()
+
+    def tearDown(self):
+        self.server.stop()
+        super(TestLargeValues, self).tearDown()
+
+    def get_values(self, **kwargs):
+        pool = ClientPool(io_loop=self.io_loop, port=self.port, **kwargs)
+        return pool, LargeValues(pool, threshold=100, chunk_size=30)
+
+    @gen_test
+    def test_set_get(self):
+        pool, values = self.get_values()
+        data = b''.join(str(i).encode() for i in range(100))
+
+        result = yield gen.Task(values.set, 'large', data)
+        self.assertEqual(result, b'OK')
+        value = yield gen.Task(values.get, 'large')
+        self.assertEqual(bytes(value), data)
+
+        manifest = yield gen.Task(pool.get, 'large')
+        length, count, token = _get_manifest(manifest)
+        self.assertEqual((length, count), (len(data), 7))
+        chunk_keys = values._chunk_keys('large', count, token)
+
+        # Small values are stored as is, old chunks are removed
+        result = yield gen.Task(values.set, 'large', 'small', expire=10)
+        self.assertEqual(result, b'OK')
+        exists = yield gen.Task(pool.exists, chunk_keys[0])
+        self.assertEqual(exists, 0)
+        value = yield gen.Task(pool.get, 'large')
+        self.assertEqual(value, b'small')
+        value = yield gen.Task(values.get, 'large')
+        self.assertEqual(value, b'small')
+
+        yield gen.Task(values.delete, 'large')
+        value = yield gen.Task(values.get, 'large')
+        self.assertEqual(value, None)
+
+    @gen_test
+    def test_sink(self):
+        pool, values = self.get_values()
+        data = b'x' * 250
+        yield gen.Task(values.set, 'large', data, expire=10)
+
+        pieces = []
+        length = yield gen.Task(values.get, 'large', sink=pieces.append)
+        self.assertEqual(length, 250)
+        self.assertEqual([len(piece) for piece in pieces], [30] * 8 + [10])
+        self.assertEqual(b''.join(pieces), data)
+        yield gen.Task(values.delete, 'large')
+
+    @gen_test
+    def test_concurrent_sets(self):
+        pool, values = self.get_values()
+        other = LargeValues(ClientPool(io_loop=self.io_loop, port=self.port),
+                            threshold=100, chunk_size=30)
+        yield [gen.Task(values.set, 'large', b'a' * 200),
+               gen.Task(other.set, 'large', b'b' * 300),
+               gen.Task(values.set, 'large', b'c' * 250)]
+
+        # Only chunks of the value written last are left
+        length, count, token = _get_manifest(
+            self.server.databases[0][b'large'])
+        self.assertEqual(
+            sorted(self.server.databases[0]),
+            sorted([b'large'] + values._chunk_keys('large', count, token)))
+        value = yield gen.Task(values.get, 'large')
+        self.assertEqual(len(value), length)
+
+        deleted = yield gen.Task(other.delete, 'large')
+        self.assertEqual(deleted, count + 1)
+        self.assertEqual(self.server.databases[0], {})
+
+    @gen_test
+    def test_serializer(self):
+        pool, values = self.get_values(serializer=Serialization())
+        data = b'[1]' * 50
+        yield gen.Task(values.set, 'large', data)
+        value = yield gen.Task(values.get, 'large')
+        self.assertEqual(bytes(value), data)
+        yield gen.Task(values.set, 'small', b'[1]')
+        value = yield gen.Task(values.get, 'small')
+        self.assertEqual(value, b'[1]')
+        self.assertEqual(self.server.databases[0][b'small'], b'[1]')
+
+        # Old chunks are found and removed on overwrite
+        yield gen.Task(values.set, 'large', b'small')
+        self.assertEqual(sorted(self.server.databases[0]),
+                         [b'large', b'small'])
@@ -121,3 +121,20 @@ class TestClient(AsyncTestCase):
         client.close()
         with self.assertRaises(IOError):
             client._stream.read_bytes(1024, lambda x: x)
+
+    def test_bulk_load(self):
+        client = Client(io_loop=self.io_loop)
+        client.connect()
+
+        def commands():
+            for i in range(1000):
+                if i == 500:
+                    yield ["NOSUCHCOMMAND"]
+                yield ["SET", "bulk:%d" % i, i]
+
+        client.bulk_load(commands(), self.stop, window=100, chunk_size=30)
+        result = self.wait()
+        self.assertEqual(result["sent"], 1001)
+        self.assertEqual(result["replies"], 1001)
+        self.assertEqual([idx for idx, error in result["errors"]], [500])
+        self.assertEqual(len(client.callbacks), 0)
@@ -0,0 +1,107 @@
+from unittest import TestCase
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from toredis.cluster import RedisCluster, crc16, key_slot
+from toredis.fakeserver import FakeServer, Redirect, Reply
+
+
+class TestSlots(TestCase):
+
+    def test_key_slot(self):
+        self.assertEqual(crc16(b'123456789'), 0x31c3)
+        self.assertEqual(key_slot('foo'), 12182)
+        self.assertEqual(key_slot('user:{foo}:profile'), 12182)
+
+
+class TestCluster(AsyncTestCase):
+
+    def setUp(self):
+        super(TestCluster, self).setUp()
+        # node1 serves slots 0-8191, node2 serves 8192-16383
+        self.node1 = FakeServer(io_loop=self.io_loop)
+        self.node2 = FakeServer(io_loop=self.io_loop)
+        self.node1.bind_unused_port()
+        self.node2.bind_unused_port()
+        self.slots = [[0, 8191, [b'127.0.0.1', self.node1.port]],
+                      [8192, 16383, [b'127.0.0.1', self.node2.port]]]
+        self.node1.cluster_slots = self.node2.cluster_slots = self.slots
+        self.cluster = RedisCluster([('127.0.0.1', self.node1.port)],
+                                    io_loop=self.io_loop)
+
+    def tearDown(self):
+        self.node1.stop()
+        self.node2.stop()
+        super(TestCluster, self).tearDown()
+
+    @gen_test
+    def test_moved(self):
+        # node1 reports stale map with all slots on itself first
+        self.node1.add_fault(Reply(
+            [[0, 16383, [b'127.0.0.1', self.node1.port]]],
+            command='CLUSTER', times=1))
+        # slot 12182 of 'foo' belongs to node2
+        self.node1.add_fault(Redirect('MOVED', self.node2.port, key='foo'))
+        result = yield gen.Task(self.cluster.set, 'foo', 'bar')
+        self.assertEqual(result, b'OK')
+        self.assertEqual(self.node2.databases[0], {b'foo': b'bar'})
+        self.assertEqual(self.cluster.get_addr(12182),
+                         ('127.0.0.1', self.node2.port))
+
+        processed = self.node2.commands_processed
+        value = yield gen.Task(self.cluster.get, 'foo')
+        self.assertEqual(value, b'bar')
+        self.assertEqual(self.node2.commands_processed, processed + 1)
+
+    @gen_test
+    def test_ask(self):
+        # slot 5061 of 'bar' belongs to node1, which is migrating it to
+        # node2
+        self.node1.add_fault(Redirect('ASK', self.node2.port, key='bar'))
+        self.node2.add_fault(Redirect('MOVED', self.node1.port, key='bar',
+                                      unless_asking=True))
+
+        result = yield gen.Task(self.cluster.set, 'bar', 'value')
+        self.assertEqual(result, b'OK')
+        self.assertEqual(self.node2.databases[0], {b'bar': b'value'})
+        # ASK does not change slot map
+        self.assertEqual(self.cluster.get_addr(key_slot('bar')),
+                         ('127.0.0.1', self.node1.port))
+
+    @gen_test
+    def test_pipeline(self):
+        replies = yield gen.Task(self.cluster.send_pipeline, [
+            ['SET', 'foo', 1], ['SET', 'bar', 2], ['GET', 'foo'],
+            ['GET', 'bar']])
+        self.assertEqual(replies, [b'OK', b'OK', b'1', b'2'])
+        self.assertEqual(self.node1.databases[0], {b'bar': b'2'})
+        self.assertEqual(self.node2.databases[0], {b'foo': b'1'})
+
+    @gen_test
+    def test_blocking(self):
+        server, other = self.node1, self.node2
+        port = server.port
+        for node in (server, other):
+            node.cluster_slots = [[0, 16383, [b'127.0.0.1', port]]]
+        cluster = RedisCluster([('127.0.0.1', port)], io_loop=self.io_loop)
+        yield gen.Task(cluster.set, 'key', 'value')
+
+        # BLPOP waits on a connection of its own, GET is not delayed
+        popped = []
+        cluster.blpop('queue', 1, callback=popped.append)
+        value = yield gen.Task(cluster.get, 'key')
+        self.assertEqual(value, b'value')
+        self.assertEqual(popped, [])
+        yield gen.Task(cluster.rpush, 'queue', 'item')
+        yield gen.sleep(0.01)
+        self.assertEqual(popped, [[b'queue', b'item']])
+
+        # After ASK blocking commands also go with ASKING
+        server.add_fault(Redirect('ASK', other.port, key='asked'))
+        other.add_fault(Redirect('MOVED', port, key='asked',
+                                 unless_asking=True))
+        value = yield gen.Task(cluster.brpop, 'asked', 0.01)
+        self.assertEqual(value, None)
+        pool = cluster.get_pool(('127.0.0.1', other.port))
+        self.assertEqual(len(pool._blocking_clients), 1)
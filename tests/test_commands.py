@@ -0,0 +1,84 @@
+import sys
+import types
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+
+import gen_commands
+import toredis.client
+from toredis.fakeserver import FakeServer
+
+
+def load_lazy_client():
+    """
+    Return toredis.client module built on top of commands.py generated by
+    gen_commands.py --lazy
+    """
+    commands = types.ModuleType('toredis.commands')
+    exec(gen_commands.get_lazy_class_source('RedisCommandsMixin'),
+         commands.__dict__)
+    module = types.ModuleType('lazy_client')
+    module.__file__ = toredis.client.__file__
+    with open(toredis.client.__file__) as f:
+        code = compile(f.read(), module.__file__, 'exec')
+    saved = sys.modules['toredis.commands']
+    sys.modules['toredis.commands'] = commands
+    try:
+        exec(code, module.__dict__)
+    finally:
+        sys.modules['toredis.commands'] = saved
+    return module
+
+
+class TestLazyCommands(AsyncTestCase):
+
+    def setUp(self):
+        super(TestLazyCommands, self).setUp()
+        self.server = FakeServer(io_loop=self.io_loop)
+        self.port = self.server.bind_unused_port()
+        self.client_module = load_lazy_client()
+
+    def tearDown(self):
+        self.server.stop()
+        super(TestLazyCommands, self).tearDown()
+
+    @gen_test
+    def test_commands(self):
+        Client = self.client_module.Client
+        mixin = self.client_module.RedisCommandsMixin
+        self.assertEqual(type(mixin.__dict__['get']).__name__, '_LazyMethod')
+
+        client = Client(io_loop=self.io_loop)
+        yield gen.Task(client.connect, port=self.port)
+        yield gen.Task(client.set, 'key', 'value')
+        value = yield gen.Task(client.get, 'key')
+        self.assertEqual(value, b'value')
+        # Compiled method replaces the stub on the mixin
+        self.assertEqual(type(mixin.__dict__['get']), types.FunctionType)
+        self.assertTrue('hgetall' in dir(client))
+
+    @gen_test
+    def test_subscribe(self):
+        Client = self.client_module.Client
+        subscriber = Client(io_loop=self.io_loop)
+        yield gen.Task(subscriber.connect, port=self.port)
+        publisher = Client(io_loop=self.io_loop)
+        yield gen.Task(publisher.connect, port=self.port)
+        messages = []
+        received = Future()
+
+        def on_message(msg):
+            messages.append(msg)
+            if msg[0] == b'message':
+                received.set_result(None)
+
+        # Client.subscribe and psubscribe call the mixin through super()
+        subscriber.subscribe('news', callback=on_message)
+        subscriber.psubscribe('new*', callback=on_message)
+        yield gen.Task(publisher.ping)
+        yield gen.Task(publisher.publish, 'news', 'hello')
+        yield received
+        self.assertEqual(messages[:2], [[b'subscribe', b'news', 1],
+                                        [b'psubscribe', b'new*', 2]])
+        self.assertTrue([b'message', b'news', b'hello'] in messages)
@@ -0,0 +1,92 @@
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from toredis.client import ClientPool
+from toredis.compression import Compressor, Policy, MAGIC
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
+
+class TestCompressor(AsyncTestCase):
+
+    def get_pools(self, **kwargs):
+        compressor = Compressor(policies=[('plain:*', None)],
+                                default=Policy(threshold=100), **kwargs)
+        return (ClientPool(io_loop=self.io_loop, codec=compressor),
+                ClientPool(io_loop=self.io_loop))
+
+    @gen_test
+    def test_round_trip(self):
+        pool, raw = self.get_pools()
+        data = b'abc' * 100
+
+        yield gen.Task(pool.set, 'compressed', data)
+        yield gen.Task(pool.set, 'small', b'abc')
+        yield gen.Task(pool.set, 'plain:large', data)
+        yield gen.Task(pool.set, 'escaped', MAGIC + b'abc')
+
+        value = yield gen.Task(raw.get, 'compressed')
+        self.assertEqual(value[:2], MAGIC + b'\x01')
+        self.assertTrue(len(value) < len(data))
+        value = yield gen.Task(raw.get, 'plain:large')
+        self.assertEqual(value, data)
+        value = yield gen.Task(raw.get, 'escaped')
+        self.assertEqual(value, MAGIC + b'\x00' + MAGIC + b'abc')
+
+        value = yield gen.Task(pool.get, 'compressed')
+        self.assertEqual(value, data)
+        values = yield gen.Task(pool.mget, ['compressed', 'small',
+                                            'plain:large', 'escaped',
+                                            'missing'])
+        self.assertEqual(values, [data, b'abc', data, MAGIC + b'abc', None])
+
+        stats = pool.codec.snapshot()
+        self.assertEqual(stats['compressed'], 1)
+        self.assertEqual(stats['decompressed'], 2)
+        self.assertTrue(stats['ratio'] < 0.5)
+        yield gen.Task(pool.delete, ['compressed', 'small', 'plain:large',
+                                     'escaped'])
+
+    def test_incompressible(self):
+        compressor = Compressor(default=Policy(threshold=10))
+        value = bytes(bytearray(range(256)))
+        self.assertEqual(compressor.encode(['SET', 'key', value]),
+                         ['SET', 'key', value])
+        self.assertEqual(compressor.snapshot()['stored_plain'], 1)
+
+    def test_decode_replies(self):
+        compressor = Compressor(default=Policy(threshold=10))
+        args = compressor.encode(['HMSET', 'hash', 'f1', b'x' * 50,
+                                  'f2', b'y'])
+        replies = []
+        callback = compressor.wrap_callback(['HGETALL', 'hash'],
+                                            replies.append)
+        callback([b'f1', args[3], b'f2', args[5]])
+        self.assertEqual(replies, [[b'f1', b'x' * 50, b'f2', b'y']])
+
+    def test_foreign_values(self):
+        compressor = Compressor()
+        # Values written by other clients which start with the marker
+        for value in [b'\xff', b'\xff\xfe', b'']:
+            self.assertEqual(compressor.decode_value(value), value)
+
+    @gen_test
+    def test_offload(self):
+        if ThreadPoolExecutor is None:
+            self.skipTest('concurrent.futures is not available')
+        executor = ThreadPoolExecutor(2)
+        pool, raw = self.get_pools(executor=executor, offload_threshold=1000)
+        data = b'abc' * 1000
+
+        replies = yield gen.Task(pool.send_pipeline,
+                                 [['SET', 'offloaded', data],
+                                  ['GET', 'offloaded']])
+        self.assertEqual(replies, [b'OK', data])
+        value = yield gen.Task(raw.get, 'offloaded')
+        self.assertEqual(value[:2], MAGIC + b'\x01')
+        self.assertEqual(pool.codec.stats['compressed'], 1)
+        yield gen.Task(pool.delete, 'offloaded')
+        executor.shutdown()
@@ -0,0 +1,197 @@
+import time
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+
+from toredis.client import Client, ClientPool
+from toredis.cluster import RedisCluster, key_slot
+from toredis.fakeserver import (FakeServer, Fault, Delay, Drop,
+                                SplitWrite, Oversized, Redirect, Reply)
+
+
+class TestFakeServer(AsyncTestCase):
+
+    def setUp(self):
+        super(TestFakeServer, self).setUp()
+        self.server = FakeServer(io_loop=self.io_loop)
+        self.port = self.server.bind_unused_port()
+        self.pool = ClientPool(port=self.port, io_loop=self.io_loop)
+
+    def tearDown(self):
+        self.server.stop()
+        super(TestFakeServer, self).tearDown()
+
+    @gen_test
+    def test_data_types(self):
+        pool = self.pool
+        replies = yield gen.Task(pool.send_pipeline, [
+            ['RPUSH', 'list', 'a', 'b', 'c'],
+            ['LPOP', 'list'],
+            ['LRANGE', 'list', 0, -1],
+            ['SADD', 'set', 'x', 'y', 'x'],
+            ['SMEMBERS', 'set'],
+            ['ZADD', 'zset', 2, 'two', 1, 'one', 1.5, 'half'],
+            ['ZRANGE', 'zset', 0, -1, 'WITHSCORES'],
+            ['ZRANGEBYSCORE', 'zset', '(1', '+inf'],
+            ['HSET', 'hash', 'field', 'value'],
+            ['HGETALL', 'hash'],
+            ['GET', 'hash'],
+            ['TYPE', 'zset'],
+        ])
+        self.assertEqual(replies[:5], [3, b'a', [b'b', b'c'], 2,
+                                       [b'x', b'y']])
+        self.assertEqual(replies[5:8], [
+            3, [b'one', b'1', b'half', b'1.5', b'two', b'2'],
+            [b'half', b'two']])
+        self.assertEqual(replies[8:10], [1, [b'field', b'value']])
+        self.assertTrue(str(replies[10]).startswith('WRONGTYPE'))
+        self.assertEqual(replies[11], b'zset')
+
+        replies = yield gen.Task(pool.send_pipeline, [
+            ['MULTI'], ['INCR', 'counter'], ['INCR', 'counter'], ['EXEC']])
+        self.assertEqual(replies, [b'OK', b'QUEUED', b'QUEUED', [1, 2]])
+
+    @gen_test
+    def test_arity(self):
+        self.server.add_fault(Fault(command='GET', times=1))
+        replies = yield gen.Task(self.pool.send_pipeline, [
+            ['SET', 'key', 'value'], ['GET', 'key'], ['GET'],
+            ['GET', 'key', 'other'], ['MSET', 'key'], ['PING', 'a', 'b']])
+        self.assertEqual(replies[:2], [b'OK', b'value'])
+        for reply, name in zip(replies[2:], ['get', 'get', 'mset', 'ping']):
+            self.assertEqual(str(reply), "ERR wrong number of arguments "
+                             "for '%s' command" % name)
+
+    @gen_test
+    def test_scan_while_deleting(self):
+        pool = self.pool
+        keys = ['key:%03d' % idx for idx in range(100)]
+        yield gen.Task(pool.mset, dict((key, 'value') for key in keys))
+        found = set()
+        cursor = 0
+        while True:
+            cursor, batch = yield gen.Task(pool.scan, cursor, count=7)
+            found.update(batch)
+            # Returned keys move away, as during a migration
+            if batch:
+                yield gen.Task(pool.delete, batch)
+            cursor = int(cursor)
+            if not cursor:
+                break
+        self.assertEqual(found, set(key.encode() for key in keys))
+
+    @gen_test
+    def test_dump_restore(self):
+        pool = self.pool
+        yield gen.Task(pool.hmset, 'hash', {'a': '1'})
+        replies = yield gen.Task(pool.send_pipeline, [
+            ['DUMP', 'hash'], ['DUMP', 'missing']])
+        self.assertEqual(replies[1], None)
+        replies = yield gen.Task(pool.send_pipeline, [
+            ['RESTORE', 'hash', 0, replies[0]],
+            ['RESTORE', 'copy', 5000, replies[0]],
+            ['RESTORE', 'copy', 0, b'garbage', 'REPLACE'],
+            ['HGETALL', 'copy'],
+            ['PTTL', 'copy']])
+        self.assertTrue(str(replies[0]).startswith('BUSYKEY'))
+        self.assertEqual(replies[1], b'OK')
+        self.assertTrue(str(replies[2]).startswith('ERR DUMP payload'))
+        self.assertEqual(replies[3], [b'a', b'1'])
+        self.assertTrue(0 < replies[4] <= 5000)
+
+    @gen_test
+    def test_blocking_pop(self):
+        pool = self.pool
+        self.io_loop.call_later(0.05, pool.rpush, 'queue', 'item')
+        value = yield gen.Task(pool.blpop, 'queue', 1)
+        self.assertEqual(value, [b'queue', b'item'])
+        value = yield gen.Task(pool.brpop, 'queue', 0.05)
+        self.assertEqual(value, None)
+
+    @gen_test
+    def test_pubsub(self):
+        subscriber = Client(io_loop=self.io_loop)
+        yield gen.Task(subscriber.connect, port=self.port)
+        messages = []
+        received = Future()
+
+        def on_message(msg):
+            messages.append(msg)
+            if msg[0] == b'message':
+                received.set_result(None)
+
+        subscriber.subscribe('news', callback=on_message)
+        yield gen.Task(self.pool.ping)
+        receivers = yield gen.Task(self.pool.publish, 'news', 'hello')
+        self.assertEqual(receivers, 1)
+        yield received
+        self.assertEqual(messages, [[b'subscribe', b'news', 1],
+                                    [b'message', b'news', b'hello']])
+
+    @gen_test
+    def test_delay(self):
+        self.server.add_fault(Delay(0.1, command='GET', times=1))
+        yield gen.Task(self.pool.set, 'key', 'value')
+        cli = self.pool.get_client()
+        started = time.time()
+        replies = []
+        cli.get('key', callback=replies.append)
+        value = yield gen.Task(cli.ping)
+        # Replies keep their order
+        self.assertEqual(replies, [b'value'])
+        self.assertEqual(value, b'PONG')
+        self.assertTrue(time.time() - started >= 0.1)
+        self.assertEqual(self.server.faults, [])
+
+    @gen_test
+    def test_drop(self):
+        self.server.add_fault(Drop(execute=True, command='SET', times=1))
+        value = yield gen.Task(self.pool.set, 'key', 'value')
+        self.assertEqual(value, None)
+        self.assertEqual(self.pool.metrics.failures, 1)
+        # Next command opens a new connection, the dropped SET did run
+        value = yield gen.Task(self.pool.get, 'key')
+        self.assertEqual(value, b'value')
+
+    @gen_test
+    def test_split_write_and_oversized(self):
+        self.server.add_fault(SplitWrite(chunk_size=2, interval=0,
+                                         command='HGETALL'))
+        self.server.add_fault(Oversized(1024 * 1024, key='big'))
+        self.server.add_fault(Reply(Exception('ERR scripted'),
+                                    command='INCR'))
+        yield gen.Task(self.pool.hmset, 'hash', {'a': '1', 'b': '2'})
+        value = yield gen.Task(self.pool.hgetall, 'hash')
+        self.assertEqual(sorted(value), [b'1', b'2', b'a', b'b'])
+        value = yield gen.Task(self.pool.get, 'big')
+        self.assertEqual(len(value), 1024 * 1024)
+        replies = yield gen.Task(self.pool.send_pipeline, [['INCR', 'n']])
+        self.assertEqual(str(replies[0]), 'ERR scripted')
+
+    @gen_test
+    def test_redirects(self):
+        other = FakeServer(io_loop=self.io_loop)
+        other.bind_unused_port()
+        for server in (self.server, other):
+            server.cluster_slots = [[0, 16383, [b'127.0.0.1', self.port]]]
+        cluster = RedisCluster([('127.0.0.1', self.port)],
+                               io_loop=self.io_loop)
+
+        # Slot of 'moved' is served by the other server
+        self.server.add_fault(Redirect('MOVED', other.port, key='moved'))
+        result = yield gen.Task(cluster.set, 'moved', 'value')
+        self.assertEqual(result, b'OK')
+        self.assertEqual(other.databases[0], {b'moved': b'value'})
+
+        # 'asked' is being migrated: the other server serves it only after
+        # ASKING
+        self.server.add_fault(Redirect('ASK', other.port, key='asked'))
+        other.add_fault(Redirect('MOVED', self.port, key='asked',
+                                 unless_asking=True))
+        result = yield gen.Task(cluster.set, 'asked', 'value')
+        self.assertEqual(result, b'OK')
+        self.assertEqual(other.databases[0][b'asked'], b'value')
+        self.assertEqual(cluster.get_addr(key_slot('asked')),
+                         ('127.0.0.1', self.port))
+        other.stop()
@@ -0,0 +1,38 @@
+import threading
+from unittest import TestCase
+
+from tornado.ioloop import IOLoop
+
+from toredis.loops import LoopPool
+
+
+class TestLoopPool(TestCase):
+
+    def test_pool_per_loop(self):
+        loop1 = IOLoop()
+        loop2 = IOLoop()
+        pool = LoopPool([loop1])
+        self.assertIs(pool.get_pool(loop1), pool.get_pool(loop1))
+        self.assertIsNot(pool.get_pool(loop1), pool.get_pool(loop2))
+        self.assertEqual(len(pool.pools()), 2)
+        pool.remove_pool(loop2)
+        self.assertEqual(pool.pools(), [pool.get_pool(loop1)])
+        loop1.close()
+        loop2.close()
+
+    def test_marshal_from_other_thread(self):
+        io_loop = IOLoop()
+        pool = LoopPool([io_loop])
+        sent = []
+        pool.get_pool(io_loop).send_message = \
+            lambda args, callback: sent.append(args)
+
+        thread = threading.Thread(target=pool.ping)
+        thread.start()
+        thread.join()
+        self.assertEqual(sent, [])
+
+        io_loop.add_callback(io_loop.stop)
+        io_loop.start()
+        self.assertEqual(sent, [['PING']])
+        io_loop.close()
@@ -0,0 +1,25 @@
+from unittest import TestCase
+
+from toredis.metrics import Histogram, Metrics
+from toredis.prometheus import format_metrics
+
+
+class TestMetrics(TestCase):
+
+    def test_histogram(self):
+        hist = Histogram(buckets=(0.001, 0.01, 0.1))
+        for value in (0.0005, 0.005, 0.005, 0.05, 1.0):
+            hist.observe(value)
+        self.assertEqual(hist.counts, [1, 2, 1, 1])
+        self.assertEqual(hist.percentile(50), 0.01)
+        self.assertEqual(hist.percentile(100), float('inf'))
+
+    def test_prometheus_format(self):
+        metrics = Metrics()
+        metrics.bytes_written = 10
+        metrics.observe_latency('GET', 0.002)
+        text = format_metrics({'main': metrics.snapshot()})
+        self.assertIn('toredis_bytes_written_total{source="main"} 10', text)
+        self.assertIn('toredis_command_latency_seconds_count'
+                      '{command="GET",source="main"} 1', text)
+        self.assertIn('le="+Inf"', text)
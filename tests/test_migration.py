@@ -0,0 +1,55 @@
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncTestCase, gen_test
+
+from toredis.fakeserver import FakeServer
+from toredis.migration import Migration
+from toredis.nodes import RedisNodes
+
+
+class TestMigration(AsyncTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()  # the default Client loop
+
+    def setUp(self):
+        super(TestMigration, self).setUp()
+        self.server = FakeServer(io_loop=self.io_loop)
+        self.port = self.server.bind_unused_port()
+
+    def tearDown(self):
+        self.server.stop()
+        self.server.disconnect_all()
+        super(TestMigration, self).tearDown()
+
+    def make_nodes(self, count):
+        return RedisNodes([{'name': 'node%d' % i, 'db': i,
+                            'host': '127.0.0.1', 'port': self.port}
+                           for i in range(count)])
+
+    @gen_test
+    def test_migrate_to_new_node(self):
+        old = self.make_nodes(1)
+        new = self.make_nodes(2)
+
+        keys = ['migrate:%d' % i for i in range(100)]
+        yield gen.Task(old.mset, dict((key, key) for key in keys))
+        yield gen.Task(old.expire, 'migrate:0', 100)
+
+        progress = []
+        migration = Migration(old, new, count=10, on_progress=progress.append)
+        stats = yield gen.Task(migration.start)
+
+        self.assertTrue(migration.finished)
+        self.assertEqual(migration.checkpoint, {'node0': None})
+        self.assertTrue(progress)
+        self.assertEqual(stats['kept'] + stats['moved'], 100)
+        self.assertTrue(stats['moved'] > 0)
+        self.assertEqual(stats['errors'], 0)
+
+        values = yield gen.Task(new.mget, keys)
+        self.assertEqual(values, [key.encode('utf-8') for key in keys])
+        ttl = yield gen.Task(new.ttl, 'migrate:0')
+        self.assertTrue(0 < ttl <= 100)
+        # Moved keys are gone from the source node
+        self.assertEqual(len(self.server.databases[0]), stats['kept'])
@@ -0,0 +1,301 @@
+import time
+import zlib
+from unittest import TestCase
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncTestCase, gen_test
+
+from toredis import metadata
+from toredis.hashing import (Crc32Ring, KetamaRing, JumpRing, RendezvousRing,
+                             hash_tag)
+from toredis.fakeserver import Delay, Drop, FakeServer, Reply
+from toredis.keys import get_flags, get_keys
+from toredis.nodes import ConnectionError, NodeDownError, RedisNodes
+
+
+NODES = [{'name': 'node%d' % i} for i in range(4)]
+KEYS = ['key:%d' % i for i in range(2000)]
+
+
+class TestRings(TestCase):
+
+    def test_all_nodes_used(self):
+        for ring_cls in (Crc32Ring, KetamaRing, JumpRing, RendezvousRing):
+            ring = ring_cls(NODES)
+            names = set(ring.get_node(key) for key in KEYS)
+            self.assertEqual(names, set(n['name'] for n in NODES))
+
+    def test_removed_node_keys_only_move(self):
+        for ring_cls in (Crc32Ring, KetamaRing, JumpRing, RendezvousRing):
+            before = ring_cls(NODES)
+            after = ring_cls(NODES[:-1])
+            for key in KEYS:
+                if before.get_node(key) != 'node3':
+                    self.assertEqual(before.get_node(key),
+                                     after.get_node(key))
+
+    def test_bytes_and_text_keys(self):
+        ring = KetamaRing(NODES)
+        self.assertEqual(ring.get_node(b'key'), ring.get_node(u'key'))
+
+    def test_hash_tag(self):
+        self.assertEqual(hash_tag('user:{42}:profile'), b'42')
+        self.assertEqual(hash_tag(b'{a}{b}'), b'a')
+        self.assertEqual(hash_tag('user:{}:x'), b'user:{}:x')
+        self.assertEqual(hash_tag('user:{42'), b'user:{42')
+
+
+class TestNodes(AsyncTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()  # the default Client loop
+
+    def setUp(self):
+        super(TestNodes, self).setUp()
+        self.server = FakeServer(io_loop=self.io_loop)
+        self.port = self.server.bind_unused_port()
+
+    def tearDown(self):
+        self.server.stop()
+        self.server.disconnect_all()
+        super(TestNodes, self).tearDown()
+
+    def get_nodes(self):
+        return RedisNodes([{'name': 'node%d' % i, 'db': i,
+                            'host': '127.0.0.1', 'port': self.port}
+                           for i in range(3)])
+
+    @gen_test
+    def test_mget_mset(self):
+        nodes = self.get_nodes()
+        values = dict(('scatter:%d' % i, str(i)) for i in range(50))
+        yield gen.Task(nodes.mset, values)
+
+        keys = sorted(values) + ['scatter:missing']
+        result = yield gen.Task(nodes.mget, keys)
+        self.assertEqual(result, [values[key].encode('utf-8')
+                                  for key in sorted(values)] + [None])
+
+        exists = yield gen.Task(nodes.exists, ['scatter:1', 'scatter:missing'])
+        self.assertEqual(exists, [1, 0])
+
+        deleted = yield gen.Task(nodes.delete, keys)
+        self.assertEqual(deleted, 50)
+
+    def test_hash_tag_routing(self):
+        nodes = RedisNodes([{'name': 'node%d' % i, 'db': i}
+                            for i in range(8)], key_func=hash_tag)
+        for i in range(20):
+            self.assertIs(nodes.get_client('user:{%d}:profile' % i),
+                          nodes.get_client('user:{%d}:feed' % i))
+
+    def test_eject_failed_node(self):
+        nodes = RedisNodes([{'name': 'up', 'db': 0, 'host': '127.0.0.1',
+                             'port': self.port},
+                            {'name': 'down', 'db': 0, 'host': 'localhost',
+                             'port': 1}], max_failures=2)
+        nodes.start_health_checks(interval=0.01, timeout=0.5,
+                                  io_loop=self.io_loop)
+
+        def check():
+            if 'down' in nodes.ejected:
+                self.stop()
+            else:
+                self.io_loop.add_timeout(time.time() + 0.01, check)
+        check()
+        self.wait()
+        nodes.stop_health_checks()
+
+        up = nodes.nodes[0][1]
+        for i in range(50):
+            self.assertIs(nodes.get_client('eject:%d' % i), up)
+
+    @gen_test
+    def test_probe_failures(self):
+        self.server.add_fault(Drop())
+        nodes = RedisNodes([{'name': 'dropping', 'db': 0,
+                             'host': '127.0.0.1', 'port': self.port}],
+                           max_failures=3)
+        pool = nodes.nodes[0][1]
+        for probe in range(3):
+            self.assertFalse('dropping' in nodes.ejected)
+            nodes._check_nodes(1.0, self.io_loop)
+            while nodes._probing:
+                yield gen.sleep(0.01)
+            # Every lost PING counts once
+            self.assertEqual(pool.metrics.failures, probe + 1)
+        self.assertTrue('dropping' in nodes.ejected)
+
+    @gen_test
+    def test_probe_timeout(self):
+        self.server.add_fault(Delay(0.5, command='PING'))
+        nodes = RedisNodes([{'name': 'slow', 'db': 0, 'host': '127.0.0.1',
+                             'port': self.port}], max_failures=1)
+        nodes.start_health_checks(interval=0.01, timeout=0.05,
+                                  io_loop=self.io_loop)
+        while 'slow' not in nodes.ejected:
+            yield gen.sleep(0.01)
+        pool = nodes.nodes[0][1]
+        # PING without reply in time counts as a failure, the connection
+        # stays up
+        self.assertEqual(pool.metrics.failures, 1)
+        self.assertTrue(pool.get_client().is_connected())
+
+        # Node answering in time again is re-admitted
+        self.server.clear_faults()
+        while 'slow' in nodes.ejected:
+            yield gen.sleep(0.01)
+        nodes.stop_health_checks()
+
+    def test_route_cache(self):
+        config = [{'name': 'node%d' % i, 'db': i} for i in range(4)]
+        plain = RedisNodes(config)
+        nodes = RedisNodes(config, route_cache_size=10, max_failures=1)
+        for i in range(30):
+            key = 'cached:%d' % (i % 15)
+            self.assertEqual(nodes.get_info(key), plain.get_info(key))
+        self.assertEqual(len(nodes._route_cache), 10)
+
+        nodes._eject('node0')
+        self.assertEqual(len(nodes._route_cache), 0)
+        for i in range(30):
+            self.assertNotEqual(nodes.get_info('cached:%d' % i)['name'],
+                                'node0')
+
+    def test_store_mode_fails_fast(self):
+        nodes = RedisNodes([{'name': 'node%d' % i, 'db': i}
+                            for i in range(2)],
+                           max_failures=1, eject_mode='store')
+        for n, cli in nodes.nodes:
+            cli.metrics.consecutive_failures = 1
+        with self.assertRaises(NodeDownError):
+            nodes.get_client('key')
+
+    @gen_test
+    def test_routed_commands(self):
+        nodes = self.get_nodes()
+        yield gen.Task(nodes.flushdb)
+        for i in range(20):
+            yield gen.Task(nodes.set, 'routed:%d' % i, i)
+
+        value = yield gen.Task(nodes.get, 'routed:7')
+        self.assertEqual(value, b'7')
+        size = yield gen.Task(nodes.dbsize)
+        self.assertEqual(size, 20)
+        exists = yield gen.Task(nodes.exists, 'routed:7')
+        self.assertEqual(exists, 1)
+
+        # OBJECT and PUBLISH go to one node only
+        processed = self.server.commands_processed
+        encoding = yield gen.Task(nodes.object, 'ENCODING', 'routed:7')
+        self.assertEqual(encoding, b'int')
+        yield gen.Task(nodes.publish, 'news', 'hello')
+        self.assertEqual(self.server.commands_processed, processed + 2)
+
+    @gen_test
+    def test_scan_iter(self):
+        nodes = self.get_nodes()
+        values = dict(('nodescan:%d' % i, i) for i in range(40))
+        yield gen.Task(nodes.mset, values)
+
+        found = set()
+        walk = nodes.scan_iter(match='nodescan:*', count=5, concurrency=2,
+                               max_buffered=1)
+        while True:
+            batch = yield gen.Task(walk.next)
+            if not batch:
+                break
+            found.update(batch)
+        self.assertTrue(walk.finished)
+        self.assertEqual(walk.errors, {})
+        self.assertEqual(found, set(key.encode() for key in values))
+        yield gen.Task(nodes.delete, list(values))
+
+    @gen_test
+    def test_scan_iter_error(self):
+        nodes = self.get_nodes()
+        values = dict(('nodescan:%d' % i, i) for i in range(40))
+        yield gen.Task(nodes.mset, values)
+        self.server.add_fault(Reply(Exception('ERR scripted'),
+                                    command='SCAN', times=1))
+        self.server.add_fault(Drop(command='SCAN', times=1))
+
+        found = set()
+        failures = []
+        walk = nodes.scan_iter(match='nodescan:*', count=5)
+        while True:
+            try:
+                batch = yield gen.Task(walk.next)
+            except Exception as e:
+                # Error replies are raised as by ScanIterator
+                failures.append(e)
+                continue
+            if not batch:
+                break
+            found.update(batch)
+        self.assertEqual(len(failures), 2)
+        self.assertEqual(str(failures[0]), 'ERR scripted')
+        self.assertTrue(isinstance(failures[1], ConnectionError))
+        self.assertEqual(len(walk.errors), 2)
+        # Other nodes are scanned to the end
+        self.assertTrue(len(found) < len(values))
+        yield gen.Task(nodes.delete, list(values))
+
+    def test_hash_func(self):
+        nodes = self.get_nodes()
+        self.assertEqual(nodes.hash_func('key'), zlib.crc32(b'key'))
+
+        class ConstantNodes(RedisNodes):
+            def hash_func(self, string):
+                return 0
+
+        # Overridden hash function still routes keys
+        nodes = ConstantNodes([n for n, cli in nodes.nodes])
+        names = set(nodes.get_info(key)['name'] for key in KEYS)
+        self.assertEqual(len(names), 1)
+
+    def test_keys_on_different_nodes(self):
+        nodes = self.get_nodes()
+        keys = ['cross:%d' % i for i in range(20)]
+        with self.assertRaises(ValueError):
+            nodes.sinter(keys)
+        with self.assertRaises(ValueError):
+            nodes.multi()
+
+    def test_get_keys(self):
+        self.assertEqual(get_keys(['GET', 'a']), ['a'])
+        self.assertEqual(get_keys(['MSET', 'a', 1, 'b', 2]), ['a', 'b'])
+        self.assertEqual(get_keys(['BLPOP', 'a', 'b', 0]), ['a', 'b'])
+        self.assertEqual(get_keys(['EVAL', 'script', 2, 'a', 'b', 'arg']),
+                         ['a', 'b'])
+        self.assertEqual(get_keys(['ZUNIONSTORE', 'd', 2, 'a', 'b',
+                                   'WEIGHTS', 1, 2]), ['d', 'a', 'b'])
+        self.assertEqual(get_keys(['INFO']), [])
+        self.assertEqual(get_keys(['OBJECT', 'ENCODING', 'a']), ['a'])
+        self.assertEqual(get_keys(['OBJECT', 'HELP']), [])
+        self.assertEqual(get_keys(['SORT', 'a', 'LIMIT', 0, 10, 'STORE',
+                                   'd']), ['a', 'd'])
+        self.assertEqual(get_keys(['SORT', b'a', b'store', b'd']),
+                         [b'a', b'd'])
+        self.assertEqual(get_keys(['SORT', 'a', 'GET', 'store']), ['a'])
+        self.assertEqual(get_keys(['PUBLISH', 'channel', 'message']),
+                         ['channel'])
+
+    def test_get_flags(self):
+        self.assertEqual(get_flags(['GET', 'a']),
+                         metadata.READONLY | metadata.IDEMPOTENT)
+        self.assertEqual(get_flags(['INCR', 'a']), metadata.WRITE)
+        self.assertTrue(get_flags(['BLPOP', 'a', 0]) & metadata.BLOCKING)
+        self.assertTrue(get_flags(['CONFIG', 'SET', 'a', 'b']) &
+                        metadata.ADMIN)
+        self.assertEqual(get_flags(['UNKNOWN']), 0)
+        self.assertEqual(sorted(metadata.SUBSCRIBE_COMMANDS),
+                         ['PSUBSCRIBE', 'PUNSUBSCRIBE', 'SUBSCRIBE',
+                          'UNSUBSCRIBE'])
+
+    @gen_test
+    def test_empty_keys(self):
+        nodes = self.get_nodes()
+        result = yield gen.Task(nodes.mget, [])
+        self.assertEqual(result, [])
@@ -1,24 +1,43 @@
-from tornado.testing import AsyncTestCase
+import os
+import unittest
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncTestCase, gen_test
 from toredis.client import ClientPool
+from toredis.fakeserver import Drop, FakeServer
 
 class TestPool(AsyncTestCase):
 
+    def get_new_ioloop(self):
+        return IOLoop.instance()  # the default Client loop
+
+    def setUp(self):
+        super(TestPool, self).setUp()
+        self.server = FakeServer(io_loop=self.io_loop)
+        self.port = self.server.bind_unused_port()
+
+    def tearDown(self):
+        self.server.stop()
+        self.server.disconnect_all()
+        super(TestPool, self).tearDown()
+
     def test_get_new_client(self):
-        pool = ClientPool(max_clients=5)
+        pool = ClientPool(max_clients=5, port=self.port)
         cli1 = pool.get_client()
         cli1.send_message(['PING'])
         cli2 = pool.get_client()
         self.assertIsNot(cli1, cli2)
 
     def test_get_existing_client(self):
-        pool = ClientPool(max_clients=5)
+        pool = ClientPool(max_clients=5, port=self.port)
         cli1 = pool.get_client()
         cli1.callbacks = []
         cli2 = pool.get_client()
         self.assertIs(cli1, cli2)
 
     def test_limit(self):
-        pool = ClientPool(max_clients=2)
+        pool = ClientPool(max_clients=2, port=self.port)
         cli1 = pool.get_client()
         cli1.send_message(['PING'])
         cli2 = pool.get_client()
@@ -26,4 +45,108 @@ class TestPool(AsyncTestCase):
         cli3 = pool.get_client()
         self.assertIn(cli3, [cli1, cli2])
 
+    def test_blocking_command_uses_dedicated_client(self):
+        pool = ClientPool(max_clients=5, max_blocking_clients=1,
+                          port=self.port)
+        pool.blpop('test_blocking', 1)
+        self.assertEqual(pool._pool, [])
+        self.assertEqual(len(pool._blocking_clients), 1)
+        pool.brpop('test_blocking', 1)
+        self.assertEqual(len(pool._blocking_clients), 1)
+        self.assertEqual(len(pool._blocking_queue), 1)
+
+    def test_drop_clients_after_fork(self):
+        pool = ClientPool(max_clients=5, min_clients=2, port=self.port)
+        pool.warm_up()
+        inherited = list(pool._pool)
+        self.assertEqual(len(inherited), 2)
+        pool._pid = -1
+        pool.get_client()
+        for cli in pool._pool:
+            self.assertNotIn(cli, inherited)
+
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'),
+                         'PID is not cached')
+    @gen_test
+    def test_fork(self):
+        pool = ClientPool(max_clients=5, port=self.port)
+        yield gen.Task(pool.ping)
+        cli = pool.get_client()
+        pid = os.fork()
+        if pid == 0:
+            # Cached PID is refreshed in the child
+            try:
+                cli.ping()
+                code = 1
+            except ValueError:
+                code = 0
+            os._exit(code)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        value = yield gen.Task(cli.ping)
+        self.assertEqual(value, b'PONG')
+
+    @gen_test
+    def test_scan_iter(self):
+        pool = ClientPool(max_clients=5, port=self.port)
+        keys = ['scan_test:%d' % i for i in range(25)]
+        yield gen.Task(pool.mset, dict((key, 1) for key in keys))
+
+        found = set()
+        walk = pool.scan_iter(match='scan_test:*', count=5)
+        while True:
+            batch = yield gen.Task(walk.next)
+            if not batch:
+                break
+            found.update(batch)
+            # Next batch is requested before this one is processed
+            self.assertTrue(walk._in_flight or walk._batches or
+                            walk.finished)
+        self.assertTrue(walk.finished)
+        self.assertEqual(found, set(key.encode() for key in keys))
+        yield gen.Task(pool.delete, keys)
+
+    @gen_test
+    def test_blocking_reconnect(self):
+        pool = ClientPool(max_clients=5, max_blocking_clients=1,
+                          port=self.port)
+        yield gen.Task(pool.rpush, 'blocking', ['a', 'b'])
+        value = yield gen.Task(pool.blpop, 'blocking', 1)
+        self.assertEqual(value, [b'blocking', b'a'])
+        cli = pool._blocking_pool[0]
+
+        # Server closes the idle blocking connection
+        self.server.disconnect_all()
+        yield gen.sleep(0.01)
+        self.assertFalse(cli.is_connected())
+        value = yield gen.Task(pool.blpop, 'blocking', 1)
+        self.assertEqual(value, [b'blocking', b'b'])
+        self.assertEqual(pool.snapshot_metrics()['reconnects'], 1)
+        self.assertEqual(len(pool._blocking_clients), 1)
+        self.assertFalse(cli in pool._blocking_clients)
+
+    @gen_test
+    def test_reconnect(self):
+        pool = ClientPool(max_clients=5, port=self.port)
+        yield gen.Task(pool.set, 'reconnect', 'value')
+        cli = pool.get_client()
+
+        # Server closes idle connections
+        self.server.disconnect_all()
+        yield gen.sleep(0.01)
+        self.assertFalse(cli.is_connected())
+        value = yield gen.Task(pool.get, 'reconnect')
+        self.assertEqual(value, b'value')
+        self.assertEqual(pool.metrics.failures, 0)
+        self.assertEqual(pool.snapshot_metrics()['reconnects'], 1)
 
+        # Connection is lost while a command waits for its reply
+        self.server.add_fault(Drop(command='GET', times=1))
+        value = yield gen.Task(pool.get, 'reconnect')
+        self.assertEqual(value, None)
+        self.assertEqual(pool.metrics.failures, 1)
+        self.assertEqual(pool.metrics.consecutive_failures, 1)
+        value = yield gen.Task(pool.get, 'reconnect')
+        self.assertEqual(value, b'value')
+        self.assertEqual(pool.metrics.connects, 3)
+        self.assertEqual(pool.snapshot_metrics()['reconnects'], 2)
+        self.assertEqual(pool.metrics.consecutive_failures, 0)
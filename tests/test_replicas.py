@@ -0,0 +1,80 @@
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncTestCase, gen_test
+
+from toredis.client import ClientPool
+from toredis.fakeserver import Delay, Drop, FakeServer
+from toredis.replicas import ReplicaSet
+
+
+class TestReplicaSet(AsyncTestCase):
+
+    def get_new_ioloop(self):
+        return IOLoop.instance()  # the default Client loop
+
+    @gen_test
+    def test_read_preference(self):
+        master = ClientPool()
+        replica = ClientPool()
+        replicas = ReplicaSet(master, [replica])
+
+        yield gen.Task(replicas.set, 'replicas', 'value')
+        self.assertEqual(replica._pool, [])
+
+        value = yield gen.Task(replicas.get, 'replicas')
+        self.assertEqual(value, b'value')
+        self.assertEqual(replica._pool, [])
+
+        value = yield gen.Task(replicas.reader('replica').get, 'replicas')
+        self.assertEqual(value, b'value')
+        self.assertEqual(len(replica._pool), 1)
+        self.assertTrue(replicas.latency(replica) > 0)
+
+    def test_nearest(self):
+        master = ClientPool()
+        replica = ClientPool()
+        replicas = ReplicaSet(master, [replica], read_preference='nearest')
+        replicas._latency[id(master)] = 0.01
+        replicas._latency[id(replica)] = 0.001
+        self.assertIs(replicas._get_read_pool('GET', None), replica)
+        self.assertIs(replicas._get_read_pool('GET', 'master'), master)
+
+    @gen_test
+    def test_dead_replica(self):
+        # Replica drops the connection on every read
+        server = FakeServer()
+        server.add_fault(Drop(command='GET'))
+        master = ClientPool()
+        replica = ClientPool(port=server.bind_unused_port())
+        replicas = ReplicaSet(master, [replica], read_preference='replica',
+                              retry_interval=0.2)
+        yield gen.Task(replicas.set, 'replicas', 'value')
+
+        value = yield gen.Task(replicas.get, 'replicas')
+        self.assertEqual(value, None)
+        # Reads go to the master until the replica is retried
+        for _ in range(3):
+            value = yield gen.Task(replicas.get, 'replicas')
+            self.assertEqual(value, b'value')
+        self.assertIs(replicas._get_read_pool('GET', 'nearest'), master)
+
+        yield gen.sleep(0.2)
+        self.assertIs(replicas._get_read_pool('GET', None), replica)
+        server.stop()
+
+    @gen_test
+    def test_slow_replica(self):
+        server = FakeServer()
+        server.add_fault(Delay(1, command='GET'))
+        master = ClientPool()
+        replica = ClientPool(port=server.bind_unused_port())
+        replicas = ReplicaSet(master, [replica], read_preference='nearest')
+        replicas._latency[id(master)] = 0.01
+        yield gen.Task(replicas.reader('replica').ping)
+
+        # Read without reply counts as latency while it waits
+        replicas.reader('replica').get('replicas')
+        self.assertIs(replicas._get_read_pool('GET', None), replica)
+        yield gen.sleep(0.05)
+        self.assertIs(replicas._get_read_pool('GET', None), master)
+        server.stop()
@@ -0,0 +1,104 @@
+import json
+import marshal
+import pickle
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from toredis.client import ClientPool
+from toredis.compression import Compressor, Policy
+from toredis.serializers import Serialization, SERIALIZERS
+
+
+class TestSerialization(AsyncTestCase):
+
+    def get_pools(self, **kwargs):
+        serializer = Serialization(prefixes=[('pickled:', 'pickle'),
+                                             ('raw:', None)])
+        return (ClientPool(io_loop=self.io_loop, serializer=serializer,
+                           **kwargs),
+                ClientPool(io_loop=self.io_loop))
+
+    @gen_test
+    def test_round_trip(self):
+        pool, raw = self.get_pools()
+        user = {'name': 'alice', 'tags': [1, 2]}
+
+        yield gen.Task(pool.set, 'user', user)
+        yield gen.Task(pool.set, 'pickled:set', set([1, 2]))
+        yield gen.Task(pool.set, 'raw:json', '{"a": 1}')
+        yield gen.Task(pool.set, 'counter', 5)
+        yield gen.Task(pool.incr, 'counter')
+
+        value = yield gen.Task(raw.get, 'user')
+        self.assertEqual(json.loads(value.decode('utf-8')), user)
+        value = yield gen.Task(raw.get, 'counter')
+        self.assertEqual(value, b'6')
+
+        value = yield gen.Task(pool.get, 'user')
+        self.assertEqual(value, user)
+        value = yield gen.Task(pool.get, 'pickled:set')
+        self.assertEqual(value, set([1, 2]))
+        value = yield gen.Task(pool.get, 'raw:json')
+        self.assertEqual(value, b'{"a": 1}')
+        values = yield gen.Task(pool.mget, ['user', 'counter', 'missing'])
+        self.assertEqual(values, [user, 6, None])
+        values = yield gen.Task(pool.mget, ['user', 'pickled:set'])
+        self.assertEqual(values, [user, set([1, 2])])
+
+        # Single calls may use another serializer
+        yield gen.Task(pool.using('marshal').set, 'marshalled', (1, 2))
+        value = yield gen.Task(pool.using('marshal').get, 'marshalled')
+        self.assertEqual(value, (1, 2))
+        value = yield gen.Task(pool.get, 'marshalled')
+        self.assertNotEqual(value, (1, 2))
+
+        yield gen.Task(pool.delete, ['user', 'pickled:set', 'raw:json',
+                                     'counter', 'marshalled'])
+
+    @gen_test
+    def test_with_compression(self):
+        pool, raw = self.get_pools(
+            codec=Compressor(default=Policy(threshold=100)))
+        data = {'items': list(range(100))}
+        yield gen.Task(pool.mset, {'compressed': data, 'small': [1]})
+        values = yield gen.Task(pool.mget, ['compressed', 'small'])
+        self.assertEqual(values, [data, [1]])
+        self.assertEqual(pool.codec.stats['compressed'], 1)
+        yield gen.Task(pool.delete, ['compressed', 'small'])
+
+    def test_decode_replies(self):
+        serialization = Serialization()
+        args = serialization.encode(['HMSET', 'hash', 'f1', {'a': 1},
+                                     'f2', b'plain'])
+        self.assertEqual(args[3], b'{"a":1}')
+        self.assertEqual(args[5], b'\x00plain')
+        replies = []
+        callback = serialization.wrap_callback(['HGETALL', 'hash'],
+                                               replies.append)
+        callback([b'f1', args[3], b'f2', args[5]])
+        self.assertEqual(replies, [[b'f1', {'a': 1}, b'f2', b'plain']])
+
+    def test_bytes_round_trip(self):
+        values = [b'null', b'true', b'[1]', b'123', b'', b'\x00raw',
+                  pickle.dumps([1], 2), marshal.dumps(1), b'\xff']
+        for name in SERIALIZERS:
+            serialization = Serialization(default=name)
+            for value in values:
+                args = serialization.encode(['SET', 'key', value])
+                self.assertEqual(
+                    serialization.decode(['GET', 'key'], args[2]), value)
+            args = serialization.encode(['MSET'] + [
+                item for idx, value in enumerate(values)
+                for item in ('key:%d' % idx, value)])
+            keys = ['key:%d' % idx for idx in range(len(values))]
+            self.assertEqual(
+                serialization.decode(['MGET'] + keys, args[2::2]), values)
+
+    def test_json_batch(self):
+        loads_many = SERIALIZERS['json'].loads_many
+        self.assertEqual(loads_many([b'1', None, b'[2]', b'"x"']),
+                         [1, None, [2], 'x'])
+        # Values which are not JSON make it fall back to one by one
+        self.assertEqual(loads_many([b'1,2', b'{"a":1}', b'raw']),
+                         [b'1,2', {'a': 1}, b'raw'])
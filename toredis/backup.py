@@ -0,0 +1,350 @@
+"""
+Export of keys to a local file with DUMP and import back with RESTORE.
+
+Typical use::
+
+    Exporter(pool, 'users.dump', match='user:*', compress=True).start(
+        callback=on_exported)
+    ...
+    Importer(nodes, 'users.dump').start(callback=on_imported)
+
+Both work with a ClientPool or RedisNodes and keep memory constant: the
+exporter holds one SCAN batch at a time, the importer reads the file
+through mmap and keeps at most ``window`` RESTORE commands in flight.
+
+File starts with a header (magic, format version, flags). Records follow,
+compressed as one zlib stream if the header has the zlib flag. Every
+record is key length, value length, TTL in milliseconds (0 for keys
+without expiration), key and DUMP value.
+"""
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from tornado import stack_context
+
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b'TRDB'
+VERSION = 1
+
+FLAG_ZLIB = 1
+
+HEADER = struct.Struct('>4sBB')
+RECORD = struct.Struct('>IIq')
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _is_error(resp):
+    return resp is None or isinstance(resp, Exception)
+
+
+def _get_pools(target):
+    # RedisNodes exposes list of (node, pool)
+    if hasattr(target, 'nodes'):
+        return [(n['name'], pool) for n, pool in target.nodes]
+    return [('pool', target)]
+
+
+def _get_router(target):
+    if hasattr(target, 'nodes'):
+        return target.get_client
+    return lambda key: target
+
+
+class _Writer(object):
+    def __init__(self, f, compress):
+        self._f = f
+        self._compressor = zlib.compressobj() if compress else None
+        self.size = 0
+        self._write(HEADER.pack(MAGIC, VERSION, FLAG_ZLIB if compress else 0))
+
+    def _write(self, data):
+        self._f.write(data)
+        self.size += len(data)
+
+    def write(self, key, ttl, data):
+        record = RECORD.pack(len(key), len(data), ttl) + key + data
+        if self._compressor is not None:
+            record = self._compressor.compress(record)
+        self._write(record)
+
+    def close(self):
+        if self._compressor is not None:
+            self._write(self._compressor.flush())
+        self._f.close()
+
+
+def _inflate_chunks(buf, offset):
+    decompressor = zlib.decompressobj()
+    size = len(buf)
+    while offset < size:
+        chunk = buf[offset:offset + CHUNK_SIZE]
+        offset += len(chunk)
+        # Inflate at most CHUNK_SIZE bytes at a time
+        while chunk:
+            yield decompressor.decompress(chunk, CHUNK_SIZE)
+            chunk = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+
+def read_records(path):
+    """
+    Iterate (key, ttl, value) records of an export file
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise ValueError('%s is not an export file' % path)
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version, flags = HEADER.unpack(buf[:HEADER.size])
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not an export file' % path)
+
+        if flags & FLAG_ZLIB:
+            records = _read_compressed(path, buf)
+        else:
+            records = _read_mapped(path, buf)
+        for record in records:
+            yield record
+    finally:
+        buf.close()
+
+
+def _read_record(data, pos):
+    # Return record at ``pos`` and offset after it, None if it is not
+    # complete
+    if len(data) - pos < RECORD.size:
+        return None
+    key_len, value_len, ttl = RECORD.unpack_from(data, pos)
+    start = pos + RECORD.size
+    end = start + key_len + value_len
+    if end > len(data):
+        return None
+    key_end = start + key_len
+    return (bytes(data[start:key_end]), ttl, bytes(data[key_end:end])), end
+
+
+def _read_mapped(path, buf):
+    # Records are sliced straight out of the mapping
+    pos = HEADER.size
+    while pos < len(buf):
+        result = _read_record(buf, pos)
+        if result is None:
+            raise ValueError('%s is truncated' % path)
+        record, pos = result
+        yield record
+
+
+def _read_compressed(path, buf):
+    # Inflated data is appended to a bytearray, so a record spanning many
+    # chunks is not copied again for every chunk
+    data = bytearray()
+    chunks = _inflate_chunks(buf, HEADER.size)
+    while True:
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            break
+        except zlib.error as e:
+            raise ValueError('%s is corrupt: %s' % (path, e))
+        data.extend(chunk)
+        pos = 0
+        result = _read_record(data, pos)
+        while result is not None:
+            record, pos = result
+            yield record
+            result = _read_record(data, pos)
+        if pos:
+            del data[:pos]
+    if data:
+        raise ValueError('%s is truncated' % path)
+
+
+class Exporter(object):
+    """
+    Writes keys of a ClientPool or of all nodes of RedisNodes to a file.
+
+    Keys are walked with SCAN; every batch is read with pipelined DUMP and
+    PTTL, and the SCAN of the next batch goes in the same pipeline. Keys
+    which disappear between SCAN and DUMP are skipped. As SCAN, export
+    may contain keys more than once if they are changed meanwhile.
+    """
+
+    def __init__(self, source, path, match=None, count=1000, compress=False):
+        """
+        :param source:
+            ClientPool or RedisNodes
+        :param match:
+            Optional SCAN MATCH pattern
+        :param count:
+            SCAN COUNT hint, approximate batch size
+        :param compress:
+            Compress records with zlib
+        """
+        self._source = source
+        self._path = path
+        self._match = match
+        self._count = count
+        self._compress = compress
+
+        self.stats = {'exported': 0, 'skipped': 0, 'errors': 0, 'bytes': 0}
+        self._callback = None
+
+    def start(self, callback=None):
+        """
+        Start export
+
+        :param callback:
+            Called with stats when the file is written
+        """
+        if callback is not None:
+            callback = stack_context.wrap(callback)
+        self._callback = callback
+        self._writer = _Writer(open(self._path, 'wb'), self._compress)
+        self._queue = _get_pools(self._source)
+        self._next_pool()
+
+    def _next_pool(self):
+        if not self._queue:
+            self._writer.close()
+            self.stats['bytes'] = self._writer.size
+            if self._callback is not None:
+                self._callback(self.stats)
+            return
+        name, pool = self._queue.pop(0)
+        self._send(name, pool, [], 0)
+
+    def _scan_args(self, cursor):
+        args = ['SCAN', cursor]
+        if self._match is not None:
+            args.extend(['MATCH', self._match])
+        args.extend(['COUNT', self._count])
+        return args
+
+    def _send(self, name, pool, keys, cursor):
+        commands = []
+        for key in keys:
+            commands.append(['DUMP', key])
+            commands.append(['PTTL', key])
+        if cursor is not None:
+            commands.append(self._scan_args(cursor))
+
+        def on_replies(replies):
+            for idx, key in enumerate(keys):
+                data, ttl = replies[2 * idx], replies[2 * idx + 1]
+                # DUMP of a missing key is None, PTTL is None only if
+                # connection was lost
+                if _is_error(ttl) or isinstance(data, Exception):
+                    logger.error('DUMP of %r failed on %s: %r', key, name,
+                                 ttl if _is_error(ttl) else data)
+                    self.stats['errors'] += 1
+                elif data is None or ttl == -2:
+                    self.stats['skipped'] += 1
+                else:
+                    self._writer.write(key, max(ttl, 0), data)
+                    self.stats['exported'] += 1
+
+            if cursor is None:
+                self._next_pool()
+                return
+            resp = replies[-1]
+            if _is_error(resp):
+                logger.error('SCAN failed on %s: %r', name, resp)
+                self.stats['errors'] += 1
+                self._next_pool()
+                return
+            next_cursor = int(resp[0])
+            self._send(name, pool, resp[1], next_cursor or None)
+
+        if not commands:
+            self._next_pool()
+            return
+        pool.send_pipeline(commands, on_replies)
+
+
+class Importer(object):
+    """
+    Restores keys from an export file to a ClientPool or RedisNodes,
+    routing every key to its owner.
+
+    Existing keys are kept and counted as skipped, unless ``replace`` is
+    set. If the file is truncated or corrupt, import stops at the first
+    broken record, counts it as an error and keeps the ValueError in
+    ``error``.
+    """
+
+    def __init__(self, target, path, window=1000, replace=False):
+        """
+        :param target:
+            ClientPool or RedisNodes
+        :param window:
+            Maximum number of RESTORE commands waiting for reply
+        """
+        self._target = target
+        self._path = path
+        self._window = window
+        self._replace = replace
+
+        self.stats = {'restored': 0, 'skipped': 0, 'errors': 0}
+        self.error = None
+        self._callback = None
+
+    def start(self, callback=None):
+        """
+        Start import
+
+        :param callback:
+            Called with stats when all records are restored
+        """
+        if callback is not None:
+            callback = stack_context.wrap(callback)
+        self._callback = callback
+        self._records = read_records(self._path)
+        self._route = _get_router(self._target)
+        self._in_flight = 0
+        self._exhausted = False
+        self._feed()
+
+    def _feed(self):
+        while not self._exhausted and self._in_flight < self._window:
+            try:
+                key, ttl, data = next(self._records)
+            except StopIteration:
+                self._exhausted = True
+                break
+            except ValueError as e:
+                logger.error('Import stopped: %s', e)
+                self.error = e
+                self.stats['errors'] += 1
+                self._exhausted = True
+                break
+            args = ['RESTORE', key, ttl, data]
+            if self._replace:
+                args.append('REPLACE')
+            self._in_flight += 1
+            self._route(key)._send_message(args, self._on_reply)
+
+        if self._exhausted and self._in_flight == 0:
+            if self._callback is not None:
+                self._callback(self.stats)
+
+    def _on_reply(self, resp):
+        self._in_flight -= 1
+        if resp is None:
+            self.stats['errors'] += 1
+        elif isinstance(resp, Exception):
+            if 'BUSYKEY' in str(resp):
+                self.stats['skipped'] += 1
+            else:
+                logger.error('RESTORE failed: %s', resp)
+                self.stats['errors'] += 1
+        else:
+            self.stats['restored'] += 1
+        if not self._exhausted or self._in_flight == 0:
+            self._feed()
@@ -0,0 +1,418 @@
+"""
+Throughput and latency benchmark of toredis, modeled on redis-benchmark.
+
+Drives a Client, ClientPool or RedisNodes with a mix of commands and
+reports operations per second and latency percentiles::
+
+    toredis-bench --target pool --clients 50 --pipeline 4 \\
+        --tests get:80,set:20 --distribution zipf
+    toredis-bench --fake --target nodes --shards 4 --json
+
+``--clients`` workers run at once, each sends ``--pipeline`` commands and
+waits for all their replies before sending the next ones. Latency of a
+command is the time from sending it to its callback.
+
+Without ``--fake`` the benchmark runs against a redis server; RedisNodes
+shards are then databases of that server. With ``--fake`` every shard is
+a :class:`~toredis.fakeserver.FakeServer` in the same process, sharing
+the IOLoop (and the CPU) with the client, which measures the overhead of
+the client rather than of the network.
+"""
+import argparse
+import bisect
+import json
+import random
+import sys
+import timeit
+
+from tornado import stack_context
+from tornado.ioloop import IOLoop
+
+from toredis.client import Client, ClientPool
+from toredis.fakeserver import FakeServer
+from toredis.nodes import RedisNodes
+
+
+MULTI_KEYS = 10
+
+
+def _ping(target, keys, value, callback):
+    # RedisNodes sends it to all nodes
+    target.send_message(['PING'], callback)
+
+
+def _get(target, keys, value, callback):
+    target.get(keys.next(), callback)
+
+
+def _set(target, keys, value, callback):
+    target.set(keys.next(), value, callback=callback)
+
+
+def _incr(target, keys, value, callback):
+    target.incr(keys.next('counter:'), callback)
+
+
+def _delete(target, keys, value, callback):
+    target.delete(keys.next(), callback)
+
+
+def _hset(target, keys, value, callback):
+    target.hset(keys.next('hash:'), 'field', value, callback)
+
+
+def _hget(target, keys, value, callback):
+    target.hget(keys.next('hash:'), 'field', callback)
+
+
+def _lpush(target, keys, value, callback):
+    target.lpush(keys.next('list:'), value, callback)
+
+
+def _rpop(target, keys, value, callback):
+    target.rpop(keys.next('list:'), callback)
+
+
+def _sadd(target, keys, value, callback):
+    target.sadd(keys.next('set:'), keys.next(), callback)
+
+
+def _zadd(target, keys, value, callback):
+    target.zadd(keys.next('zset:'), {keys.next(): 1}, callback)
+
+
+def _mget(target, keys, value, callback):
+    target.mget([keys.next() for _ in range(MULTI_KEYS)], callback)
+
+
+def _mset(target, keys, value, callback):
+    target.mset(dict((keys.next(), value) for _ in range(MULTI_KEYS)),
+                callback)
+
+
+# name: function of (target, keys, value, callback) sending one command
+COMMANDS = {
+    'ping': _ping,
+    'get': _get,
+    'set': _set,
+    'incr': _incr,
+    'del': _delete,
+    'hset': _hset,
+    'hget': _hget,
+    'lpush': _lpush,
+    'rpop': _rpop,
+    'sadd': _sadd,
+    'zadd': _zadd,
+    'mget': _mget,
+    'mset': _mset,
+}
+
+
+class KeyGenerator(object):
+    """
+    Cycles through ``sample_size`` key indexes drawn in advance from the
+    uniform or Zipfian distribution over ``keyspace`` keys, so drawing
+    keys costs little during the run. Commands of different data types
+    use different key prefixes, as in redis-benchmark.
+    """
+
+    def __init__(self, keyspace, distribution='uniform', zipf_s=0.99,
+                 seed=None, sample_size=1 << 16):
+        rnd = random.Random(seed)
+        self._keyspace = keyspace
+        self._keys = {}
+        if distribution == 'uniform':
+            sample = [rnd.randrange(keyspace) for _ in range(sample_size)]
+        elif distribution == 'zipf':
+            # Key of rank k is drawn with weight 1 / k ** s
+            cdf = []
+            total = 0.0
+            for rank in range(1, keyspace + 1):
+                total += 1.0 / rank ** zipf_s
+                cdf.append(total)
+            sample = [min(bisect.bisect_left(cdf, rnd.random() * total),
+                          keyspace - 1)
+                      for _ in range(sample_size)]
+            # Hot keys are spread over the keyspace, not sorted by rank
+            order = list(range(keyspace))
+            rnd.shuffle(order)
+            sample = [order[idx] for idx in sample]
+        else:
+            raise ValueError('Unknown distribution: %s' % distribution)
+        self._sample = sample
+        self._pos = 0
+
+    def next(self, prefix='key:'):
+        keys = self._keys.get(prefix)
+        if keys is None:
+            keys = self._keys[prefix] = ['%s%012d' % (prefix, idx)
+                                         for idx in range(self._keyspace)]
+        idx = self._sample[self._pos]
+        self._pos = (self._pos + 1) % len(self._sample)
+        return keys[idx]
+
+
+def parse_mix(spec):
+    """
+    Parse ``name:weight,name:weight`` into list of (name, weight)
+    """
+    mix = []
+    for item in spec.split(','):
+        name, _, weight = item.strip().partition(':')
+        name = name.lower()
+        if name not in COMMANDS:
+            raise ValueError('Unknown command %r, choose from %s' %
+                             (name, ', '.join(sorted(COMMANDS))))
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    idx = int(fraction * len(sorted_values))
+    return sorted_values[min(idx, len(sorted_values) - 1)]
+
+
+class Benchmark(object):
+    """
+    Runs ``requests`` commands of the ``mix`` against the target with
+    ``clients`` concurrent workers
+    """
+
+    def __init__(self, target, mix, keys, requests=100000, clients=50,
+                 pipeline=1, data_size=3, seed=None):
+        self._target = target
+        self._keys = keys
+        self._requests = requests
+        self._clients = clients
+        self._pipeline = pipeline
+        self._value = b'x' * data_size
+
+        # Command of every operation is drawn in advance as well
+        rnd = random.Random(seed)
+        names = [name for name, weight in mix]
+        cdf = []
+        total = 0.0
+        for name, weight in mix:
+            total += weight
+            cdf.append(total)
+        self._plan = [COMMANDS[names[bisect.bisect_right(
+                          cdf, rnd.random() * total)
+                          if len(names) > 1 else 0]]
+                      for _ in range(min(requests, 1 << 16))]
+
+        self.latencies = []
+        self.errors = 0
+        self._sent = 0
+        self._running = 0
+        self._callback = None
+
+    def run(self, callback):
+        """
+        Start workers, callback gets result dictionary when all commands
+        are answered
+        """
+        self._callback = callback
+        self._started = timeit.default_timer()
+        self._running = self._clients
+        for _ in range(self._clients):
+            self._send_batch()
+
+    def _send_batch(self):
+        count = min(self._pipeline, self._requests - self._sent)
+        if count <= 0:
+            self._running -= 1
+            if self._running == 0:
+                self._finish()
+            return
+        first = self._sent
+        self._sent += count
+        state = {'pending': count}
+        timer = timeit.default_timer
+
+        def done():
+            state['pending'] -= 1
+            if state['pending'] == 0:
+                # Out of the context of this batch, otherwise contexts of
+                # all batches of the worker nest
+                with stack_context.NullContext():
+                    self._send_batch()
+
+        def on_error(typ, value, tb):
+            # Error replies are raised in callbacks
+            self.errors += 1
+            done()
+            return True
+
+        with stack_context.ExceptionStackContext(on_error):
+            for idx in range(first, first + count):
+                command = self._plan[idx % len(self._plan)]
+                started = timer()
+
+                def on_reply(resp, started=started):
+                    self.latencies.append(timer() - started)
+                    # NodesError of multi-key commands over RedisNodes
+                    if isinstance(resp, Exception):
+                        self.errors += 1
+                    done()
+
+                try:
+                    command(self._target, self._keys, self._value, on_reply)
+                except Exception:
+                    self.errors += 1
+                    done()
+
+    def _finish(self):
+        elapsed = timeit.default_timer() - self._started
+        latencies = sorted(self.latencies)
+        self._callback({
+            'requests': self._requests,
+            'errors': self.errors,
+            'seconds': elapsed,
+            'ops_per_sec': self._requests / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'p999_ms': percentile(latencies, 0.999) * 1000,
+            'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+        })
+
+
+def make_target(options, io_loop, ports):
+    """
+    Return (target, connect) where connect is a function of callback
+    which opens connections of the target
+    """
+    host, port = options.host, ports[0]
+    if options.target == 'client':
+        client = Client(io_loop=io_loop)
+        return client, lambda callback: client.connect(host, port,
+                                                       callback=callback)
+    if options.target == 'pool':
+        pool = ClientPool(host=host, port=port, io_loop=io_loop,
+                          max_clients=options.connections,
+                          min_clients=options.connections)
+
+        def connect(callback):
+            pool.warm_up()
+            pool.send_message(['PING'], lambda resp: callback())
+        return pool, connect
+
+    nodes = []
+    for idx in range(options.shards):
+        nodes.append({
+            'name': 'shard%d' % idx,
+            'host': host,
+            'port': ports[idx] if options.fake else port,
+            'db': 0 if options.fake else idx,
+            'max_clients': options.connections,
+            'min_clients': options.connections,
+        })
+    # Pools of RedisNodes use the global IOLoop
+    target = RedisNodes(nodes)
+
+    def connect(callback):
+        target.warm_up()
+        target.send_message(['PING'], lambda resp: callback())
+    return target, connect
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='toredis-bench',
+        description='Throughput and latency benchmark of toredis')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('-p', '--port', type=int, default=6379)
+    parser.add_argument('--fake', action='store_true',
+                        help='run against in-process fake servers')
+    parser.add_argument('--target', choices=['client', 'pool', 'nodes'],
+                        default='pool')
+    parser.add_argument('--shards', type=int, default=3,
+                        help='number of RedisNodes nodes')
+    parser.add_argument('--connections', type=int, default=4,
+                        help='connections of every pool')
+    parser.add_argument('-n', '--requests', type=int, default=100000)
+    parser.add_argument('-c', '--clients', type=int, default=50,
+                        help='number of concurrent workers')
+    parser.add_argument('-P', '--pipeline', type=int, default=1,
+                        help='commands sent by a worker at once')
+    parser.add_argument('-d', '--data-size', type=int, default=3,
+                        help='value size in bytes')
+    parser.add_argument('-r', '--keyspace', type=int, default=100000)
+    parser.add_argument('--distribution', choices=['uniform', 'zipf'],
+                        default='uniform')
+    parser.add_argument('--zipf-s', type=float, default=0.99,
+                        help='exponent of the Zipfian distribution')
+    parser.add_argument('-t', '--tests', default='get:50,set:50',
+                        help='command mix as name:weight,..., one of %s' %
+                             ', '.join(sorted(COMMANDS)))
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', action='store_true',
+                        help='print result as JSON')
+    return parser
+
+
+def run(options):
+    """
+    Run benchmark described by parsed options on the global IOLoop, return
+    result dictionary
+    """
+    io_loop = IOLoop.instance()
+    mix = parse_mix(options.tests)
+    keys = KeyGenerator(options.keyspace, options.distribution,
+                        options.zipf_s, options.seed)
+
+    servers = []
+    ports = [options.port]
+    if options.fake:
+        count = options.shards if options.target == 'nodes' else 1
+        servers = [FakeServer(io_loop=io_loop) for _ in range(count)]
+        ports = [server.bind_unused_port() for server in servers]
+        options.host = '127.0.0.1'
+
+    target, connect = make_target(options, io_loop, ports)
+    benchmark = Benchmark(target, mix, keys, options.requests,
+                          options.clients, options.pipeline,
+                          options.data_size, options.seed)
+    result = {}
+
+    def on_done(res):
+        result.update(res)
+        io_loop.stop()
+
+    connect(lambda *args: benchmark.run(on_done))
+    io_loop.start()
+    for server in servers:
+        server.stop()
+
+    result.update({
+        'target': options.target,
+        'tests': options.tests,
+        'clients': options.clients,
+        'pipeline': options.pipeline,
+        'data_size': options.data_size,
+        'distribution': options.distribution,
+        'fake': options.fake,
+    })
+    return result
+
+
+def main(argv=None):
+    options = get_parser().parse_args(argv)
+    result = run(options)
+    if options.json:
+        print(json.dumps(result, sort_keys=True))
+    else:
+        print('%s on %s: %d requests, %d clients, pipeline %d, %s keys' % (
+            options.tests, options.target, options.requests, options.clients,
+            options.pipeline, options.distribution))
+        print('  %12.1f requests per second' % result['ops_per_sec'])
+        print('  %12.3f ms p50' % result['p50_ms'])
+        print('  %12.3f ms p99' % result['p99_ms'])
+        print('  %12.3f ms p999' % result['p999_ms'])
+        print('  %12d errors' % result['errors'])
+    return 1 if result['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""
+Storage of values too large for one redis string.
+
+A value longer than ``threshold`` is split into chunk keys and the key
+itself holds a small manifest: magic bytes, value length, number of
+chunks and a random token which is part of chunk key names. A new write
+uses a new token and removes chunks of the old value, so readers never
+mix chunks of two writes.
+
+Example::
+
+    values = LargeValues(pool, threshold=1024 * 1024)
+    values.set('report', data, callback=on_set)
+    values.get('report', callback=on_get)
+"""
+import binascii
+import os
+import struct
+
+from collections import deque
+
+from tornado import stack_context
+
+from toredis.client import _getpid, _wrap_callback
+from toredis.hashing import to_bytes
+from toredis.serializers import Prepared
+
+
+MAGIC = b'\x00TRCHNK\x01'
+MANIFEST = struct.Struct('>8sQI16s')
+
+
+class ChunkError(Exception):
+    """
+    Chunks of a value are missing because it was changed while being read,
+    or it kept changing while being written
+    """
+
+
+def _get_manifest(value):
+    if (not isinstance(value, bytes) or len(value) != MANIFEST.size or
+            not value.startswith(MAGIC)):
+        return None
+    return MANIFEST.unpack(value)[1:]
+
+
+class LargeValues(object):
+    """
+    Opt-in large-value layer over a Client or ClientPool.
+
+    Values up to ``threshold`` bytes are stored as usual. Larger ones are
+    written as chunks of ``chunk_size`` bytes with the manifest. Every
+    write and delete reads the old manifest under WATCH and replaces the
+    value and removes old chunks in one MULTI/EXEC, repeated up to
+    ``retries`` times if the key changes meanwhile. Reads fetch all
+    chunks with pipelined GETs over one connection and assemble them into
+    a preallocated buffer, or pass them to ``sink`` as they arrive.
+
+    Values are stored as bytes, a serializer of the target is not used.
+    """
+
+    def __init__(self, target, threshold=1024 * 1024, chunk_size=512 * 1024,
+                 retries=3):
+        """
+        :param target:
+            Client or ClientPool
+        :param retries:
+            How many times a read or a write is repeated if the value
+            changes meanwhile
+        """
+        self._target = target
+        self._threshold = threshold
+        self._chunk_size = chunk_size
+        self._retries = retries
+
+        # WATCH applies to the whole connection: writes of a pool go over
+        # a connection of their own, one at a time
+        self._writer = None
+        self._writes = deque()
+        self._writing = False
+
+    def _get_client(self):
+        # One connection keeps replies in order
+        get_client = getattr(self._target, 'get_client', None)
+        return get_client() if get_client is not None else self._target
+
+    def _get_writer(self):
+        connect = getattr(self._target, '_connect_client', None)
+        if connect is None:
+            return self._target
+        writer = self._writer
+        if writer is not None and writer._pid != _getpid():
+            writer._close_inherited()
+            writer = None
+        if writer is None or not writer.is_connected():
+            writer = self._writer = connect()
+        return writer
+
+    def _chunk_keys(self, key, count, token):
+        prefix = to_bytes(key) + b':chunk:' + token + b':'
+        return [prefix + str(idx).encode('ascii') for idx in range(count)]
+
+    def set(self, key, value, callback=None, expire=None):
+        """
+        Set value of the key
+
+        :param expire:
+            Optional time to live in seconds
+        """
+        self._write(key, to_bytes(value), expire, _wrap_callback(callback))
+
+    def delete(self, key, callback=None):
+        """
+        Delete the key and its chunks
+        """
+        self._write(key, None, None, _wrap_callback(callback))
+
+    def _write(self, key, value, expire, callback):
+        self._writes.append((key, value, expire, callback))
+        if not self._writing:
+            self._next_write()
+
+    def _next_write(self):
+        if not self._writes:
+            self._writing = False
+            return
+        self._writing = True
+        key, value, expire, callback = self._writes.popleft()
+
+        def on_done(resp):
+            if callback is not None:
+                callback(resp)
+            self._next_write()
+
+        self._transaction(key, value, expire, on_done, self._retries)
+
+    def _get_records(self, key, value):
+        if len(value) <= self._threshold:
+            return [(key, value)]
+        token = binascii.hexlify(os.urandom(8))
+        size = self._chunk_size
+        count = (len(value) + size - 1) // size
+        keys = self._chunk_keys(key, count, token)
+        records = [(chunk_key, value[idx * size:(idx + 1) * size])
+                   for idx, chunk_key in enumerate(keys)]
+        records.append((key, MANIFEST.pack(MAGIC, len(value), count, token)))
+        return records
+
+    def _transaction(self, key, value, expire, callback, retries):
+        cli = self._get_writer()
+
+        def on_old(replies):
+            resp = replies[1]
+            if resp is None or isinstance(resp, Exception):
+                if cli.is_connected():
+                    cli._send_message(Prepared(['UNWATCH']), None)
+                callback(resp)
+                return
+
+            old = _get_manifest(resp)
+            commands = [Prepared(['MULTI'])]
+            if value is None:
+                args = ['DEL', key]
+                if old is not None:
+                    args.extend(self._chunk_keys(key, old[1], old[2]))
+                commands.append(Prepared(args))
+            else:
+                records = self._get_records(key, value)
+                if expire is None:
+                    args = ['MSET']
+                    for record_key, data in records:
+                        args.extend([record_key, data])
+                    commands.append(Prepared(args))
+                else:
+                    for record_key, data in records:
+                        commands.append(Prepared(['SETEX', record_key,
+                                                  expire, data]))
+                if old is not None:
+                    commands.append(Prepared(
+                        ['DEL'] + self._chunk_keys(key, old[1], old[2])))
+            commands.append(Prepared(['EXEC']))
+
+            def on_exec(replies):
+                resp = replies[-1]
+                if resp is None and cli.is_connected():
+                    # Key was changed after WATCH
+                    if retries > 0:
+                        self._transaction(key, value, expire, callback,
+                                          retries - 1)
+                    else:
+                        callback(ChunkError('Value of %r keeps changing' %
+                                            key))
+                    return
+                if isinstance(resp, list):
+                    errors = [item for item in resp
+                              if isinstance(item, Exception)]
+                    if errors:
+                        resp = errors[0]
+                    elif value is None:
+                        resp = resp[0]
+                    else:
+                        resp = b'OK'
+                callback(resp)
+
+            cli.send_pipeline(commands, on_exec)
+
+        cli.send_pipeline([Prepared(['WATCH', key]),
+                           Prepared(['GETRANGE', key, 0, MANIFEST.size - 1])],
+                          on_old)
+
+    def get(self, key, callback, sink=None):
+        """
+        Get value of the key, chunked values are returned as bytearray
+
+        :param sink:
+            Optional function which gets the value piece by piece instead;
+            callback then gets the value length, or None if there is no
+            value
+        """
+        callback = _wrap_callback(callback)
+        if sink is not None:
+            sink = stack_context.wrap(sink)
+        self._get(key, callback, sink, self._retries)
+
+    def _get(self, key, callback, sink, retries):
+        cli = self._get_client()
+
+        def on_value(resp):
+            manifest = _get_manifest(resp)
+            if manifest is None:
+                if (sink is not None and resp is not None and
+                        not isinstance(resp, Exception)):
+                    sink(resp)
+                    resp = len(resp)
+                callback(resp)
+                return
+
+            length, count, token = manifest
+            keys = self._chunk_keys(key, count, token)
+            buf = bytearray(length) if sink is None else None
+            state = {'offset': 0, 'error': None, 'lost': False}
+
+            def on_chunk(resp):
+                if state['error'] is not None or state['lost']:
+                    return
+                if resp is None:
+                    if cli.is_connected():
+                        state['error'] = ChunkError(
+                            'Chunks of %r are missing' % key)
+                    else:
+                        state['lost'] = True
+                elif isinstance(resp, Exception):
+                    state['error'] = resp
+                else:
+                    if buf is not None:
+                        offset = state['offset']
+                        buf[offset:offset + len(resp)] = resp
+                    else:
+                        sink(resp)
+                    state['offset'] += len(resp)
+
+            def on_last(resp):
+                on_chunk(resp)
+                if state['lost']:
+                    callback(None)
+                    return
+                error = state['error']
+                if error is None and state['offset'] != length:
+                    error = ChunkError('Value of %r is incomplete' % key)
+                if error is None:
+                    callback(buf if sink is None else length)
+                elif (isinstance(error, ChunkError) and sink is None and
+                        retries > 0):
+                    self._get(key, callback, sink, retries - 1)
+                else:
+                    callback(error)
+
+            for chunk_key in keys[:-1]:
+                cli._send_message(Prepared(['GET', chunk_key]), on_chunk)
+            cli._send_message(Prepared(['GET', keys[-1]]), on_last)
+
+        cli._send_message(Prepared(['GET', key]), on_value)
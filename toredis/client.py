@@ -1,8 +1,10 @@
 import logging
+import os
 import socket
+import time
 
 from collections import deque
-from functools import wraps
+from itertools import islice
 
 import hiredis
 
@@ -11,6 +13,9 @@ from tornado.ioloop import IOLoop
 from tornado import stack_context
 
 from toredis.commands import RedisCommandsMixin
+from toredis.metadata import BLOCKING_COMMANDS, SUBSCRIBE_COMMANDS
+from toredis.metrics import Metrics
+from toredis.serializers import Prepared, SerializerMixin
 
 
 logger = logging.getLogger(__name__)
@@ -22,23 +27,190 @@ except NameError:
     string = str
 
 
-class Client(RedisCommandsMixin):
+# PID of this process, refreshed in forked children. Without
+# os.register_at_fork it stays None and os.getpid() is asked every time.
+_pid = None
+if hasattr(os, 'register_at_fork'):
+    def _update_pid():
+        global _pid
+        _pid = os.getpid()
+
+    _update_pid()
+    os.register_at_fork(after_in_child=_update_pid)
+
+
+def _getpid():
+    return _pid or os.getpid()
+
+
+def _wrap_callback(callback):
+    """
+        Wrap user callback: preserve stack context and raise error replies
+    """
+    if callback is None:
+        return None
+
+    @stack_context.wrap
+    def cb(resp):
+        if isinstance(resp, Exception):
+            raise resp
+        callback(resp)
+    return cb
+
+
+class ScanIterator(object):
+    """
+        Walks SCAN, SSCAN, HSCAN or ZSCAN cursor batch by batch.
+
+        Next batch is requested as soon as the current one is received, so
+        it is usually ready when the caller asks for it. ``prefetch`` sets
+        how many batches may be buffered ahead, 0 disables prefetching.
+
+        Example::
+
+            @gen.coroutine
+            def walk(pool):
+                keys = pool.scan_iter(match='user:*', count=1000)
+                while True:
+                    batch = yield gen.Task(keys.next)
+                    if not batch:
+                        break
+                    process(batch)
+
+        Batches are returned as is: HSCAN and ZSCAN batches are flat lists
+        of fields (members) and values (scores). Redis may return a key more
+        than once during the walk.
+    """
+    def __init__(self, target, args, match=None, count=None, prefetch=1):
+        """
+            :param target:
+                Client or pool to send commands with
+            :param args:
+                Command name and key, without cursor
+        """
+        self._target = target
+        self._args = list(args)
+        if match is not None:
+            self._options = ['MATCH', match]
+        else:
+            self._options = []
+        if count is not None:
+            self._options.extend(['COUNT', count])
+        self._prefetch = prefetch
+
+        self._cursor = 0
+        self._in_flight = False
+        self._batches = deque()
+        self._waiting = None
+
+    @property
+    def finished(self):
+        """
+            True when the walk is complete and all batches are taken
+        """
+        return (self._cursor is None and not self._in_flight and
+                not self._batches)
+
+    def next(self, callback):
+        """
+            Get next batch
+
+            :param callback:
+                Callback, gets non-empty list of items, empty list when the
+                walk is complete, or None if the connection was lost
+        """
+        if self._waiting is not None:
+            raise ValueError('Previous batch is not received yet')
+        self._waiting = _wrap_callback(callback)
+        self._deliver()
+
+    def _request(self):
+        if self._cursor is None or self._in_flight:
+            return
+        if self._waiting is None and len(self._batches) >= self._prefetch:
+            return
+        self._in_flight = True
+        self._target._send_message(
+            self._args + [self._cursor] + self._options, self._on_reply)
+
+    def _on_reply(self, resp):
+        self._in_flight = False
+        if resp is None or isinstance(resp, Exception):
+            # Walk stops on the first failure
+            self._cursor = None
+            self._batches.append(resp)
+        else:
+            self._cursor = int(resp[0]) or None
+            if resp[1]:
+                self._batches.append(resp[1])
+        self._deliver()
+
+    def _deliver(self):
+        if self._waiting is not None:
+            if self._batches:
+                callback, self._waiting = self._waiting, None
+                batch = self._batches.popleft()
+                self._request()
+                callback(batch)
+                return
+            if self._cursor is None and not self._in_flight:
+                callback, self._waiting = self._waiting, None
+                callback([])
+                return
+        self._request()
+
+
+class ScanMixin(object):
+    """
+        Cursor iterators, see :class:`ScanIterator`
+    """
+    def scan_iter(self, match=None, count=None, prefetch=1):
+        return ScanIterator(self, ['SCAN'], match, count, prefetch)
+
+    def sscan_iter(self, key, match=None, count=None, prefetch=1):
+        return ScanIterator(self, ['SSCAN', key], match, count, prefetch)
+
+    def hscan_iter(self, key, match=None, count=None, prefetch=1):
+        return ScanIterator(self, ['HSCAN', key], match, count, prefetch)
+
+    def zscan_iter(self, key, match=None, count=None, prefetch=1):
+        return ScanIterator(self, ['ZSCAN', key], match, count, prefetch)
+
+
+class Client(ScanMixin, SerializerMixin, RedisCommandsMixin):
     """
         Redis client class
     """
-    def __init__(self, io_loop=None):
+    def __init__(self, io_loop=None, metrics=None, codec=None,
+                 serializer=None):
         """
             Constructor
 
             :param io_loop:
                 Optional IOLoop instance
+            :param metrics:
+                Optional :class:`~toredis.metrics.Metrics` instance to
+                report to. Pools share one instance between their clients.
+            :param codec:
+                Optional :class:`~toredis.compression.Compressor` applied
+                to values of commands and replies
+            :param serializer:
+                Optional :class:`~toredis.serializers.Serialization` applied
+                to values of commands and replies
         """
         self._io_loop = io_loop or IOLoop.instance()
 
         self._stream = None
+        self._pid = None
+        self._closing = False
 
         self.reader = None
         self.callbacks = deque()
+        self.metrics = metrics or Metrics()
+        self.codec = codec
+        self.serializer = serializer
+        # (command, send time) for every callback in self.callbacks
+        self._pending = deque()
 
         self._sub_callback = None
 
@@ -82,6 +254,12 @@ class Client(RedisCommandsMixin):
         """
         return bool(self._stream) and not self._stream.closed()
 
+    def snapshot_metrics(self):
+        """
+            Return dictionary with metrics of this connection
+        """
+        return self.metrics.snapshot([self])
+
     def send_message(self, args, callback=None):
         """
             Send command to redis
@@ -91,24 +269,165 @@ class Client(RedisCommandsMixin):
             :param callback:
                 Callback
         """
+        self._send_message(args, _wrap_callback(callback))
+
+    def send_pipeline(self, commands, callback=None):
+        """
+            Send several commands at once
+
+            :param commands:
+                List of argument lists
+            :param callback:
+                Callback, gets list of replies. Error replies are returned
+                as exception instances, replies lost on disconnect as None.
+        """
+        if callback is not None:
+            callback = stack_context.wrap(callback)
+        if not commands:
+            if callback is not None:
+                callback([])
+            return
+
+        replies = []
+
+        def on_reply(resp):
+            replies.append(resp)
+            if len(replies) == len(commands) and callback is not None:
+                callback(replies)
+
+        codec = self.codec
+        if codec is not None and codec.should_offload(commands):
+            callbacks = [on_reply] * len(commands)
+            if self.serializer is not None:
+                serialized = [self._serialize(args, on_reply)
+                              for args in commands]
+                commands = [args for args, cb in serialized]
+                callbacks = [cb for args, cb in serialized]
+
+            def on_encoded(future):
+                encoded, stats = future.result()
+                codec.merge_stats(stats)
+                for args, encoded_args, cb in zip(commands, encoded,
+                                                  callbacks):
+                    self._write_message(encoded_args,
+                                        codec.wrap_callback(args, cb))
+
+            self._io_loop.add_future(
+                codec.executor.submit(codec.encode_commands, commands),
+                on_encoded)
+            return
+
+        for args in commands:
+            self._send_message(args, on_reply)
+
+    def bulk_load(self, commands, callback=None, window=10000,
+                  chunk_size=1000):
+        """
+            Send a large number of commands, for example from a generator.
+
+            Commands are encoded and written in chunks of ``chunk_size``,
+            at most ``window`` replies are outstanding at any time.
+            Replies are counted, not stored.
+
+            :param commands:
+                Iterable of argument lists
+            :param callback:
+                Callback, gets dictionary with numbers of ``sent`` commands
+                and received ``replies``, and ``errors``: list of (command
+                index, error reply). If the connection is lost, loading
+                stops and the first lost command is reported with None.
+        """
+        if self._pid != _getpid():
+            raise ValueError('Connection was inherited from parent process')
+        if self._sub_callback is not None:
+            raise ValueError('Cannot run normal command over PUBSUB '
+                             'connection')
+        if callback is not None:
+            callback = stack_context.wrap(callback)
+        commands = iter(commands)
+        chunk_size = min(chunk_size, window)
+        state = {'sent': 0, 'replies': 0, 'errors': [], 'exhausted': False,
+                 'lost': False}
+
+        def finish():
+            if callback is not None:
+                callback({'sent': state['sent'], 'replies': state['replies'],
+                          'errors': state['errors']})
+
+        def feed():
+            format_message = self.format_message
+            while (not state['exhausted'] and
+                   state['sent'] - state['replies'] + chunk_size <= window):
+                chunk = list(islice(commands, chunk_size))
+                if len(chunk) < chunk_size:
+                    state['exhausted'] = True
+                if not chunk:
+                    break
+                if self.serializer is not None:
+                    chunk = [self._serialize(args, None)[0]
+                             for args in chunk]
+                if self.codec is not None:
+                    chunk = [self.codec.encode(args) for args in chunk]
+                data = b''.join([format_message(args) for args in chunk])
+                now = time.time()
+                self._stream.write(data)
+                self.metrics.bytes_written += len(data)
+                self.callbacks.extend([on_reply] * len(chunk))
+                self._pending.extend([(args[0], now) for args in chunk])
+                state['sent'] += len(chunk)
+            if state['exhausted'] and state['replies'] == state['sent']:
+                finish()
+
+        def on_reply(resp):
+            if state['lost']:
+                return
+            if resp is None:
+                # Connection is lost, the rest of replies are None too
+                state['lost'] = True
+                state['errors'].append((state['replies'], None))
+                finish()
+                return
+            if isinstance(resp, Exception):
+                state['errors'].append((state['replies'], resp))
+            state['replies'] += 1
+            if not state['exhausted']:
+                feed()
+            elif state['replies'] == state['sent']:
+                finish()
+
+        feed()
+
+    def _send_message(self, args, callback):
+        # Callback receives raw replies, including error objects
+        if self.serializer is not None:
+            args, callback = self._serialize(args, callback)
+        if self.codec is not None:
+            callback = self.codec.wrap_callback(args, callback)
+            args = self.codec.encode(args)
+        self._write_message(args, callback)
+
+    def _serialize(self, args, callback):
+        if isinstance(args, Prepared):
+            return args, callback
+        return (self.serializer.encode(args),
+                self.serializer.wrap_callback(args, callback))
+
+    def _write_message(self, args, callback):
+        if self._pid != (_pid or os.getpid()):
+            raise ValueError('Connection was inherited from parent process')
+
         # Special case for pub-sub
         cmd = args[0]
 
-        if (self._sub_callback is not None and
-            cmd not in ('PSUBSCRIBE', 'SUBSCRIBE', 'PUNSUBSCRIBE', 'UNSUBSCRIBE')):
+        if self._sub_callback is not None and cmd not in SUBSCRIBE_COMMANDS:
             raise ValueError('Cannot run normal command over PUBSUB connection')
 
         # Send command
-        self._stream.write(self.format_message(args))
-        cb = callback
-        if callback is not None:
-            @stack_context.wrap
-            @wraps(callback)
-            def cb(resp):
-                if isinstance(resp, Exception):
-                    raise resp
-                callback(resp)
-        self.callbacks.append(cb)
+        data = self.format_message(args)
+        self._stream.write(data)
+        self.metrics.bytes_written += len(data)
+        self.callbacks.append(callback)
+        self._pending.append((cmd, time.time()))
 
     def format_message(self, args):
         """
@@ -134,6 +453,7 @@ class Client(RedisCommandsMixin):
         """
             Close redis connection
         """
+        self._closing = True
         self.quit()
         self._stream.close()
 
@@ -170,6 +490,10 @@ class Client(RedisCommandsMixin):
 
     # Helpers
     def _connect(self, sock, addr, callback):
+        if self._stream is not None:
+            self.metrics.reconnects += 1
+        self.metrics.connects += 1
+        self._pid = _getpid()
         self._reset()
 
         self._stream = IOStream(sock, io_loop=self._io_loop)
@@ -179,6 +503,8 @@ class Client(RedisCommandsMixin):
     # Event handlers
     def _on_read(self, data):
         self.reader.feed(data)
+        self.metrics.bytes_read += len(data)
+        now = time.time()
 
         resp = self.reader.gets()
 
@@ -191,6 +517,10 @@ class Client(RedisCommandsMixin):
             else:
                 if self.callbacks:
                     callback = self.callbacks.popleft()
+                    if self._pending:
+                        cmd, sent = self._pending.popleft()
+                        self.metrics.observe_latency(cmd, now - sent)
+                    self.metrics.consecutive_failures = 0
                     if callback is not None:
                         try:
                             callback(resp)
@@ -210,6 +540,12 @@ class Client(RedisCommandsMixin):
         # Trigger any pending callbacks
         callbacks = self.callbacks
         self.callbacks = deque()
+        self._pending = deque()
+
+        # Connection error or replies lost
+        if not self._closing and (callbacks or self._stream.error is not None):
+            self.metrics.failures += 1
+            self.metrics.consecutive_failures += 1
 
         if callbacks:
             for cb in callbacks:
@@ -229,33 +565,125 @@ class Client(RedisCommandsMixin):
         # Trigger on_disconnect
         self.on_disconnect()
 
+    def _close_inherited(self):
+        # Close socket inherited from parent process without sending QUIT
+        # and without touching IOLoop or callbacks of the parent
+        if self._stream is not None and self._stream.socket is not None:
+            self._stream.socket.close()
+        self._stream = None
+        self.callbacks = deque()
+        self._pending = deque()
+
     def _reset(self):
         self.reader = hiredis.Reader()
         self._sub_callback = None
+        self._closing = False
+
+
+class ClientPool(ScanMixin, SerializerMixin, RedisCommandsMixin):
+    """
+        Pool of multiplexed redis connections.
 
+        Blocking commands (BLPOP, BRPOP, BRPOPLPUSH) never go to the shared
+        connections: each of them takes an exclusive connection from a
+        separate sub-pool limited by ``max_blocking_clients``. When all of
+        them are busy, blocking commands wait in a queue.
 
-class ClientPool(RedisCommandsMixin):
+        The pool may be created before forking: when it is used in a child
+        process, inherited connections are dropped and ``min_clients`` new
+        ones are opened. Call :meth:`warm_up` right after forking to open
+        them in advance.
+    """
     #TODO: improve (taking a client from the pool to make transaction)
 
     client_cls = Client
 
     def __init__(self, db=0, password=None, host='localhost', port=6379,
-                    unix_socket=None, max_clients=100, io_loop=None):
+                    unix_socket=None, max_clients=100, io_loop=None,
+                    max_blocking_clients=10, min_clients=0, codec=None,
+                    serializer=None):
         self._db = db
         self._password = password
         self._host = host
         self._port = port
         self._unix_socket = unix_socket
         self._max_clients = max_clients
+        self._min_clients = min_clients
         self._pool = []
-        self._io_loop = io_loop or IOLoop.instance()
+        # Without explicit IOLoop clients use the IOLoop instance of the
+        # process they are created in
+        self._io_loop = io_loop
+        self._pid = _getpid()
+        self.metrics = Metrics()
+        self.codec = codec
+        self.serializer = serializer
+
+        self._max_blocking_clients = max_blocking_clients
+        self._blocking_clients = []
+        self._blocking_pool = []
+        self._blocking_queue = deque()
 
     def send_message(self, args, callback=None):
-        self.get_client().send_message(args, callback)
+        self._send_message(args, _wrap_callback(callback))
+
+    def send_pipeline(self, commands, callback=None):
+        """
+            Send several commands over one connection, see
+            :meth:`Client.send_pipeline`. Commands must not be blocking.
+        """
+        self.get_client().send_pipeline(commands, callback)
+
+    def bulk_load(self, commands, callback=None, window=10000,
+                  chunk_size=1000):
+        """
+            Send commands over one connection, see :meth:`Client.bulk_load`
+        """
+        self.get_client().bulk_load(commands, callback, window, chunk_size)
+
+    def _send_message(self, args, callback):
+        if args[0] in BLOCKING_COMMANDS:
+            self._check_pid()
+            self._send_blocking(args, callback)
+        else:
+            self.get_client()._send_message(args, callback)
 
     def make_client(self):
-        cli = self.client_cls(self._io_loop)
+        cli = self._connect_client()
         self._pool.insert(0, cli)
+        return cli
+
+    def warm_up(self):
+        """
+            Open connections up to ``min_clients``
+        """
+        self._check_pid()
+        while len(self._pool) < self._min_clients:
+            self.make_client()
+
+    def _check_pid(self):
+        if self._pid != _getpid():
+            self._reset_after_fork()
+
+    def _reset_after_fork(self):
+        for cli in self._pool + self._blocking_clients:
+            cli._close_inherited()
+        self._pool = []
+        self._blocking_clients = []
+        self._blocking_pool = []
+        self._blocking_queue = deque()
+        self.metrics = Metrics()
+        self._pid = _getpid()
+        self.warm_up()
+
+    def snapshot_metrics(self):
+        """
+            Return dictionary with metrics of all pool connections
+        """
+        return self.metrics.snapshot(self._pool + self._blocking_clients)
+
+    def _connect_client(self):
+        cli = self.client_cls(self._io_loop, metrics=self.metrics,
+                              codec=self.codec, serializer=self.serializer)
         if self._unix_socket is not None:
             cli.connect_usocket(self._unix_socket)
         else:
@@ -265,7 +693,60 @@ class ClientPool(RedisCommandsMixin):
         cli.select(self._db)
         return cli
 
+    def _send_blocking(self, args, callback, asking=False):
+        # ``asking`` sends ASKING first on the same connection, for
+        # commands redirected by a cluster node with ASK
+        cli = self._take_blocking()
+        if cli is None:
+            if len(self._blocking_clients) >= self._max_blocking_clients:
+                self._blocking_queue.append((args, callback, asking,
+                                             time.time()))
+                return
+            cli = self._connect_client()
+            self._blocking_clients.append(cli)
+
+        @stack_context.wrap
+        def on_reply(resp):
+            self._release_blocking(cli)
+            if callback is not None:
+                callback(resp)
+            elif isinstance(resp, Exception):
+                logger.error(resp)
+
+        if asking:
+            cli._send_message(['ASKING'], None)
+        cli._send_message(args, on_reply)
+
+    def _take_blocking(self):
+        # Idle connection of the blocking sub-pool, None if there is none
+        while self._blocking_pool:
+            cli = self._blocking_pool.pop()
+            if cli.is_connected():
+                return cli
+            # Closed by server while idle, free its slot
+            self._blocking_clients.remove(cli)
+            self.metrics.reconnects += 1
+        return None
+
+    def _release_blocking(self, cli):
+        if cli.is_connected():
+            self._blocking_pool.append(cli)
+        else:
+            self._blocking_clients.remove(cli)
+            self.metrics.reconnects += 1
+
+        if self._blocking_queue:
+            args, callback, asking, queued = self._blocking_queue.popleft()
+            self.metrics.pool_wait.observe(time.time() - queued)
+            self._send_blocking(args, callback, asking)
+
     def get_client(self):
+        self._check_pid()
+        # Drop connections closed by server or network errors, new ones
+        # are opened in their place
+        connected = [cli for cli in self._pool if cli.is_connected()]
+        self.metrics.reconnects += len(self._pool) - len(connected)
+        self._pool = connected
         if not self._pool:
             return self.make_client()
         self._pool.sort(key=lambda c: len(c.callbacks))
@@ -0,0 +1,285 @@
+"""
+Redis Cluster client: routes commands by key slot, follows MOVED and ASK
+redirections and keeps one ClientPool per master.
+"""
+import logging
+
+from tornado import stack_context
+
+from toredis.client import ClientPool, _wrap_callback
+from toredis.commands import RedisCommandsMixin
+from toredis.hashing import hash_tag
+from toredis.keys import get_keys
+from toredis.metadata import BLOCKING_COMMANDS
+
+
+logger = logging.getLogger(__name__)
+
+
+NUM_SLOTS = 16384
+
+
+def _make_crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = (crc << 1) ^ 0x1021
+            else:
+                crc <<= 1
+        table.append(crc & 0xffff)
+    return table
+
+
+_CRC16_TABLE = _make_crc16_table()
+
+
+def crc16(data):
+    """
+    CRC16-CCITT (XMODEM), the checksum used by Redis Cluster
+    """
+    crc = 0
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xff00) ^ _CRC16_TABLE[((crc >> 8) ^ byte) & 0xff]
+    return crc
+
+
+def key_slot(key):
+    """
+    Return cluster slot of the key, hash tags included
+    """
+    return crc16(hash_tag(key)) % NUM_SLOTS
+
+
+def _parse_redirect(resp):
+    # 'MOVED 3999 127.0.0.1:6381' -> ('MOVED', 3999, ('127.0.0.1', 6381))
+    if not isinstance(resp, Exception):
+        return None
+    parts = str(resp).split(' ')
+    if len(parts) != 3 or parts[0] not in ('MOVED', 'ASK'):
+        return None
+    host, port = parts[2].rsplit(':', 1)
+    return parts[0], int(parts[1]), (host, int(port))
+
+
+def _to_str(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class RedisCluster(RedisCommandsMixin):
+    """
+    Redis Cluster router.
+
+    Slot map is loaded with CLUSTER SLOTS from any of ``startup_nodes``
+    on the first command. Commands are sent to the master owning the slot
+    of their keys; all keys of one command must be in one slot (use hash
+    tags). Commands without keys go to any master. On MOVED the slot map
+    is updated at once and reloaded in background; on ASK the command is
+    sent once to the given node preceded by ASKING.
+    """
+
+    pool_cls = ClientPool # should be a subclass of ClientPool
+
+    def __init__(self, startup_nodes, max_clients=100, password=None,
+                 max_redirects=5, io_loop=None):
+        """
+        :param startup_nodes:
+            list of (host, port) tuples
+        """
+        self.startup_nodes = [(host, int(port))
+                              for host, port in startup_nodes]
+        self._max_clients = max_clients
+        self._password = password
+        self._max_redirects = max_redirects
+        self._io_loop = io_loop
+
+        self._pools = {}
+        self._slots = None
+        self._refreshing = False
+        self._waiting = []
+
+    # Slot map
+    def get_pool(self, addr):
+        """
+        Return pool for (host, port) address
+        """
+        pool = self._pools.get(addr)
+        if pool is None:
+            pool = self._pools[addr] = self.pool_cls(
+                host=addr[0], port=addr[1], password=self._password,
+                max_clients=self._max_clients, io_loop=self._io_loop)
+        return pool
+
+    def get_addr(self, slot):
+        """
+        Return (host, port) of the master owning the slot
+        """
+        addr = self._slots[slot] if self._slots else None
+        return addr or self.startup_nodes[0]
+
+    def refresh_slots(self, callback=None):
+        """
+        Load slot map with CLUSTER SLOTS
+
+        :param callback:
+            Optional callback, called when the map is loaded
+        """
+        if callback is not None:
+            self._waiting.append(((), stack_context.wrap(callback)))
+        if self._refreshing:
+            return
+        self._refreshing = True
+        addrs = list(self.startup_nodes)
+        for addr in self._pools:
+            if addr not in addrs:
+                addrs.append(addr)
+        self._load_slots(addrs)
+
+    def _load_slots(self, addrs):
+        addr = addrs[0]
+
+        def on_reply(replies):
+            resp = replies[0]
+            if resp is None or isinstance(resp, Exception):
+                logger.error('CLUSTER SLOTS failed on %s:%s: %r',
+                             addr[0], addr[1], resp)
+                if len(addrs) > 1:
+                    self._load_slots(addrs[1:])
+                    return
+            else:
+                self._set_slots(resp)
+            self._refreshing = False
+            self._flush_waiting()
+
+        self.get_pool(addr).send_pipeline([['CLUSTER', 'SLOTS']], on_reply)
+
+    def _set_slots(self, resp):
+        slots = [None] * NUM_SLOTS
+        for entry in resp:
+            start, end, master = entry[0], entry[1], entry[2]
+            addr = (_to_str(master[0]), int(master[1]))
+            for slot in range(int(start), int(end) + 1):
+                slots[slot] = addr
+        self._slots = slots
+
+    def _flush_waiting(self):
+        waiting = self._waiting
+        self._waiting = []
+        for args, callback in waiting:
+            if not args:
+                if callback is not None:
+                    callback(self._slots is not None)
+            elif self._slots is not None:
+                self._send_message(args, callback)
+            elif callback is not None:
+                # No node answered CLUSTER SLOTS
+                callback(None)
+
+    # Commands
+    def get_slot(self, args):
+        """
+        Return slot of command keys, None for commands without keys
+        """
+        keys = get_keys(args)
+        if not keys:
+            return None
+        slot = key_slot(keys[0])
+        for key in keys[1:]:
+            if key_slot(key) != slot:
+                raise ValueError('Keys of %s are in different slots' % args[0])
+        return slot
+
+    def send_message(self, args, callback=None):
+        self._send_message(args, _wrap_callback(callback))
+
+    def _send_message(self, args, callback):
+        if self._slots is None:
+            self._waiting.append((args, callback))
+            self.refresh_slots()
+            return
+        slot = self.get_slot(args)
+        addr = self.get_addr(slot) if slot is not None else self.get_addr(0)
+        self._send_to(addr, args, callback, 0, False)
+
+    def _send_to(self, addr, args, callback, redirects, asking):
+        pool = self.get_pool(addr)
+        on_reply = self._make_reply_handler(args, callback, redirects)
+        if not asking:
+            pool._send_message(args, on_reply)
+        elif args[0] in BLOCKING_COMMANDS:
+            pool._send_blocking(args, on_reply, asking=True)
+        else:
+            # ASKING applies to the next command of the connection
+            cli = pool.get_client()
+            cli._send_message(['ASKING'], None)
+            cli._send_message(args, on_reply)
+
+    def _make_reply_handler(self, args, callback, redirects):
+        def on_reply(resp):
+            if self._follow_redirect(args, resp, callback, redirects):
+                return
+            if callback is not None:
+                callback(resp)
+            elif isinstance(resp, Exception):
+                logger.error(resp)
+        return on_reply
+
+    def _follow_redirect(self, args, resp, callback, redirects):
+        redirect = _parse_redirect(resp)
+        if redirect is None or redirects >= self._max_redirects:
+            return False
+        kind, slot, addr = redirect
+        if kind == 'MOVED':
+            if self._slots is not None:
+                self._slots[slot] = addr
+            self.refresh_slots()
+        self._send_to(addr, args, callback, redirects + 1, kind == 'ASK')
+        return True
+
+    def send_pipeline(self, commands, callback=None):
+        """
+        Send commands pipelined per slot owner, callback gets list of raw
+        replies in order of commands
+        """
+        if callback is not None:
+            callback = stack_context.wrap(callback)
+        if self._slots is None:
+            def on_loaded(loaded):
+                if loaded:
+                    self.send_pipeline(commands, callback)
+                elif callback is not None:
+                    callback([None] * len(commands))
+            self.refresh_slots(on_loaded)
+            return
+
+        result = [None] * len(commands)
+        state = {'pending': len(commands)}
+
+        def set_reply(idx, resp):
+            result[idx] = resp
+            state['pending'] -= 1
+            if state['pending'] == 0 and callback is not None:
+                callback(result)
+
+        if not commands:
+            if callback is not None:
+                callback(result)
+            return
+
+        groups = {}
+        for idx, args in enumerate(commands):
+            slot = self.get_slot(args)
+            addr = self.get_addr(slot if slot is not None else 0)
+            groups.setdefault(addr, []).append(idx)
+
+        for addr, indexes in groups.items():
+            def on_replies(replies, indexes=indexes):
+                for idx, resp in zip(indexes, replies):
+                    handler = lambda resp, idx=idx: set_reply(idx, resp)
+                    if not self._follow_redirect(commands[idx], resp,
+                                                 handler, 0):
+                        set_reply(idx, resp)
+
+            self.get_pool(addr).send_pipeline(
+                [commands[idx] for idx in indexes], on_replies)
@@ -702,6 +702,32 @@ class RedisCommandsMixin(object):
             _args.append(value)
         self.send_message(_args, callback)
 
+    def hscan(self, key, cursor, match=None, count=None, callback=None):
+        """
+        Incrementally iterate hash fields and associated values
+
+            :param key:
+            :param cursor:
+            :param match:
+            :param count:
+
+        Complexity
+        ----------
+        O(1) for every call. O(N) for a complete iteration, including enough
+        command calls for the cursor to return back to 0. N is the number of
+        elements inside the collection.
+        """
+        _args = ["HSCAN"]
+        _args.append(key)
+        _args.append(cursor)
+        if match:
+            _args.append("MATCH")
+            _args.append(match)
+        if count:
+            _args.append("COUNT")
+            _args.append(count)
+        self.send_message(_args, callback)
+
     def hset(self, key, field, value, callback=None):
         """
         Set the string value of a hash field
@@ -1473,6 +1499,30 @@ class RedisCommandsMixin(object):
         _args = ["SAVE"]
         self.send_message(_args, callback)
 
+    def scan(self, cursor, match=None, count=None, callback=None):
+        """
+        Incrementally iterate the keys space
+
+            :param cursor:
+            :param match:
+            :param count:
+
+        Complexity
+        ----------
+        O(1) for every call. O(N) for a complete iteration, including enough
+        command calls for the cursor to return back to 0. N is the number of
+        elements inside the collection.
+        """
+        _args = ["SCAN"]
+        _args.append(cursor)
+        if match:
+            _args.append("MATCH")
+            _args.append(match)
+        if count:
+            _args.append("COUNT")
+            _args.append(count)
+        self.send_message(_args, callback)
+
     def scard(self, key, callback=None):
         """
         Get the number of members in a set
@@ -1910,6 +1960,32 @@ class RedisCommandsMixin(object):
             _args.extend(members)
         self.send_message(_args, callback)
 
+    def sscan(self, key, cursor, match=None, count=None, callback=None):
+        """
+        Incrementally iterate Set elements
+
+            :param key:
+            :param cursor:
+            :param match:
+            :param count:
+
+        Complexity
+        ----------
+        O(1) for every call. O(N) for a complete iteration, including enough
+        command calls for the cursor to return back to 0. N is the number of
+        elements inside the collection.
+        """
+        _args = ["SSCAN"]
+        _args.append(key)
+        _args.append(cursor)
+        if match:
+            _args.append("MATCH")
+            _args.append(match)
+        if count:
+            _args.append("COUNT")
+            _args.append(count)
+        self.send_message(_args, callback)
+
     def strlen(self, key, callback=None):
         """
         Get the length of the value stored in a key
@@ -2377,6 +2453,32 @@ class RedisCommandsMixin(object):
         _args.append(member)
         self.send_message(_args, callback)
 
+    def zscan(self, key, cursor, match=None, count=None, callback=None):
+        """
+        Incrementally iterate sorted sets elements and associated scores
+
+            :param key:
+            :param cursor:
+            :param match:
+            :param count:
+
+        Complexity
+        ----------
+        O(1) for every call. O(N) for a complete iteration, including enough
+        command calls for the cursor to return back to 0. N is the number of
+        elements inside the collection.
+        """
+        _args = ["ZSCAN"]
+        _args.append(key)
+        _args.append(cursor)
+        if match:
+            _args.append("MATCH")
+            _args.append(match)
+        if count:
+            _args.append("COUNT")
+            _args.append(count)
+        self.send_message(_args, callback)
+
     def zscore(self, key, member, callback=None):
         """
         Get the score associated with the given member in a sorted set
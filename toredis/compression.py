@@ -0,0 +1,249 @@
+"""
+Transparent compression of values.
+
+A :class:`Compressor` given to a Client or ClientPool as ``codec``
+compresses values of write commands (SET, MSET, HSET, HMSET...) before
+they are formatted and decompresses replies of read commands (GET, MGET,
+HGET, HGETALL...). Compressed values start with the ``MAGIC`` byte and
+the id of the codec, so compressed and plain values can be stored side
+by side and a policy can be changed at any time. Plain values which
+happen to start with ``MAGIC`` are escaped with codec id 0.
+
+Example::
+
+    compressor = Compressor(policies=[('session:*', None),
+                                      ('report:*', Policy(threshold=256))])
+    pool = ClientPool(codec=compressor)
+"""
+import re
+import struct
+import time
+import zlib
+from fnmatch import translate
+
+from toredis.hashing import to_bytes
+
+
+MAGIC = b'\xff'
+RAW = 0
+
+# name: (id, compress, decompress)
+CODECS = {}
+_CODEC_IDS = {}
+
+
+def register_codec(codec_id, name, compress, decompress):
+    """
+    Register compression codec
+
+    :param codec_id:
+        Number from 1 to 255 stored in every value, must never change
+    :param compress:
+        Function of bytes returning compressed bytes
+    """
+    if not 0 < codec_id < 256:
+        raise ValueError('Codec id must be from 1 to 255')
+    if codec_id in _CODEC_IDS and _CODEC_IDS[codec_id][0] != name:
+        raise ValueError('Codec id %d is used by %s' %
+                         (codec_id, _CODEC_IDS[codec_id][0]))
+    CODECS[name] = (codec_id, compress, decompress)
+    _CODEC_IDS[codec_id] = (name, decompress)
+
+
+register_codec(1, 'zlib', zlib.compress, zlib.decompress)
+
+
+# command: (position of the first value, step between values or 0 for a
+# single value, True if every value is preceded by its key)
+WRITE_COMMANDS = {
+    'SET': (2, 0, False),
+    'SETNX': (2, 0, False),
+    'GETSET': (2, 0, False),
+    'SETEX': (3, 0, False),
+    'PSETEX': (3, 0, False),
+    'MSET': (2, 2, True),
+    'MSETNX': (2, 2, True),
+    'HSET': (3, 0, False),
+    'HSETNX': (3, 0, False),
+    'HMSET': (3, 2, False),
+}
+
+SINGLE, LIST, PAIRS = 0, 1, 2
+
+READ_COMMANDS = {
+    'GET': SINGLE,
+    'GETSET': SINGLE,
+    'HGET': SINGLE,
+    'MGET': LIST,
+    'HMGET': LIST,
+    'HVALS': LIST,
+    'HGETALL': PAIRS,
+}
+
+
+def _escape(value):
+    if value[:1] == MAGIC:
+        return MAGIC + b'\x00' + value
+    return value
+
+
+def _unescape(value):
+    return value[2:]
+
+
+class Policy(object):
+    """
+    Values of at least ``threshold`` bytes are compressed with ``codec``.
+    A compressed value is stored only if it is smaller than ``max_ratio``
+    of the original.
+    """
+
+    def __init__(self, codec='zlib', threshold=1024, max_ratio=0.9):
+        codec_id, self.compress = CODECS[codec][:2]
+        self.prefix = MAGIC + struct.pack('B', codec_id)
+        self.threshold = threshold
+        self.max_ratio = max_ratio
+
+
+def _new_stats():
+    return {'compressed': 0, 'stored_plain': 0, 'decompressed': 0,
+            'bytes_in': 0, 'bytes_out': 0,
+            'compress_time': 0.0, 'decompress_time': 0.0}
+
+
+class Compressor(object):
+    """
+    Codec stage of Client and ClientPool.
+
+    ``policies`` is a list of (key pattern, :class:`Policy` or None) in
+    glob syntax; the first matching pattern wins, None disables compression
+    of matching keys. Other keys use ``default``.
+
+    With ``executor`` (for example
+    ``concurrent.futures.ThreadPoolExecutor``), pipelines whose values
+    are at least ``offload_threshold`` bytes in total are compressed in it
+    instead of on the IOLoop. Such pipelines are sent once compressed, so
+    commands sent meanwhile may run before them.
+    """
+
+    def __init__(self, policies=(), default=None, executor=None,
+                 offload_threshold=1024 * 1024):
+        self._policies = [(re.compile(translate(pattern).encode('utf-8')),
+                           policy) for pattern, policy in policies]
+        self.default = default if default is not None else Policy()
+        self.executor = executor
+        self._offload_threshold = offload_threshold
+        self.stats = _new_stats()
+
+    def get_policy(self, key):
+        key = to_bytes(key)
+        for regex, policy in self._policies:
+            if regex.match(key):
+                return policy
+        return self.default
+
+    def snapshot(self):
+        """
+        Return stats with ``ratio`` of compressed to original size of
+        compressed values
+        """
+        stats = dict(self.stats)
+        stats['ratio'] = (float(stats['bytes_out']) / stats['bytes_in']
+                          if stats['bytes_in'] else 1.0)
+        return stats
+
+    # Write path
+    def encode_value(self, key, value, stats=None):
+        if stats is None:
+            stats = self.stats
+        value = to_bytes(value)
+        policy = self.get_policy(key)
+        if policy is None or len(value) < policy.threshold:
+            return _escape(value)
+        started = time.time()
+        compressed = policy.compress(value)
+        stats['compress_time'] += time.time() - started
+        if len(compressed) + 2 > len(value) * policy.max_ratio:
+            stats['stored_plain'] += 1
+            return _escape(value)
+        stats['compressed'] += 1
+        stats['bytes_in'] += len(value)
+        stats['bytes_out'] += len(compressed) + 2
+        return policy.prefix + compressed
+
+    def encode(self, args, stats=None):
+        """
+        Return arguments with values encoded
+        """
+        spec = WRITE_COMMANDS.get(args[0])
+        if spec is None:
+            return args
+        first, step, keyed = spec
+        args = list(args)
+        positions = range(first, len(args), step) if step else [first]
+        for pos in positions:
+            key = args[pos - 1] if keyed else args[1]
+            args[pos] = self.encode_value(key, args[pos], stats)
+        return args
+
+    def encode_commands(self, commands):
+        """
+        Encode list of commands, return them with stats of the work.
+        Safe to run in another thread.
+        """
+        stats = _new_stats()
+        return [self.encode(args, stats) for args in commands], stats
+
+    def should_offload(self, commands):
+        if self.executor is None:
+            return False
+        total = 0
+        for args in commands:
+            spec = WRITE_COMMANDS.get(args[0])
+            if spec is not None:
+                first, step, keyed = spec
+                for pos in (range(first, len(args), step) if step
+                            else [first]):
+                    total += len(to_bytes(args[pos]))
+        return total >= self._offload_threshold
+
+    def merge_stats(self, stats):
+        for name, value in stats.items():
+            self.stats[name] += value
+
+    # Read path
+    def decode_value(self, value):
+        if (not isinstance(value, bytes) or len(value) < 2 or
+                value[:1] != MAGIC):
+            return value
+        codec_id = bytearray(value[1:2])[0]
+        if codec_id == RAW:
+            return _unescape(value)
+        if codec_id not in _CODEC_IDS:
+            return value
+        started = time.time()
+        result = _CODEC_IDS[codec_id][1](value[2:])
+        self.stats['decompress_time'] += time.time() - started
+        self.stats['decompressed'] += 1
+        return result
+
+    def wrap_callback(self, args, callback):
+        """
+        Return callback which decodes reply of the command
+        """
+        kind = READ_COMMANDS.get(args[0])
+        if kind is None or callback is None:
+            return callback
+        decode = self.decode_value
+
+        def on_reply(resp):
+            if isinstance(resp, list):
+                if kind == PAIRS:
+                    resp = [decode(item) if idx % 2 else item
+                            for idx, item in enumerate(resp)]
+                else:
+                    resp = [decode(item) for item in resp]
+            else:
+                resp = decode(resp)
+            callback(resp)
+        return on_reply
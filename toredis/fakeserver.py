@@ -0,0 +1,1264 @@
+"""
+In-process stand-in for a redis server.
+
+:class:`FakeServer` speaks RESP over TCP on the IOLoop of the process and
+keeps data in dictionaries. It implements common string, hash, list, set,
+sorted set, keyspace, transaction and pub/sub commands, enough to run
+clients, pools, benchmarks and tests without a real server::
+
+    server = FakeServer()
+    port = server.bind_unused_port()
+    pool = ClientPool(port=port)
+
+Commands run in the order they arrive, so results are deterministic.
+Nothing is persisted.
+
+Faults make the server misbehave in a controlled way. Each one matches
+commands by name and key pattern, optionally only ``times`` times::
+
+    server.latency = 0.01                       # every reply
+    server.add_fault(Delay(0.5, command='GET'))
+    server.add_fault(Drop(command='SET', times=1))
+    server.add_fault(SplitWrite(chunk_size=3))
+    server.add_fault(Oversized(64 * 1024 * 1024, command='GET'))
+    server.add_fault(Redirect('MOVED', other.port, key='user:*'))
+"""
+import bisect
+import fnmatch
+import inspect
+import marshal
+import socket
+import time
+from collections import deque
+
+import hiredis
+from tornado.netutil import bind_sockets
+from tornado.tcpserver import TCPServer
+
+from toredis.cluster import key_slot
+from toredis.keys import get_keys
+from toredis.metadata import WRITE_COMMANDS
+
+
+class Status(bytes):
+    """
+    Status reply, sent as ``+OK`` instead of a bulk string
+    """
+
+
+OK = Status(b'OK')
+PONG = Status(b'PONG')
+QUEUED = Status(b'QUEUED')
+
+# Reply of commands which answer later or several times
+NO_REPLY = object()
+
+
+class CommandError(Exception):
+    """
+    Error reply of a command
+    """
+
+
+class WrongArguments(CommandError):
+    """
+    Raised by commands which got a wrong number of variable arguments
+    """
+
+
+WRONGTYPE = 'WRONGTYPE Operation against a key holding the wrong kind of ' \
+    'value'
+
+
+try:
+    _getargspec = inspect.getfullargspec
+except AttributeError:
+    _getargspec = inspect.getargspec
+
+
+def _arity(handler):
+    """
+    Return (minimum, maximum) number of arguments of a command handler,
+    maximum is None for variadic commands
+    """
+    spec = _getargspec(handler)
+    # self and conn are not arguments of the command
+    count = len(spec.args) - 2
+    return (count - len(spec.defaults or ()),
+            None if spec.varargs else count)
+
+
+def encode_reply(value):
+    """
+    Return RESP encoding of a reply
+    """
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, Status):
+        return b'+' + value + b'\r\n'
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return b':' + str(value).encode('ascii') + b'\r\n'
+    if isinstance(value, Exception):
+        return b'-' + str(value).encode('utf-8') + b'\r\n'
+    if isinstance(value, (list, tuple)):
+        return (b'*' + str(len(value)).encode('ascii') + b'\r\n' +
+                b''.join([encode_reply(item) for item in value]))
+    if not isinstance(value, bytes):
+        value = str(value).encode('utf-8')
+    return (b'$' + str(len(value)).encode('ascii') + b'\r\n' + value +
+            b'\r\n')
+
+
+class _Hash(dict):
+    pass
+
+
+class _SortedSet(dict):
+    pass
+
+
+# DUMP payload: type tag and marshalled value, not compatible with redis
+_DUMP_TYPES = [(bytes, b's'), (list, b'l'), (set, b'S'), (_Hash, b'h'),
+               (_SortedSet, b'z')]
+_BAD_PAYLOAD = 'ERR DUMP payload version or checksum are wrong'
+
+
+def _int(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise CommandError('ERR value is not an integer or out of range')
+
+
+def _float(value):
+    try:
+        return float(value)
+    except ValueError:
+        raise CommandError('ERR value is not a valid float')
+
+
+def _score_bound(value):
+    # '(1.5' is exclusive, '-inf' and '+inf' are infinite
+    if value[:1] == b'(':
+        return _float(value[1:]), True
+    return _float(value), False
+
+
+def _wrong_arguments(name):
+    return CommandError("ERR wrong number of arguments for '%s' command" %
+                        name)
+
+
+def _first_key(request):
+    keys = get_keys([request[0].decode('utf-8', 'replace').upper()] +
+                    list(request[1:]))
+    return keys[0] if keys else None
+
+
+def _format_score(score):
+    if score == int(score) and abs(score) < 1e17:
+        return str(int(score)).encode('ascii')
+    return repr(score).encode('ascii')
+
+
+# Faults
+class Fault(object):
+    """
+    Misbehaviour of the server for matching commands.
+
+    ``command`` is a command name, ``key`` a glob pattern of the first
+    key of the command; None matches everything. After ``times`` matches
+    the fault is removed, None keeps it forever.
+    """
+
+    def __init__(self, command=None, key=None, times=None):
+        self.command = command.upper().encode('ascii') if command else None
+        self.key = key
+        self.times = times
+
+    def matches(self, request, asking):
+        if self.command is not None and request[0].upper() != self.command:
+            return False
+        if self.key is not None:
+            key = _first_key(request)
+            if key is None:
+                return False
+            return fnmatch.fnmatchcase(key.decode('utf-8', 'replace'),
+                                       self.key)
+        return True
+
+    def handle(self, server, conn, request, delay):
+        """
+        Answer the request, replies are sent after ``delay`` seconds.
+        Subclasses change it, by default the command runs as usual.
+        """
+        server.reply(conn, server.execute(request, conn), delay)
+
+
+class Delay(Fault):
+    """
+    Reply after ``seconds``; replies to later commands of the connection
+    wait for it
+    """
+
+    def __init__(self, seconds, **kwargs):
+        super(Delay, self).__init__(**kwargs)
+        self.seconds = seconds
+
+    def handle(self, server, conn, request, delay):
+        super(Delay, self).handle(server, conn, request,
+                                  delay + self.seconds)
+
+
+class Drop(Fault):
+    """
+    Close the connection instead of replying. With ``execute`` the
+    command runs first, as if the connection was lost after it.
+    """
+
+    def __init__(self, execute=False, **kwargs):
+        super(Drop, self).__init__(**kwargs)
+        self.execute = execute
+
+    def handle(self, server, conn, request, delay):
+        if self.execute:
+            server.execute(request, conn)
+        conn.close(delay)
+
+
+class SplitWrite(Fault):
+    """
+    Send the reply in pieces of ``chunk_size`` bytes, ``interval``
+    seconds apart, so the client parses partial replies
+    """
+
+    def __init__(self, chunk_size=1, interval=0.001, **kwargs):
+        super(SplitWrite, self).__init__(**kwargs)
+        self.chunk_size = chunk_size
+        self.interval = interval
+
+    def handle(self, server, conn, request, delay):
+        reply = server.execute(request, conn)
+        if reply is not NO_REPLY:
+            conn.send(encode_reply(reply), delay, self.chunk_size,
+                      self.interval)
+
+
+class Oversized(Fault):
+    """
+    Reply with a bulk string of ``size`` bytes instead of running the
+    command
+    """
+
+    def __init__(self, size, **kwargs):
+        super(Oversized, self).__init__(**kwargs)
+        self.size = size
+
+    def handle(self, server, conn, request, delay):
+        conn.send(encode_reply(b'x' * self.size), delay)
+
+
+class Reply(Fault):
+    """
+    Reply with ``value`` instead of running the command, Exception
+    instances are sent as errors
+    """
+
+    def __init__(self, value, **kwargs):
+        super(Reply, self).__init__(**kwargs)
+        self.value = value
+
+    def handle(self, server, conn, request, delay):
+        server.reply(conn, self.value, delay)
+
+
+class Redirect(Fault):
+    """
+    Reply with MOVED or ASK to another server for the slot of the key.
+    With ``unless_asking``, commands preceded by ASKING run here, as on a
+    node importing the slot.
+    """
+
+    def __init__(self, kind, port, host='127.0.0.1', unless_asking=False,
+                 **kwargs):
+        super(Redirect, self).__init__(**kwargs)
+        if kind not in ('MOVED', 'ASK'):
+            raise ValueError('Unknown redirect: %s' % kind)
+        self.kind = kind
+        self.address = '%s:%d' % (host, port)
+        self.unless_asking = unless_asking
+
+    def matches(self, request, asking):
+        if (asking and self.unless_asking) or _first_key(request) is None:
+            return False
+        return super(Redirect, self).matches(request, asking)
+
+    def handle(self, server, conn, request, delay):
+        server.reply(conn, CommandError('%s %d %s' % (
+            self.kind, key_slot(_first_key(request)), self.address)), delay)
+
+
+class _Connection(object):
+    def __init__(self, server, stream):
+        self.server = server
+        self.stream = stream
+        self.io_loop = stream.io_loop
+        self.db = 0
+        self.asking = False
+        self.multi = None
+        # (db, key) watched by WATCH, dirty once any of them is written
+        self.watched = set()
+        self.dirty = False
+        self.channels = set()
+        self.patterns = set()
+        # Replies are written in order: none is written before the time
+        # the previous one is scheduled for
+        self._ready = 0.0
+        self._scheduled = 0
+
+    def send(self, data, delay=0.0, chunk_size=None, interval=0.0):
+        now = self.io_loop.time()
+        at = max(now + delay, self._ready)
+        if chunk_size is None:
+            chunks = [data]
+        else:
+            chunks = [data[idx:idx + chunk_size]
+                      for idx in range(0, len(data), chunk_size)]
+        for idx, chunk in enumerate(chunks):
+            when = at + idx * interval
+            if when <= now and not self._scheduled:
+                self._write(chunk)
+            else:
+                self._scheduled += 1
+                self.io_loop.call_at(when, self._write_scheduled, chunk)
+        self._ready = at + (len(chunks) - 1) * interval
+
+    def _write(self, data):
+        if not self.stream.closed():
+            self.stream.write(data)
+
+    def _write_scheduled(self, data):
+        self._scheduled -= 1
+        self._write(data)
+
+    def close(self, delay=0.0):
+        at = max(self.io_loop.time() + delay, self._ready)
+        self._ready = at
+        self.io_loop.call_at(at, self.stream.close)
+
+
+class FakeServer(TCPServer):
+    """
+    Fake redis server.
+
+    ``databases`` is a list of dictionaries of key to value: bytes for
+    strings, dict for hashes, list for lists, set for sets and dict of
+    member to score for sorted sets. Expiration times are kept in
+    ``expires``. ``latency`` delays every reply, ``cluster_slots`` is the
+    reply to CLUSTER SLOTS.
+    """
+
+    def __init__(self, io_loop=None, databases=16):
+        super(FakeServer, self).__init__(io_loop=io_loop)
+        self.databases = [{} for _ in range(databases)]
+        self.expires = [{} for _ in range(databases)]
+        self.port = None
+        self.commands_processed = 0
+        self.latency = 0.0
+        self.cluster_slots = None
+        self.faults = []
+        self.connections = set()
+        # command name -> (minimum, maximum) number of arguments
+        self._arities = {}
+        # (db, key) -> connections watching it
+        self._watchers = {}
+        # (db, key) -> waiting BLPOP/BRPOP requests
+        self._waiters = {}
+        # channel or pattern -> subscribed connections
+        self._channels = {}
+        self._patterns = {}
+        # SCAN cursor -> last key returned with it
+        self._cursors = {}
+
+    def bind_unused_port(self, address='127.0.0.1'):
+        """
+        Listen on a free port and return it
+        """
+        sockets = bind_sockets(0, address, family=socket.AF_INET)
+        self.add_sockets(sockets)
+        self.port = sockets[0].getsockname()[1]
+        return self.port
+
+    def add_fault(self, fault):
+        """
+        Add :class:`Fault`, earlier faults take precedence
+        """
+        self.faults.append(fault)
+        return fault
+
+    def clear_faults(self):
+        self.faults = []
+
+    def disconnect_all(self):
+        """
+        Close all client connections
+        """
+        for conn in list(self.connections):
+            conn.close()
+
+    def handle_stream(self, stream, address):
+        # As redis, send small replies at once
+        stream.set_nodelay(True)
+        reader = hiredis.Reader()
+        conn = _Connection(self, stream)
+        self.connections.add(conn)
+
+        def on_data(data):
+            reader.feed(data)
+            request = reader.gets()
+            while request is not False:
+                self.handle_request(conn, request)
+                request = reader.gets()
+
+        def on_close():
+            self.connections.discard(conn)
+            self._unsubscribe_all(conn)
+            self._unwatch(conn)
+
+        stream.set_close_callback(on_close)
+        stream.read_until_close(lambda data: None, on_data)
+
+    def handle_request(self, conn, request):
+        asking, conn.asking = conn.asking, False
+        for fault in self.faults:
+            if fault.matches(request, asking):
+                if fault.times is not None:
+                    fault.times -= 1
+                    if fault.times <= 0:
+                        self.faults.remove(fault)
+                fault.handle(self, conn, request, self.latency)
+                return
+        self.reply(conn, self.execute(request, conn), self.latency)
+
+    def reply(self, conn, reply, delay=0.0):
+        if reply is not NO_REPLY:
+            conn.send(encode_reply(reply), delay)
+
+    def execute(self, request, conn):
+        """
+        Run one command of a connection, return its reply
+        """
+        self.commands_processed += 1
+        name = request[0].decode('utf-8', 'replace').lower()
+        if conn.multi is not None and name not in ('exec', 'discard',
+                                                   'multi'):
+            conn.multi.append(request)
+            return QUEUED
+        handler = getattr(self, 'cmd_' + name, None)
+        if handler is None:
+            return CommandError("ERR unknown command '%s'" % name)
+        arity = self._arities.get(name)
+        if arity is None:
+            arity = self._arities[name] = _arity(handler)
+        args = request[1:]
+        if len(args) < arity[0] or (arity[1] is not None and
+                                    len(args) > arity[1]):
+            return _wrong_arguments(name)
+        try:
+            reply = handler(conn, *args)
+        except WrongArguments:
+            return _wrong_arguments(name)
+        except CommandError as e:
+            return e
+        if self._watchers and name.upper() in WRITE_COMMANDS:
+            for key in get_keys([name.upper()] + list(args)):
+                for other in self._watchers.get((conn.db, key), ()):
+                    other.dirty = True
+        return reply
+
+    # Keyspace
+    def _db(self, conn):
+        return self.databases[conn.db]
+
+    def _lookup(self, conn, key, kind=None):
+        expires = self.expires[conn.db]
+        deadline = expires.get(key)
+        db = self._db(conn)
+        if deadline is not None and deadline <= time.time():
+            del expires[key]
+            db.pop(key, None)
+        value = db.get(key)
+        if value is not None and kind is not None and \
+                not isinstance(value, kind):
+            raise CommandError(WRONGTYPE)
+        return value
+
+    def _set(self, conn, key, value):
+        self._db(conn)[key] = value
+        self.expires[conn.db].pop(key, None)
+
+    def _delete(self, conn, key):
+        self.expires[conn.db].pop(key, None)
+        return self._db(conn).pop(key, None) is not None
+
+    def _get_or_create(self, conn, key, kind):
+        value = self._lookup(conn, key, kind)
+        if value is None:
+            value = self._db(conn)[key] = kind()
+        return value
+
+    def _drop_empty(self, conn, key, value):
+        if not value:
+            self._delete(conn, key)
+
+    def cmd_ping(self, conn, message=None):
+        return PONG if message is None else message
+
+    def cmd_echo(self, conn, message):
+        return message
+
+    def cmd_select(self, conn, index):
+        index = _int(index)
+        if not 0 <= index < len(self.databases):
+            raise CommandError('ERR DB index is out of range')
+        conn.db = index
+        return OK
+
+    def cmd_flushdb(self, conn):
+        self._db(conn).clear()
+        self.expires[conn.db].clear()
+        return OK
+
+    def cmd_flushall(self, conn):
+        for db, expires in zip(self.databases, self.expires):
+            db.clear()
+            expires.clear()
+        return OK
+
+    def cmd_dbsize(self, conn):
+        return len(self._db(conn))
+
+    def cmd_info(self, conn, section=None):
+        return b'# Server\r\nredis_version:fake\r\n'
+
+    def cmd_quit(self, conn):
+        conn.close()
+        return OK
+
+    def cmd_exists(self, conn, *keys):
+        if not keys:
+            raise WrongArguments()
+        return sum(1 for key in keys if self._lookup(conn, key) is not None)
+
+    def cmd_del(self, conn, *keys):
+        if not keys:
+            raise WrongArguments()
+        return sum(1 for key in keys
+                   if self._lookup(conn, key) is not None and
+                   self._delete(conn, key))
+
+    def cmd_type(self, conn, key):
+        value = self._lookup(conn, key)
+        for kind, name in ((bytes, b'string'), (list, b'list'),
+                           (set, b'set'), (_Hash, b'hash'),
+                           (_SortedSet, b'zset')):
+            if isinstance(value, kind):
+                return Status(name)
+        return Status(b'none')
+
+    def cmd_object(self, conn, subcommand, *args):
+        if subcommand.upper() != b'ENCODING' or len(args) != 1:
+            raise CommandError('ERR Unknown subcommand or wrong number of '
+                               'arguments')
+        value = self._lookup(conn, args[0])
+        if isinstance(value, bytes):
+            try:
+                int(value)
+                return b'int'
+            except ValueError:
+                return b'embstr' if len(value) <= 44 else b'raw'
+        for kind, name in ((list, b'quicklist'), (set, b'hashtable'),
+                           (_Hash, b'hashtable'), (_SortedSet, b'skiplist')):
+            if isinstance(value, kind):
+                return name
+        return None
+
+    def _keys(self, conn, pattern=None):
+        pattern = pattern.decode('utf-8') if pattern is not None else None
+        return [key for key in sorted(self._db(conn))
+                if self._lookup(conn, key) is not None and
+                (pattern is None or
+                 fnmatch.fnmatchcase(key.decode('utf-8'), pattern))]
+
+    def cmd_keys(self, conn, pattern):
+        return self._keys(conn, pattern)
+
+    def cmd_scan(self, conn, cursor, *options):
+        # Cursor stands for the last returned key, the scan resumes after
+        # it, so keys present all along are returned even if others are
+        # added or deleted meanwhile
+        match = count = None
+        for idx in range(0, len(options) - 1, 2):
+            if options[idx].upper() == b'MATCH':
+                match = options[idx + 1]
+            elif options[idx].upper() == b'COUNT':
+                count = _int(options[idx + 1])
+        keys = sorted(self._db(conn))
+        cursor = _int(cursor)
+        start = 0
+        if cursor:
+            if cursor not in self._cursors:
+                raise CommandError('ERR invalid cursor')
+            start = bisect.bisect_right(keys, self._cursors[cursor])
+        end = start + (count or 10)
+        batch = [key for key in keys[start:end]
+                 if self._lookup(conn, key) is not None and
+                 (match is None or fnmatch.fnmatchcase(
+                     key.decode('utf-8'), match.decode('utf-8')))]
+        next_cursor = 0
+        if end < len(keys):
+            next_cursor = len(self._cursors) + 1
+            self._cursors[next_cursor] = keys[end - 1]
+        return [str(next_cursor).encode('ascii'), batch]
+
+    def cmd_rename(self, conn, key, new_key):
+        value = self._lookup(conn, key)
+        if value is None:
+            raise CommandError('ERR no such key')
+        deadline = self.expires[conn.db].get(key)
+        self._delete(conn, key)
+        self._set(conn, new_key, value)
+        if deadline is not None:
+            self.expires[conn.db][new_key] = deadline
+        return OK
+
+    def cmd_expire(self, conn, key, seconds):
+        return self.cmd_pexpire(conn, key, _int(seconds) * 1000)
+
+    def cmd_pexpire(self, conn, key, milliseconds):
+        if self._lookup(conn, key) is None:
+            return 0
+        self.expires[conn.db][key] = \
+            time.time() + _int(milliseconds) / 1000.0
+        return 1
+
+    def cmd_persist(self, conn, key):
+        if self._lookup(conn, key) is None:
+            return 0
+        return int(self.expires[conn.db].pop(key, None) is not None)
+
+    def cmd_pttl(self, conn, key):
+        if self._lookup(conn, key) is None:
+            return -2
+        deadline = self.expires[conn.db].get(key)
+        if deadline is None:
+            return -1
+        return int((deadline - time.time()) * 1000)
+
+    def cmd_ttl(self, conn, key):
+        ttl = self.cmd_pttl(conn, key)
+        return ttl if ttl < 0 else (ttl + 500) // 1000
+
+    def cmd_dump(self, conn, key):
+        value = self._lookup(conn, key)
+        if value is None:
+            return None
+        for kind, tag in _DUMP_TYPES:
+            if isinstance(value, kind):
+                if isinstance(value, dict):
+                    value = dict(value)
+                return tag + marshal.dumps(value)
+
+    def cmd_restore(self, conn, key, ttl, payload, *options):
+        ttl = _int(ttl)
+        if ttl < 0:
+            raise CommandError('ERR Invalid TTL value, must be >= 0')
+        options = [option.upper() for option in options]
+        if b'REPLACE' not in options and \
+                self._lookup(conn, key) is not None:
+            raise CommandError('BUSYKEY Target key name already exists.')
+        kinds = dict((tag, kind) for kind, tag in _DUMP_TYPES)
+        kind = kinds.get(payload[:1])
+        try:
+            value = marshal.loads(payload[1:])
+        except (EOFError, ValueError, TypeError):
+            kind = None
+        if kind is None:
+            raise CommandError(_BAD_PAYLOAD)
+        self._set(conn, key, kind(value))
+        if ttl:
+            self.expires[conn.db][key] = time.time() + ttl / 1000.0
+        return OK
+
+    # Strings
+    def cmd_get(self, conn, key):
+        return self._lookup(conn, key, bytes)
+
+    def cmd_set(self, conn, key, value, *options):
+        options = [option.upper() for option in options]
+        expire = None
+        if b'EX' in options:
+            expire = _int(options[options.index(b'EX') + 1]) * 1000
+        elif b'PX' in options:
+            expire = _int(options[options.index(b'PX') + 1])
+        exists = self._lookup(conn, key) is not None
+        if (b'NX' in options and exists) or (b'XX' in options and
+                                             not exists):
+            return None
+        self._set(conn, key, value)
+        if expire is not None:
+            self.cmd_pexpire(conn, key, expire)
+        return OK
+
+    def cmd_setnx(self, conn, key, value):
+        return int(self.cmd_set(conn, key, value, b'NX') is not None)
+
+    def cmd_setex(self, conn, key, seconds, value):
+        return self.cmd_set(conn, key, value, b'EX', seconds)
+
+    def cmd_psetex(self, conn, key, milliseconds, value):
+        return self.cmd_set(conn, key, value, b'PX', milliseconds)
+
+    def cmd_getset(self, conn, key, value):
+        old = self._lookup(conn, key, bytes)
+        self._set(conn, key, value)
+        return old
+
+    def cmd_mget(self, conn, *keys):
+        if not keys:
+            raise WrongArguments()
+        values = []
+        for key in keys:
+            value = self._lookup(conn, key)
+            values.append(value if isinstance(value, bytes) else None)
+        return values
+
+    def cmd_mset(self, conn, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise WrongArguments()
+        for idx in range(0, len(pairs), 2):
+            self._set(conn, pairs[idx], pairs[idx + 1])
+        return OK
+
+    def cmd_append(self, conn, key, value):
+        value = (self._lookup(conn, key, bytes) or b'') + value
+        self._db(conn)[key] = value
+        return len(value)
+
+    def cmd_strlen(self, conn, key):
+        return len(self._lookup(conn, key, bytes) or b'')
+
+    def cmd_getrange(self, conn, key, start, end):
+        value = self._lookup(conn, key, bytes) or b''
+        start, end = _int(start), _int(end)
+        if start < 0:
+            start = max(len(value) + start, 0)
+        if end < 0:
+            end = len(value) + end
+        return value[start:end + 1]
+
+    def cmd_incrby(self, conn, key, increment):
+        value = _int(self._lookup(conn, key, bytes) or b'0') + \
+            _int(increment)
+        self._db(conn)[key] = str(value).encode('ascii')
+        return value
+
+    def cmd_incr(self, conn, key):
+        return self.cmd_incrby(conn, key, b'1')
+
+    def cmd_decrby(self, conn, key, decrement):
+        return self.cmd_incrby(conn, key, str(-_int(decrement)).encode())
+
+    def cmd_decr(self, conn, key):
+        return self.cmd_incrby(conn, key, b'-1')
+
+    # Hashes
+    def cmd_hset(self, conn, key, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise WrongArguments()
+        value = self._get_or_create(conn, key, _Hash)
+        added = 0
+        for idx in range(0, len(pairs), 2):
+            added += pairs[idx] not in value
+            value[pairs[idx]] = pairs[idx + 1]
+        return added
+
+    def cmd_hsetnx(self, conn, key, field, value):
+        if field in (self._lookup(conn, key, _Hash) or {}):
+            return 0
+        return self.cmd_hset(conn, key, field, value)
+
+    def cmd_hmset(self, conn, key, *pairs):
+        self.cmd_hset(conn, key, *pairs)
+        return OK
+
+    def cmd_hget(self, conn, key, field):
+        return (self._lookup(conn, key, _Hash) or {}).get(field)
+
+    def cmd_hmget(self, conn, key, *fields):
+        if not fields:
+            raise WrongArguments()
+        value = self._lookup(conn, key, _Hash) or {}
+        return [value.get(field) for field in fields]
+
+    def cmd_hgetall(self, conn, key):
+        result = []
+        for item in (self._lookup(conn, key, _Hash) or {}).items():
+            result.extend(item)
+        return result
+
+    def cmd_hkeys(self, conn, key):
+        return list(self._lookup(conn, key, _Hash) or {})
+
+    def cmd_hvals(self, conn, key):
+        return list((self._lookup(conn, key, _Hash) or {}).values())
+
+    def cmd_hlen(self, conn, key):
+        return len(self._lookup(conn, key, _Hash) or {})
+
+    def cmd_hexists(self, conn, key, field):
+        return int(field in (self._lookup(conn, key, _Hash) or {}))
+
+    def cmd_hdel(self, conn, key, *fields):
+        value = self._lookup(conn, key, _Hash)
+        if value is None:
+            return 0
+        removed = sum(1 for field in fields
+                      if value.pop(field, None) is not None)
+        self._drop_empty(conn, key, value)
+        return removed
+
+    def cmd_hincrby(self, conn, key, field, increment):
+        value = self._get_or_create(conn, key, _Hash)
+        result = _int(value.get(field, b'0')) + _int(increment)
+        value[field] = str(result).encode('ascii')
+        return result
+
+    # Lists
+    def _push(self, conn, key, values, left):
+        if not values:
+            raise WrongArguments()
+        value = self._get_or_create(conn, key, list)
+        for item in values:
+            if left:
+                value.insert(0, item)
+            else:
+                value.append(item)
+        length = len(value)
+        self._serve_waiters(conn.db, key)
+        return length
+
+    def _pop(self, conn, key, left):
+        value = self._lookup(conn, key, list)
+        if not value:
+            return None
+        item = value.pop(0 if left else -1)
+        self._drop_empty(conn, key, value)
+        return item
+
+    def cmd_lpush(self, conn, key, *values):
+        return self._push(conn, key, values, True)
+
+    def cmd_rpush(self, conn, key, *values):
+        return self._push(conn, key, values, False)
+
+    def cmd_lpop(self, conn, key):
+        return self._pop(conn, key, True)
+
+    def cmd_rpop(self, conn, key):
+        return self._pop(conn, key, False)
+
+    def cmd_rpoplpush(self, conn, source, destination):
+        self._lookup(conn, destination, list)
+        item = self._pop(conn, source, False)
+        if item is not None:
+            self._push(conn, destination, [item], True)
+        return item
+
+    def cmd_llen(self, conn, key):
+        return len(self._lookup(conn, key, list) or [])
+
+    def _range(self, length, start, stop):
+        start, stop = _int(start), _int(stop)
+        if start < 0:
+            start = max(length + start, 0)
+        if stop < 0:
+            stop = length + stop
+        return start, stop + 1
+
+    def cmd_lrange(self, conn, key, start, stop):
+        value = self._lookup(conn, key, list) or []
+        start, stop = self._range(len(value), start, stop)
+        return value[start:stop]
+
+    def cmd_lindex(self, conn, key, index):
+        value = self._lookup(conn, key, list) or []
+        index = _int(index)
+        if -len(value) <= index < len(value):
+            return value[index]
+        return None
+
+    def cmd_lset(self, conn, key, index, item):
+        value = self._lookup(conn, key, list)
+        if value is None:
+            raise CommandError('ERR no such key')
+        index = _int(index)
+        if not -len(value) <= index < len(value):
+            raise CommandError('ERR index out of range')
+        value[index] = item
+        return OK
+
+    def cmd_ltrim(self, conn, key, start, stop):
+        value = self._lookup(conn, key, list)
+        if value is not None:
+            start, stop = self._range(len(value), start, stop)
+            value[:] = value[start:stop]
+            self._drop_empty(conn, key, value)
+        return OK
+
+    def cmd_lrem(self, conn, key, count, item):
+        value = self._lookup(conn, key, list)
+        if value is None:
+            return 0
+        count = _int(count)
+        indexes = [idx for idx, other in enumerate(value) if other == item]
+        if count < 0:
+            indexes = indexes[count:]
+        elif count > 0:
+            indexes = indexes[:count]
+        for idx in reversed(indexes):
+            del value[idx]
+        self._drop_empty(conn, key, value)
+        return len(indexes)
+
+    def _blocking_pop(self, conn, args, left):
+        if len(args) < 2:
+            raise WrongArguments()
+        keys, timeout = args[:-1], _float(args[-1])
+        for key in keys:
+            item = self._pop(conn, key, left)
+            if item is not None:
+                return [key, item]
+        if conn.multi is not None:
+            return None
+        waiter = {'conn': conn, 'keys': keys, 'left': left, 'timeout': None}
+        for key in keys:
+            self._waiters.setdefault((conn.db, key), deque()).append(waiter)
+        if timeout > 0:
+            waiter['timeout'] = conn.io_loop.call_later(
+                timeout, self._expire_waiter, waiter)
+        return NO_REPLY
+
+    def _expire_waiter(self, waiter):
+        self._remove_waiter(waiter)
+        self.reply(waiter['conn'], None)
+
+    def _remove_waiter(self, waiter):
+        conn = waiter['conn']
+        for key in waiter['keys']:
+            waiters = self._waiters.get((conn.db, key))
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[(conn.db, key)]
+        if waiter['timeout'] is not None:
+            conn.io_loop.remove_timeout(waiter['timeout'])
+
+    def _serve_waiters(self, db, key):
+        waiters = self._waiters.get((db, key))
+        while waiters:
+            waiter = waiters[0]
+            conn = waiter['conn']
+            if conn.stream.closed():
+                self._remove_waiter(waiter)
+                continue
+            item = self._pop(conn, key, waiter['left'])
+            if item is None:
+                break
+            self._remove_waiter(waiter)
+            self.reply(conn, [key, item], self.latency)
+            waiters = self._waiters.get((db, key))
+
+    def cmd_blpop(self, conn, *args):
+        return self._blocking_pop(conn, args, True)
+
+    def cmd_brpop(self, conn, *args):
+        return self._blocking_pop(conn, args, False)
+
+    # Sets
+    def cmd_sadd(self, conn, key, *members):
+        if not members:
+            raise WrongArguments()
+        value = self._get_or_create(conn, key, set)
+        size = len(value)
+        value.update(members)
+        return len(value) - size
+
+    def cmd_srem(self, conn, key, *members):
+        value = self._lookup(conn, key, set)
+        if value is None:
+            return 0
+        size = len(value)
+        value.difference_update(members)
+        removed = size - len(value)
+        self._drop_empty(conn, key, value)
+        return removed
+
+    def cmd_smembers(self, conn, key):
+        return sorted(self._lookup(conn, key, set) or ())
+
+    def cmd_sismember(self, conn, key, member):
+        return int(member in (self._lookup(conn, key, set) or ()))
+
+    def cmd_scard(self, conn, key):
+        return len(self._lookup(conn, key, set) or ())
+
+    def cmd_spop(self, conn, key):
+        value = self._lookup(conn, key, set)
+        if not value:
+            return None
+        member = value.pop()
+        self._drop_empty(conn, key, value)
+        return member
+
+    def _sets(self, conn, keys):
+        if not keys:
+            raise WrongArguments()
+        return [self._lookup(conn, key, set) or set() for key in keys]
+
+    def cmd_sinter(self, conn, *keys):
+        sets = self._sets(conn, keys)
+        return sorted(sets[0].intersection(*sets[1:]))
+
+    def cmd_sunion(self, conn, *keys):
+        sets = self._sets(conn, keys)
+        return sorted(sets[0].union(*sets[1:]))
+
+    def cmd_sdiff(self, conn, *keys):
+        sets = self._sets(conn, keys)
+        return sorted(sets[0].difference(*sets[1:]))
+
+    # Sorted sets
+    def _sorted(self, value):
+        return sorted(value.items(), key=lambda item: (item[1], item[0]))
+
+    def _with_scores(self, items, with_scores):
+        if not with_scores:
+            return [member for member, score in items]
+        result = []
+        for member, score in items:
+            result.extend([member, _format_score(score)])
+        return result
+
+    def cmd_zadd(self, conn, key, *args):
+        args = list(args)
+        flags = set()
+        while args and args[0].upper() in (b'NX', b'XX', b'CH'):
+            flags.add(args.pop(0).upper())
+        if not args or len(args) % 2:
+            raise WrongArguments()
+        pairs = [(_float(args[idx]), args[idx + 1])
+                 for idx in range(0, len(args), 2)]
+        value = self._get_or_create(conn, key, _SortedSet)
+        changed = 0
+        for score, member in pairs:
+            exists = member in value
+            if (b'NX' in flags and exists) or (b'XX' in flags and
+                                               not exists):
+                continue
+            if not exists or (b'CH' in flags and value[member] != score):
+                changed += 1
+            value[member] = score
+        self._drop_empty(conn, key, value)
+        return changed
+
+    def cmd_zincrby(self, conn, key, increment, member):
+        value = self._get_or_create(conn, key, _SortedSet)
+        value[member] = value.get(member, 0.0) + _float(increment)
+        return _format_score(value[member])
+
+    def cmd_zscore(self, conn, key, member):
+        score = (self._lookup(conn, key, _SortedSet) or {}).get(member)
+        return _format_score(score) if score is not None else None
+
+    def cmd_zcard(self, conn, key):
+        return len(self._lookup(conn, key, _SortedSet) or {})
+
+    def cmd_zrem(self, conn, key, *members):
+        value = self._lookup(conn, key, _SortedSet)
+        if value is None:
+            return 0
+        removed = sum(1 for member in members
+                      if value.pop(member, None) is not None)
+        self._drop_empty(conn, key, value)
+        return removed
+
+    def cmd_zrank(self, conn, key, member):
+        items = self._sorted(self._lookup(conn, key, _SortedSet) or {})
+        for idx, (other, score) in enumerate(items):
+            if other == member:
+                return idx
+        return None
+
+    def _zrange(self, conn, key, start, stop, options, reverse):
+        items = self._sorted(self._lookup(conn, key, _SortedSet) or {})
+        if reverse:
+            items.reverse()
+        start, stop = self._range(len(items), start, stop)
+        with_scores = b'WITHSCORES' in [option.upper() for option in options]
+        return self._with_scores(items[start:stop], with_scores)
+
+    def cmd_zrange(self, conn, key, start, stop, *options):
+        return self._zrange(conn, key, start, stop, options, False)
+
+    def cmd_zrevrange(self, conn, key, start, stop, *options):
+        return self._zrange(conn, key, start, stop, options, True)
+
+    def _in_range(self, score, low, high):
+        (low, low_open), (high, high_open) = low, high
+        return ((score > low if low_open else score >= low) and
+                (score < high if high_open else score <= high))
+
+    def cmd_zrangebyscore(self, conn, key, low, high, *options):
+        low, high = _score_bound(low), _score_bound(high)
+        options = list(options)
+        upper = [option.upper() for option in options]
+        items = [item for item in self._sorted(
+                     self._lookup(conn, key, _SortedSet) or {})
+                 if self._in_range(item[1], low, high)]
+        if b'LIMIT' in upper:
+            idx = upper.index(b'LIMIT')
+            offset, count = _int(options[idx + 1]), _int(options[idx + 2])
+            items = items[offset:offset + count if count >= 0 else None]
+        return self._with_scores(items, b'WITHSCORES' in upper)
+
+    def cmd_zcount(self, conn, key, low, high):
+        low, high = _score_bound(low), _score_bound(high)
+        return sum(1 for score in (
+            self._lookup(conn, key, _SortedSet) or {}).values()
+            if self._in_range(score, low, high))
+
+    # Transactions
+    def cmd_multi(self, conn):
+        if conn.multi is not None:
+            raise CommandError('ERR MULTI calls can not be nested')
+        conn.multi = []
+        return OK
+
+    def cmd_exec(self, conn):
+        if conn.multi is None:
+            raise CommandError('ERR EXEC without MULTI')
+        requests, conn.multi = conn.multi, None
+        dirty = conn.dirty
+        self._unwatch(conn)
+        if dirty:
+            # Aborted: a watched key was written
+            return None
+        return [self.execute(request, conn) for request in requests]
+
+    def cmd_discard(self, conn):
+        if conn.multi is None:
+            raise CommandError('ERR DISCARD without MULTI')
+        conn.multi = None
+        self._unwatch(conn)
+        return OK
+
+    def cmd_watch(self, conn, key, *keys):
+        for key in (key,) + keys:
+            self._watchers.setdefault((conn.db, key), set()).add(conn)
+            conn.watched.add((conn.db, key))
+        return OK
+
+    def cmd_unwatch(self, conn):
+        self._unwatch(conn)
+        return OK
+
+    def _unwatch(self, conn):
+        for item in conn.watched:
+            watchers = self._watchers.get(item)
+            if watchers is not None:
+                watchers.discard(conn)
+                if not watchers:
+                    del self._watchers[item]
+        conn.watched.clear()
+        conn.dirty = False
+
+    # Pub/sub
+    def _subscribe(self, conn, names, kind, registry, subscribed):
+        if not names:
+            raise WrongArguments()
+        for name in names:
+            registry.setdefault(name, set()).add(conn)
+            subscribed.add(name)
+            self.reply(conn, [kind, name,
+                              len(conn.channels) + len(conn.patterns)])
+        return NO_REPLY
+
+    def _unsubscribe(self, conn, names, kind, registry, subscribed):
+        names = names or sorted(subscribed)
+        if not names:
+            self.reply(conn, [kind, None,
+                              len(conn.channels) + len(conn.patterns)])
+        for name in names:
+            registry.get(name, set()).discard(conn)
+            if not registry.get(name, True):
+                del registry[name]
+            subscribed.discard(name)
+            self.reply(conn, [kind, name,
+                              len(conn.channels) + len(conn.patterns)])
+        return NO_REPLY
+
+    def _unsubscribe_all(self, conn):
+        for registry, subscribed in ((self._channels, conn.channels),
+                                     (self._patterns, conn.patterns)):
+            for name in subscribed:
+                registry.get(name, set()).discard(conn)
+                if not registry.get(name, True):
+                    del registry[name]
+            subscribed.clear()
+
+    def cmd_subscribe(self, conn, *channels):
+        return self._subscribe(conn, channels, b'subscribe', self._channels,
+                               conn.channels)
+
+    def cmd_psubscribe(self, conn, *patterns):
+        return self._subscribe(conn, patterns, b'psubscribe',
+                               self._patterns, conn.patterns)
+
+    def cmd_unsubscribe(self, conn, *channels):
+        return self._unsubscribe(conn, channels, b'unsubscribe',
+                                 self._channels, conn.channels)
+
+    def cmd_punsubscribe(self, conn, *patterns):
+        return self._unsubscribe(conn, patterns, b'punsubscribe',
+                                 self._patterns, conn.patterns)
+
+    def cmd_publish(self, conn, channel, message):
+        receivers = 0
+        for subscriber in self._channels.get(channel, ()):
+            self.reply(subscriber, [b'message', channel, message],
+                       self.latency)
+            receivers += 1
+        name = channel.decode('utf-8', 'replace')
+        for pattern, subscribers in list(self._patterns.items()):
+            if fnmatch.fnmatchcase(name, pattern.decode('utf-8', 'replace')):
+                for subscriber in subscribers:
+                    self.reply(subscriber,
+                               [b'pmessage', pattern, channel, message],
+                               self.latency)
+                    receivers += 1
+        return receivers
+
+    # Cluster
+    def cmd_asking(self, conn):
+        conn.asking = True
+        return OK
+
+    def cmd_cluster(self, conn, subcommand, *args):
+        if subcommand.upper() != b'SLOTS' or self.cluster_slots is None:
+            raise CommandError('ERR This instance has cluster support '
+                               'disabled')
+        return self.cluster_slots
+
@@ -0,0 +1,142 @@
+"""
+Key to node mapping algorithms for RedisNodes.
+
+Every ring is built from the list of node definitions (dictionaries with
+``name`` and optional ``replicas``) and maps a key to a node name.
+"""
+import struct
+import zlib
+from bisect import bisect_left
+from hashlib import md5
+
+
+try:
+    string = unicode
+except NameError:
+    string = str
+
+
+def to_bytes(key):
+    if isinstance(key, bytes):
+        return key
+    if not isinstance(key, string):
+        key = string(key)
+    return key.encode('utf-8')
+
+
+def hash_tag(key):
+    """
+    Return hash tag of the key, the same way Redis Cluster does: part of
+    the key between the first ``{`` and the next ``}`` if it is not empty,
+    otherwise the whole key. ``user:{42}:profile`` and ``user:{42}:feed``
+    both give ``42``.
+    """
+    key = to_bytes(key)
+    start = key.find(b'{')
+    if start != -1:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+class Crc32Ring(object):
+    """
+    Original toredis ring: crc32 of ``'{name}: {num}'`` points.
+    """
+
+    default_replicas = 100
+
+    def __init__(self, nodes, default_replicas=None):
+        if default_replicas is None:
+            default_replicas = self.default_replicas
+        hash_to_name = {}
+        for n in nodes:
+            for num in range(n.get('replicas', default_replicas)):
+                _hash = self.hash_func('{}: {}'.format(n['name'], num))
+                hash_to_name[_hash] = n['name']
+        self._points = sorted(hash_to_name)
+        self._names = [hash_to_name[p] for p in self._points]
+
+    def hash_func(self, key):
+        return zlib.crc32(to_bytes(key))
+
+    def get_node(self, key):
+        idx = bisect_left(self._points, self.hash_func(key))
+        if idx == len(self._points):
+            idx = 0
+        return self._names[idx]
+
+
+class KetamaRing(Crc32Ring):
+    """
+    Ketama ring compatible with libketama and libmemcached: every md5 of
+    ``'{name}-{num}'`` gives four points. Use ``name`` of ``'host:port'``
+    to share layout with other ketama clients.
+    """
+
+    default_replicas = 160
+
+    def __init__(self, nodes, default_replicas=None):
+        if default_replicas is None:
+            default_replicas = self.default_replicas
+        unpack = struct.Struct('<4I').unpack
+        points = []
+        for n in nodes:
+            name = n['name']
+            digests = (n.get('replicas', default_replicas) + 3) // 4
+            # One md5 and one unpack per four points
+            for num in range(digests):
+                digest = md5(to_bytes('%s-%d' % (name, num))).digest()
+                points.extend((p, name) for p in unpack(digest))
+        points.sort()
+        self._points = [p for p, name in points]
+        self._names = [name for p, name in points]
+
+    def hash_func(self, key):
+        return struct.unpack_from('<I', md5(to_bytes(key)).digest())[0]
+
+
+class JumpRing(object):
+    """
+    Jump consistent hash (Lamping and Veach). Needs no memory, but nodes
+    can only be added or removed at the end of the list.
+    """
+
+    def __init__(self, nodes, default_replicas=None):
+        self._names = [n['name'] for n in nodes]
+
+    def get_node(self, key):
+        key = struct.unpack_from('<Q', md5(to_bytes(key)).digest())[0]
+        num_buckets = len(self._names)
+        b, j = -1, 0
+        while j < num_buckets:
+            b = j
+            key = (key * 2862933555777941757 + 1) & 0xffffffffffffffff
+            j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+        return self._names[b]
+
+
+def _mix64(x):
+    # splitmix64 finalizer
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & 0xffffffffffffffff
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & 0xffffffffffffffff
+    return x ^ (x >> 31)
+
+
+class RendezvousRing(object):
+    """
+    Rendezvous (highest random weight) hashing. Lookup is O(number of
+    nodes), any node can be removed with minimal key movement.
+    """
+
+    def __init__(self, nodes, default_replicas=None):
+        self._seeds = [
+            (struct.unpack_from('<Q', md5(to_bytes(n['name'])).digest())[0],
+             n['name'])
+            for n in nodes]
+
+    def get_node(self, key):
+        _hash = struct.unpack_from('<Q', md5(to_bytes(key)).digest())[0]
+        return max((_mix64(_hash ^ seed), name)
+                   for seed, name in self._seeds)[1]
@@ -0,0 +1,65 @@
+from toredis.metadata import COMMANDS, KEY_SPECS
+
+
+def _lookup(table, args):
+    value = table.get(args[0])
+    if value is None and len(args) > 1:
+        # Two-word commands, like DEBUG OBJECT
+        try:
+            value = table.get('%s %s' % (args[0], args[1]))
+        except (TypeError, UnicodeError):
+            pass
+    return value
+
+
+def get_key_spec(args):
+    """
+    Return key positions of the command, None for commands without keys
+    """
+    return _lookup(KEY_SPECS, args)
+
+
+def get_flags(args):
+    """
+    Return flags of the command, see flag constants in toredis.metadata.
+    Unknown commands have no flags.
+
+    :param args:
+        Arguments sent to redis, the command name included
+    """
+    info = _lookup(COMMANDS, args)
+    return info[0] if info is not None else 0
+
+
+def get_keys(args):
+    """
+    Return keys of the command from its argument list
+
+    :param args:
+        Arguments sent to redis, the command name included
+    """
+    spec = get_key_spec(args)
+    if spec is None:
+        return []
+    first, last, step, numkeys, keyword = spec
+    keys = []
+    if first:
+        if last < 0:
+            last += len(args)
+        keys = args[first:last + 1:step]
+    if numkeys:
+        start = numkeys + 1
+        keys = keys + args[start:start + int(args[numkeys])]
+    if keyword:
+        # Options come after the keys, the last match wins as in redis
+        for idx in range(len(args) - 2, first, -1):
+            if _is_keyword(args[idx], keyword):
+                keys = keys + [args[idx + 1]]
+                break
+    return keys
+
+
+def _is_keyword(arg, keyword):
+    if isinstance(arg, bytes):
+        arg = arg.decode('latin-1')
+    return hasattr(arg, 'upper') and arg.upper() == keyword
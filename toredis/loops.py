@@ -0,0 +1,79 @@
+import threading
+
+from tornado.ioloop import IOLoop
+
+from toredis.client import ClientPool
+from toredis.commands import RedisCommandsMixin
+
+
+class LoopPool(RedisCommandsMixin):
+    """
+        Thread-aware pool facade keeping one ClientPool per IOLoop.
+
+        Commands issued from a thread with a current IOLoop go to the pool
+        of that loop, so sockets are never shared between threads. Commands
+        issued from other threads are passed with ``add_callback`` to one of
+        the known loops (round-robin), and their callbacks run on that loop.
+    """
+
+    pool_cls = ClientPool # should be a subclass of ClientPool
+
+    def __init__(self, io_loops=(), **pool_kwargs):
+        """
+            Constructor
+
+            :param io_loops:
+                Optional list of IOLoops to create pools for in advance
+            :param pool_kwargs:
+                Arguments for every ClientPool, except ``io_loop``
+        """
+        self._pool_kwargs = pool_kwargs
+        self._pools = {}
+        self._loops = []
+        self._next_loop = 0
+        self._lock = threading.Lock()
+        for io_loop in io_loops:
+            self.get_pool(io_loop)
+
+    def get_pool(self, io_loop=None):
+        """
+            Return pool for the IOLoop, creating it when needed
+
+            :param io_loop:
+                IOLoop, current one by default
+        """
+        io_loop = io_loop or IOLoop.current()
+        pool = self._pools.get(io_loop)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(io_loop)
+                if pool is None:
+                    pool = self.pool_cls(io_loop=io_loop, **self._pool_kwargs)
+                    self._pools[io_loop] = pool
+                    self._loops.append(io_loop)
+        return pool
+
+    def remove_pool(self, io_loop):
+        """
+            Forget pool of the IOLoop, e.g. when the loop is closed
+        """
+        with self._lock:
+            if self._pools.pop(io_loop, None) is not None:
+                self._loops.remove(io_loop)
+
+    def pools(self):
+        return list(self._pools.values())
+
+    def send_message(self, args, callback=None):
+        io_loop = IOLoop.current(instance=False)
+        if io_loop is not None:
+            self.get_pool(io_loop).send_message(args, callback)
+            return
+
+        with self._lock:
+            if not self._loops:
+                raise ValueError('No IOLoop to send command from this thread')
+            io_loop = self._loops[self._next_loop % len(self._loops)]
+            self._next_loop += 1
+            pool = self._pools[io_loop]
+        io_loop.add_callback(pool.send_message, args, callback)
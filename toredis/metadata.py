@@ -0,0 +1,183 @@
+# Generated by gen_commands.py from commands.json
+
+READONLY = 1
+WRITE = 2
+BLOCKING = 4
+PUBSUB = 8
+ADMIN = 16
+IDEMPOTENT = 32
+STATEFUL = 64
+
+# name: (flags, first, last, step, numkeys, keyword), key positions
+# are described in toredis.keys.get_keys
+COMMANDS = {
+    "APPEND": (WRITE, 1, 1, 1, 0, ""),
+    "AUTH": (STATEFUL, 0, 0, 1, 0, ""),
+    "BGREWRITEAOF": (ADMIN, 0, 0, 1, 0, ""),
+    "BGSAVE": (ADMIN, 0, 0, 1, 0, ""),
+    "BITCOUNT": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "BITOP": (WRITE, 2, -1, 1, 0, ""),
+    "BLPOP": (WRITE | BLOCKING, 1, -2, 1, 0, ""),
+    "BRPOP": (WRITE | BLOCKING, 1, -2, 1, 0, ""),
+    "BRPOPLPUSH": (WRITE | BLOCKING, 1, 2, 1, 0, ""),
+    "CLIENT GETNAME": (IDEMPOTENT, 0, 0, 1, 0, ""),
+    "CLIENT KILL": (ADMIN, 0, 0, 1, 0, ""),
+    "CLIENT LIST": (ADMIN | IDEMPOTENT, 0, 0, 1, 0, ""),
+    "CLIENT SETNAME": (0, 0, 0, 1, 0, ""),
+    "CONFIG GET": (ADMIN | IDEMPOTENT, 0, 0, 1, 0, ""),
+    "CONFIG RESETSTAT": (ADMIN, 0, 0, 1, 0, ""),
+    "CONFIG SET": (ADMIN, 0, 0, 1, 0, ""),
+    "DBSIZE": (IDEMPOTENT, 0, 0, 1, 0, ""),
+    "DEBUG OBJECT": (ADMIN, 2, 2, 1, 0, ""),
+    "DEBUG SEGFAULT": (ADMIN, 0, 0, 1, 0, ""),
+    "DECR": (WRITE, 1, 1, 1, 0, ""),
+    "DECRBY": (WRITE, 1, 1, 1, 0, ""),
+    "DEL": (WRITE | IDEMPOTENT, 1, -1, 1, 0, ""),
+    "DISCARD": (STATEFUL, 0, 0, 1, 0, ""),
+    "DUMP": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "ECHO": (IDEMPOTENT, 0, 0, 1, 0, ""),
+    "EVAL": (WRITE, 0, 0, 1, 2, ""),
+    "EVALSHA": (WRITE, 0, 0, 1, 2, ""),
+    "EXEC": (STATEFUL, 0, 0, 1, 0, ""),
+    "EXISTS": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "EXPIRE": (WRITE, 1, 1, 1, 0, ""),
+    "EXPIREAT": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "FLUSHALL": (WRITE | IDEMPOTENT, 0, 0, 1, 0, ""),
+    "FLUSHDB": (WRITE | IDEMPOTENT, 0, 0, 1, 0, ""),
+    "GET": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "GETBIT": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "GETRANGE": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "GETSET": (WRITE, 1, 1, 1, 0, ""),
+    "HDEL": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "HEXISTS": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "HGET": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "HGETALL": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "HINCRBY": (WRITE, 1, 1, 1, 0, ""),
+    "HINCRBYFLOAT": (WRITE, 1, 1, 1, 0, ""),
+    "HKEYS": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "HLEN": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "HMGET": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "HMSET": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "HSCAN": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "HSET": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "HSETNX": (WRITE, 1, 1, 1, 0, ""),
+    "HVALS": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "INCR": (WRITE, 1, 1, 1, 0, ""),
+    "INCRBY": (WRITE, 1, 1, 1, 0, ""),
+    "INCRBYFLOAT": (WRITE, 1, 1, 1, 0, ""),
+    "INFO": (IDEMPOTENT, 0, 0, 1, 0, ""),
+    "KEYS": (READONLY | IDEMPOTENT, 0, 0, 1, 0, ""),
+    "LASTSAVE": (IDEMPOTENT, 0, 0, 1, 0, ""),
+    "LINDEX": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "LINSERT": (WRITE, 1, 1, 1, 0, ""),
+    "LLEN": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "LPOP": (WRITE, 1, 1, 1, 0, ""),
+    "LPUSH": (WRITE, 1, 1, 1, 0, ""),
+    "LPUSHX": (WRITE, 1, 1, 1, 0, ""),
+    "LRANGE": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "LREM": (WRITE, 1, 1, 1, 0, ""),
+    "LSET": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "LTRIM": (WRITE, 1, 1, 1, 0, ""),
+    "MGET": (READONLY | IDEMPOTENT, 1, -1, 1, 0, ""),
+    "MIGRATE": (WRITE, 3, 3, 1, 0, ""),
+    "MONITOR": (ADMIN | STATEFUL, 0, 0, 1, 0, ""),
+    "MOVE": (WRITE, 1, 1, 1, 0, ""),
+    "MSET": (WRITE | IDEMPOTENT, 1, -1, 2, 0, ""),
+    "MSETNX": (WRITE, 1, -1, 2, 0, ""),
+    "MULTI": (STATEFUL, 0, 0, 1, 0, ""),
+    "OBJECT": (READONLY | IDEMPOTENT, 2, 2, 1, 0, ""),
+    "PERSIST": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "PEXPIRE": (WRITE, 1, 1, 1, 0, ""),
+    "PEXPIREAT": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "PING": (IDEMPOTENT, 0, 0, 1, 0, ""),
+    "PSETEX": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "PSUBSCRIBE": (PUBSUB | STATEFUL, 0, 0, 1, 0, ""),
+    "PTTL": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "PUBLISH": (PUBSUB, 1, 1, 1, 0, ""),
+    "PUBSUB": (PUBSUB | IDEMPOTENT, 0, 0, 1, 0, ""),
+    "PUNSUBSCRIBE": (PUBSUB | STATEFUL, 0, 0, 1, 0, ""),
+    "QUIT": (STATEFUL, 0, 0, 1, 0, ""),
+    "RANDOMKEY": (READONLY | IDEMPOTENT, 0, 0, 1, 0, ""),
+    "RENAME": (WRITE, 1, 2, 1, 0, ""),
+    "RENAMENX": (WRITE, 1, 2, 1, 0, ""),
+    "RESTORE": (WRITE, 1, 1, 1, 0, ""),
+    "RPOP": (WRITE, 1, 1, 1, 0, ""),
+    "RPOPLPUSH": (WRITE, 1, 2, 1, 0, ""),
+    "RPUSH": (WRITE, 1, 1, 1, 0, ""),
+    "RPUSHX": (WRITE, 1, 1, 1, 0, ""),
+    "SADD": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "SAVE": (ADMIN, 0, 0, 1, 0, ""),
+    "SCAN": (READONLY | IDEMPOTENT, 0, 0, 1, 0, ""),
+    "SCARD": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "SCRIPT EXISTS": (IDEMPOTENT, 0, 0, 1, 0, ""),
+    "SCRIPT FLUSH": (0, 0, 0, 1, 0, ""),
+    "SCRIPT KILL": (ADMIN, 0, 0, 1, 0, ""),
+    "SCRIPT LOAD": (IDEMPOTENT, 0, 0, 1, 0, ""),
+    "SDIFF": (READONLY | IDEMPOTENT, 1, -1, 1, 0, ""),
+    "SDIFFSTORE": (WRITE, 1, -1, 1, 0, ""),
+    "SELECT": (IDEMPOTENT | STATEFUL, 0, 0, 1, 0, ""),
+    "SET": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "SETBIT": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "SETEX": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "SETNX": (WRITE, 1, 1, 1, 0, ""),
+    "SETRANGE": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "SHUTDOWN": (ADMIN, 0, 0, 1, 0, ""),
+    "SINTER": (READONLY | IDEMPOTENT, 1, -1, 1, 0, ""),
+    "SINTERSTORE": (WRITE, 1, -1, 1, 0, ""),
+    "SISMEMBER": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "SLAVEOF": (ADMIN, 0, 0, 1, 0, ""),
+    "SLOWLOG": (ADMIN, 0, 0, 1, 0, ""),
+    "SMEMBERS": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "SMOVE": (WRITE, 1, 2, 1, 0, ""),
+    "SORT": (WRITE, 1, 1, 1, 0, "STORE"),
+    "SPOP": (WRITE, 1, 1, 1, 0, ""),
+    "SRANDMEMBER": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "SREM": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "SSCAN": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "STRLEN": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "SUBSCRIBE": (PUBSUB | STATEFUL, 0, 0, 1, 0, ""),
+    "SUNION": (READONLY | IDEMPOTENT, 1, -1, 1, 0, ""),
+    "SUNIONSTORE": (WRITE, 1, -1, 1, 0, ""),
+    "SYNC": (ADMIN | STATEFUL, 0, 0, 1, 0, ""),
+    "TIME": (IDEMPOTENT, 0, 0, 1, 0, ""),
+    "TTL": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "TYPE": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "UNSUBSCRIBE": (PUBSUB | STATEFUL, 0, 0, 1, 0, ""),
+    "UNWATCH": (STATEFUL, 0, 0, 1, 0, ""),
+    "WATCH": (STATEFUL, 1, -1, 1, 0, ""),
+    "ZADD": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "ZCARD": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "ZCOUNT": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "ZINCRBY": (WRITE, 1, 1, 1, 0, ""),
+    "ZINTERSTORE": (WRITE, 1, 1, 1, 2, ""),
+    "ZRANGE": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "ZRANGEBYSCORE": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "ZRANK": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "ZREM": (WRITE | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "ZREMRANGEBYRANK": (WRITE, 1, 1, 1, 0, ""),
+    "ZREMRANGEBYSCORE": (WRITE, 1, 1, 1, 0, ""),
+    "ZREVRANGE": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "ZREVRANGEBYSCORE": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "ZREVRANK": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "ZSCAN": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "ZSCORE": (READONLY | IDEMPOTENT, 1, 1, 1, 0, ""),
+    "ZUNIONSTORE": (WRITE, 1, 1, 1, 2, ""),
+}
+
+
+def _with_flags(flags):
+    return frozenset(cmd for cmd, info in COMMANDS.items()
+                     if info[0] & flags == flags)
+
+
+READONLY_COMMANDS = _with_flags(READONLY)
+WRITE_COMMANDS = _with_flags(WRITE)
+BLOCKING_COMMANDS = _with_flags(BLOCKING)
+PUBSUB_COMMANDS = _with_flags(PUBSUB)
+ADMIN_COMMANDS = _with_flags(ADMIN)
+IDEMPOTENT_COMMANDS = _with_flags(IDEMPOTENT)
+STATEFUL_COMMANDS = _with_flags(STATEFUL)
+SUBSCRIBE_COMMANDS = _with_flags(PUBSUB | STATEFUL)
+
+KEY_SPECS = dict((cmd, info[1:]) for cmd, info in COMMANDS.items()
+                 if info[1] or info[4] or info[5])
@@ -0,0 +1,105 @@
+from bisect import bisect_left
+
+
+def _make_buckets():
+    # 1-2-5 series from 10us to 10s, roughly HDR-like relative precision
+    buckets = []
+    for exp in range(-5, 2):
+        for mult in (1, 2, 5):
+            buckets.append(mult * 10.0 ** exp)
+    return tuple(b for b in buckets if b <= 10.0)
+
+
+LATENCY_BUCKETS = _make_buckets()
+
+
+class Histogram(object):
+    """
+        Fixed-bucket histogram. Recording a value is a single bisect.
+    """
+    __slots__ = ('buckets', 'counts', 'count', 'total')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # Last slot is for values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, q):
+        """
+            Upper bound of the bucket containing q-th percentile (0..100)
+        """
+        if not self.count:
+            return 0.0
+        rank = self.count * q / 100.0
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'buckets': list(zip(self.buckets + (float('inf'),), self.counts)),
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+        }
+
+
+class Metrics(object):
+    """
+        Counters shared by one client or by all clients of a pool.
+
+        All updates are plain attribute increments, so metrics are always
+        collected. Use :meth:`snapshot` to get a copy of current values.
+    """
+    def __init__(self):
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.connects = 0
+        # Connects of a client over a lost connection, and lost connections
+        # a pool dropped to open new ones
+        self.reconnects = 0
+        # Connection errors or disconnects with replies pending
+        self.failures = 0
+        # Failures since the last reply, used for health tracking
+        self.consecutive_failures = 0
+        self.commands = {}
+        self.pool_wait = Histogram()
+
+    def observe_latency(self, cmd, value):
+        hist = self.commands.get(cmd)
+        if hist is None:
+            hist = self.commands[cmd] = Histogram()
+        hist.observe(value)
+
+    def snapshot(self, clients=()):
+        """
+            Return metrics as a dictionary
+
+            :param clients:
+                Clients to report in-flight depth for
+        """
+        return {
+            'bytes_written': self.bytes_written,
+            'bytes_read': self.bytes_read,
+            'connects': self.connects,
+            'reconnects': self.reconnects,
+            'failures': self.failures,
+            'connections': [{'in_flight': len(cli.callbacks),
+                             'connected': cli.is_connected()}
+                            for cli in clients],
+            'commands': dict((cmd, hist.snapshot())
+                             for cmd, hist in self.commands.items()),
+            'pool_wait': self.pool_wait.snapshot(),
+        }
@@ -0,0 +1,294 @@
+"""
+Online migration of keys between two RedisNodes layouts.
+
+Typical use::
+
+    old = RedisNodes(old_config)
+    new = RedisNodes(new_config)
+    migration = Migration(old, new, on_progress=save_checkpoint)
+    migration.start(callback=on_done)
+
+While migration runs, application writes should go to ``new`` and reads
+should go through :meth:`Migration.read` (or :meth:`Migration.get`), which
+asks the new owner of the key first and falls back to the old one.
+"""
+import logging
+import time
+
+from tornado import stack_context
+from tornado.ioloop import IOLoop
+
+
+logger = logging.getLogger(__name__)
+
+
+def _is_error(resp):
+    return resp is None or isinstance(resp, Exception)
+
+
+class Migration(object):
+    """
+    Moves every key whose owner differs between ``old_nodes`` and
+    ``new_nodes``.
+
+    Source nodes are walked with SCAN. For each batch, keys are read with
+    pipelined DUMP and PTTL and written with pipelined RESTORE to the new
+    owner, then deleted from the source. A key which already exists on the
+    new owner was written there during migration and is kept as is.
+    With ``use_migrate`` keys are moved by MIGRATE on the source node
+    instead; it needs ``host`` and ``port`` of the new owner.
+
+    ``checkpoint`` maps source node name to the SCAN cursor to continue
+    from, None for nodes which are done. It is passed to ``on_progress``
+    after every batch and can be given back to the constructor to resume.
+    """
+
+    def __init__(self, old_nodes, new_nodes, match=None, count=1000,
+                 concurrency=2, rate=None, use_migrate=False,
+                 migrate_timeout=1000, checkpoint=None, on_progress=None,
+                 io_loop=None):
+        """
+        :param match:
+            Optional SCAN MATCH pattern
+        :param count:
+            SCAN COUNT hint, approximate batch size
+        :param concurrency:
+            Number of source nodes migrated at once
+        :param rate:
+            Optional limit of scanned keys per second for every source node
+        """
+        self.old_nodes = old_nodes
+        self.new_nodes = new_nodes
+        self._match = match
+        self._count = count
+        self._concurrency = concurrency
+        self._rate = rate
+        self._use_migrate = use_migrate
+        self._migrate_timeout = migrate_timeout
+        self._on_progress = on_progress
+        self._io_loop = io_loop or IOLoop.instance()
+
+        self.checkpoint = dict(checkpoint or {})
+        self.stats = {'scanned': 0, 'kept': 0, 'moved': 0, 'skipped': 0,
+                      'errors': 0}
+        self.running = False
+        self.finished = False
+
+        self._queue = []
+        self._active = 0
+        self._callback = None
+
+    # Control
+    def start(self, callback=None):
+        """
+        Start migration
+
+        :param callback:
+            Called with stats when all nodes are migrated
+        """
+        if callback is not None:
+            callback = stack_context.wrap(callback)
+        self._callback = callback
+        self.running = True
+        self._queue = [(n, pool) for n, pool in self.old_nodes.nodes
+                       if self.checkpoint.get(n['name'], 0) is not None]
+        if not self._queue:
+            self._finish()
+            return
+        for _ in range(min(self._concurrency, len(self._queue))):
+            self._next_node()
+
+    def stop(self):
+        """
+        Stop after batches in flight, checkpoint stays valid for resuming
+        """
+        self.running = False
+
+    # Dual-read routing
+    def read(self, args, callback, key=None):
+        """
+        Run read command on the new owner of the key, and on the old owner
+        if the new one has no value
+
+        :param args:
+            Command arguments
+        :param key:
+            Key to route by, ``args[1]`` by default
+        """
+        if key is None:
+            key = args[1]
+        new_pool = self.new_nodes.get_client(key)
+        if (self.finished or self.new_nodes.get_info(key)['name'] ==
+                self.old_nodes.get_info(key)['name']):
+            new_pool.send_message(args, callback)
+            return
+        old_pool = self.old_nodes.get_client(key)
+
+        callback = stack_context.wrap(callback)
+
+        def on_new(resp):
+            if resp is None or resp == []:
+                old_pool.send_message(args, callback)
+            else:
+                callback(resp)
+
+        new_pool.send_message(args, on_new)
+
+    def get(self, key, callback):
+        self.read(['GET', key], callback)
+
+    # Helpers
+    def _next_node(self):
+        if not self._queue or not self.running:
+            if self._active == 0:
+                self._finish()
+            return
+        n, pool = self._queue.pop(0)
+        self._active += 1
+        self._scan(n, pool, self.checkpoint.get(n['name'], 0))
+
+    def _node_done(self):
+        self._active -= 1
+        self._next_node()
+
+    def _finish(self):
+        self.running = False
+        self.finished = all(self.checkpoint.get(n['name'], 0) is None
+                            for n, pool in self.old_nodes.nodes)
+        if self._callback is not None:
+            self._callback(self.stats)
+
+    def _scan(self, n, pool, cursor):
+        if not self.running:
+            self._node_done()
+            return
+
+        args = ['SCAN', cursor]
+        if self._match is not None:
+            args.extend(['MATCH', self._match])
+        args.extend(['COUNT', self._count])
+        started = time.time()
+
+        def on_scan(replies):
+            resp = replies[0]
+            if _is_error(resp):
+                logger.error('SCAN failed on %s: %r', n['name'], resp)
+                self.stats['errors'] += 1
+                self._node_done()
+                return
+            next_cursor = int(resp[0])
+            keys = resp[1]
+            self.stats['scanned'] += len(keys)
+
+            def on_batch():
+                self.checkpoint[n['name']] = next_cursor or None
+                if self._on_progress is not None:
+                    self._on_progress({'stats': dict(self.stats),
+                                       'checkpoint': dict(self.checkpoint)})
+                if not next_cursor:
+                    self._node_done()
+                    return
+                delay = 0
+                if self._rate:
+                    delay = (len(keys) / float(self._rate) -
+                             (time.time() - started))
+                if delay > 0:
+                    self._io_loop.add_timeout(
+                        time.time() + delay,
+                        lambda: self._scan(n, pool, next_cursor))
+                else:
+                    self._scan(n, pool, next_cursor)
+
+            moving = [key for key in keys
+                      if self.new_nodes.get_info(key)['name'] != n['name']]
+            self.stats['kept'] += len(keys) - len(moving)
+            if not moving:
+                on_batch()
+            elif self._use_migrate:
+                self._migrate_keys(pool, moving, on_batch)
+            else:
+                self._move_keys(pool, moving, on_batch)
+
+        pool.send_pipeline([args], on_scan)
+
+    def _move_keys(self, pool, keys, callback):
+        commands = []
+        for key in keys:
+            commands.append(['DUMP', key])
+            commands.append(['PTTL', key])
+
+        def on_dump(replies):
+            targets = {}
+            for idx, key in enumerate(keys):
+                data, ttl = replies[2 * idx], replies[2 * idx + 1]
+                if _is_error(data) or _is_error(ttl):
+                    self.stats['errors'] += 1
+                    continue
+                # ttl -2: key is gone since SCAN
+                if ttl == -2:
+                    self.stats['skipped'] += 1
+                    continue
+                target = self.new_nodes.get_client(key)
+                targets.setdefault(target, []).append(
+                    (key, max(ttl, 0), data))
+            self._restore_keys(pool, targets, callback)
+
+        pool.send_pipeline(commands, on_dump)
+
+    def _restore_keys(self, pool, targets, callback):
+        state = {'pending': len(targets), 'delete': []}
+
+        def done():
+            state['pending'] -= 1
+            if state['pending'] > 0:
+                return
+            if not state['delete']:
+                callback()
+                return
+            pool.send_pipeline([['DEL'] + state['delete']],
+                               lambda replies: callback())
+
+        if not targets:
+            callback()
+            return
+
+        for target, records in targets.items():
+            def on_restore(replies, records=records):
+                for (key, ttl, data), resp in zip(records, replies):
+                    if resp is None:
+                        self.stats['errors'] += 1
+                        continue
+                    if isinstance(resp, Exception):
+                        if 'BUSYKEY' not in str(resp):
+                            logger.error('RESTORE of %r failed: %s', key, resp)
+                            self.stats['errors'] += 1
+                            continue
+                        # Written to the new owner during migration
+                        self.stats['skipped'] += 1
+                    else:
+                        self.stats['moved'] += 1
+                    state['delete'].append(key)
+                done()
+
+            target.send_pipeline([['RESTORE', key, ttl, data]
+                                  for key, ttl, data in records], on_restore)
+
+    def _migrate_keys(self, pool, keys, callback):
+        commands = []
+        for key in keys:
+            info = self.new_nodes.get_info(key)
+            commands.append(['MIGRATE', info['host'], info['port'], key,
+                             info['db'], self._migrate_timeout])
+
+        def on_migrate(replies):
+            for key, resp in zip(keys, replies):
+                if _is_error(resp):
+                    logger.error('MIGRATE of %r failed: %s', key, resp)
+                    self.stats['errors'] += 1
+                elif resp in (b'NOKEY', 'NOKEY'):
+                    self.stats['skipped'] += 1
+                else:
+                    self.stats['moved'] += 1
+            callback()
+
+        pool.send_pipeline(commands, on_migrate)
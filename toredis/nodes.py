@@ -1,55 +1,655 @@
-import zlib
-from bisect import bisect_left
-from toredis.client import ClientPool
+import logging
+import time
+from collections import OrderedDict, deque
 
+from tornado import stack_context
+from tornado.ioloop import IOLoop, PeriodicCallback
 
-class RedisNodes(object):
+from toredis.client import ClientPool, _wrap_callback
+from toredis.commands import RedisCommandsMixin
+from toredis.hashing import Crc32Ring
+from toredis.keys import get_keys
+from toredis.metadata import STATEFUL_COMMANDS
+from toredis.replicas import ReplicaSet
+from toredis.serializers import SerializerMixin
+
+
+logger = logging.getLogger(__name__)
+
+
+try:
+    ConnectionError = ConnectionError
+except NameError:
+    # Python 2
+    import socket
+    ConnectionError = socket.error
+
+
+# Empty ring, lends its hash function to RedisNodes.hash_func
+_CRC32_RING = Crc32Ring([])
+
+
+def _func(method):
+    # Function of the method on Python 2 and 3
+    return getattr(method, '__func__', method)
+
+
+class NodeDownError(Exception):
+    """
+    Node owning the key is ejected and RedisNodes runs in store mode
+    """
+
+    def __init__(self, name):
+        super(NodeDownError, self).__init__('Node %s is down' % name)
+        self.name = name
+
+
+class NodesError(Exception):
+    """
+    Some nodes failed to run a multi-node command. ``result`` holds the
+    result built from replies of the other nodes, ``errors`` maps name of
+    every failed node to its error reply (None if connection was closed).
+    """
+
+    def __init__(self, result, errors):
+        super(NodesError, self).__init__(
+            'Failed nodes: %s' % ', '.join(sorted(errors)))
+        self.result = result
+        self.errors = errors
+
+
+if hasattr(OrderedDict, 'move_to_end'):
+    _move_to_end = OrderedDict.move_to_end
+else:
+    def _move_to_end(cache, key):
+        cache[key] = cache.pop(key)
+
+
+def _concat(replies):
+    result = []
+    for reply in replies:
+        result.extend(reply)
+    return result
+
+
+class RedisNodes(SerializerMixin, RedisCommandsMixin):
     """
     Change of almost all parameters of nodes requires rebalancing of keys.
+
+    All redis commands are available and routed by their keys, for example
+    ``nodes.get(key, callback)``. Commands without keys (INFO, DBSIZE,
+    FLUSHDB...) run on all nodes; replies are combined by
+    ``broadcast_aggregators`` or, if all nodes return the same reply,
+    passed as is; otherwise callback gets dictionary of node name to reply.
+    MGET, MSET, DEL and EXISTS work with keys of any nodes, other commands
+    must have all their keys on one node. PUBLISH is routed by its channel:
+    subscribe on ``get_client(channel)`` to receive it.
+
+    Keys are mapped to nodes by ``ring_cls``, one of the rings from
+    :mod:`toredis.hashing`. ``default_replicas`` of None means the default
+    number of points of the ring. A subclass overriding ``hash_func``, as
+    older versions allowed, gets :class:`~toredis.hashing.Crc32Ring` with
+    that function.
+
+    ``key_func`` turns a key into the part used for routing. Pass
+    :func:`toredis.hashing.hash_tag` to keep keys with the same ``{tag}``
+    on one node.
+
+    ``serializer`` is a :class:`~toredis.serializers.Serialization`
+    shared by pools of all nodes.
+
+    ``route_cache_size`` enables LRU cache of key to node mapping, which
+    saves hashing of hot keys. It is cleared whenever the ring changes.
+
+    A node with ``read_replicas`` (list of dictionaries with ``host``,
+    ``port`` or ``unix_socket`` and optional ``max_clients``) is served by
+    a :class:`~toredis.replicas.ReplicaSet`, which routes read-only
+    commands according to the node ``read_preference`` or
+    ``default_read_preference``.
+
+    With ``max_failures`` set, a node is ejected after that many
+    consecutive connection failures or failed health checks. In ``cache``
+    ``eject_mode`` its keys are spread over the other nodes; in ``store``
+    mode routing to it raises :class:`NodeDownError` at once. Call
+    :meth:`start_health_checks` to PING nodes periodically: this detects
+    nodes which hang and re-admits ejected nodes once they reply.
     """
 
     pool_cls = ClientPool # should be a subclass of ClientPool
+    ring_cls = Crc32Ring
+
+    broadcast_aggregators = {
+        'DBSIZE': sum,
+        'KEYS': _concat,
+    }
+
+    # Connection state and pub/sub make no sense over several pools
+    unroutable_commands = STATEFUL_COMMANDS
 
     def __init__(self, nodes, default_max_clients=100,
-                                 default_replicas=100):
-        self._hash_to_nodeinfo = {}
-        self._hash_to_client = {}
+                                 default_replicas=None,
+                                 default_min_clients=0,
+                                 ring_cls=None,
+                                 key_func=None,
+                                 default_read_preference='master',
+                                 max_failures=None,
+                                 eject_mode='cache',
+                                 route_cache_size=0,
+                                 serializer=None):
+        if eject_mode not in ('cache', 'store'):
+            raise ValueError('Unknown eject mode: %s' % eject_mode)
+        self._serializer = serializer
+        self._name_to_node = {}
         self.nodes = []
         for n in nodes:
-            cli = self.pool_cls(host=n.get('host'),
-                                port=n.get('port'),
-                                unix_socket=n.get('unix_socket'),
-                                max_clients=n.get('max_clients',
-                                                default_max_clients),
-                                db=n['db'],
-                                password=n.get('password'))
+            cli = self._make_pool(n, n, default_max_clients,
+                                  default_min_clients)
+            if n.get('read_replicas'):
+                replicas = [self._make_pool(n, r, default_max_clients,
+                                            default_min_clients)
+                            for r in n['read_replicas']]
+                cli = ReplicaSet(cli, replicas,
+                                 read_preference=n.get(
+                                    'read_preference',
+                                    default_read_preference))
 
             self.nodes.append((n, cli))
-            for num in range(n.get('replicas', default_replicas)):
-                _hash = self.hash_func('{}: {}'.format(n['name'], num))
-                self._hash_to_nodeinfo[_hash] = n
-                self._hash_to_client[_hash] = cli
+            self._name_to_node[n['name']] = (n, cli)
 
-        self._hash_list = sorted(self._hash_to_client)
+        self._ring_cls = ring_cls or self.ring_cls
+        if ring_cls is None and _func(type(self).hash_func) is not \
+                _func(RedisNodes.hash_func):
+            self._ring_cls = self._make_hash_func_ring()
+        self._default_replicas = default_replicas
+        self._ring = self._ring_cls(nodes, default_replicas)
+        self._key_func = key_func
+        self._route_cache_size = route_cache_size
+        self._route_cache = OrderedDict() if route_cache_size else None
+
+        self._max_failures = max_failures
+        self._eject_mode = eject_mode
+        self.ejected = set()
+        self._checker = None
+        self._probing = set()
 
     def hash_func(self, string):
-        return zlib.crc32(string.encode('utf-8'))
+        """
+        Hash function of the default ring, kept for compatibility
+        """
+        return _CRC32_RING.hash_func(string)
+
+    def _make_hash_func_ring(self):
+        nodes = self
+
+        class HashFuncRing(Crc32Ring):
+            def hash_func(self, key):
+                return nodes.hash_func(key)
+
+        return HashFuncRing
+
+    def _make_pool(self, n, conf, default_max_clients, default_min_clients):
+        return self.pool_cls(host=conf.get('host'),
+                             port=conf.get('port'),
+                             unix_socket=conf.get('unix_socket'),
+                             max_clients=conf.get('max_clients',
+                                            default_max_clients),
+                             min_clients=conf.get('min_clients',
+                                            default_min_clients),
+                             db=n['db'],
+                             password=n.get('password'),
+                             serializer=self._serializer)
+
+    def warm_up(self):
+        """
+        Open ``min_clients`` connections to every node. Call it in each
+        child process right after forking.
+        """
+        for n, cli in self.nodes:
+            cli.warm_up()
+
+    def _route(self, key):
+        if self._key_func is not None:
+            key = self._key_func(key)
+        return self._name_to_node[self._ring.get_node(key)]
+
+    def _lookup(self, key):
+        cache = self._route_cache
+        if cache is None:
+            return self._route(key)
+        node = cache.get(key)
+        if node is not None:
+            _move_to_end(cache, key)
+            return node
+        node = cache[key] = self._route(key)
+        if len(cache) > self._route_cache_size:
+            cache.popitem(last=False)
+        return node
+
+    def _get_node(self, key):
+        node = self._lookup(key)
+        if self._max_failures is None:
+            return node
+
+        name = node[0]['name']
+        if (name not in self.ejected and
+                node[1].metrics.consecutive_failures >= self._max_failures):
+            self._eject(name)
+        if name in self.ejected:
+            if self._eject_mode == 'store':
+                raise NodeDownError(name)
+            node = self._lookup(key)
+        return node
+
+    # Health tracking
+    def start_health_checks(self, interval=1.0, timeout=1.0, io_loop=None):
+        """
+        PING every node each ``interval`` seconds. A PING without reply in
+        ``timeout`` seconds counts as a failure.
+        """
+        self.stop_health_checks()
+        io_loop = io_loop or IOLoop.instance()
+        self._checker = PeriodicCallback(
+            lambda: self._check_nodes(timeout, io_loop),
+            interval * 1000, io_loop=io_loop)
+        self._checker.start()
 
-    def _get_node_hash(self, key):
-        _hash = self.hash_func(key)
-        idx = bisect_left(self._hash_list, _hash)
-        if idx == len(self._hash_list):
-            idx = 0
-        return self._hash_list[idx]
+    def stop_health_checks(self):
+        if self._checker is not None:
+            self._checker.stop()
+            self._checker = None
 
-    def get_client(self, key):
-        _node_hash = self._get_node_hash(key)
-        return self._hash_to_client[_node_hash]
+    def _check_nodes(self, timeout, io_loop):
+        for n, cli in self.nodes:
+            if n['name'] not in self._probing:
+                self._probe(n, cli, timeout, io_loop)
+
+    def _probe(self, n, cli, timeout, io_loop):
+        name = n['name']
+        self._probing.add(name)
+        state = {'done': False}
+        # Lost connections are already counted by the client
+        failures = cli.metrics.failures
+
+        def finish(ok):
+            if state['done']:
+                return
+            state['done'] = True
+            self._probing.discard(name)
+            if ok:
+                cli.metrics.consecutive_failures = 0
+                if name in self.ejected:
+                    self._readmit(name)
+                return
+            if cli.metrics.failures == failures:
+                cli.metrics.failures += 1
+                cli.metrics.consecutive_failures += 1
+            if (name not in self.ejected and
+                    cli.metrics.consecutive_failures >= self._max_failures):
+                self._eject(name)
+
+        def on_reply(replies):
+            io_loop.remove_timeout(handle)
+            resp = replies[0]
+            finish(resp is not None and not isinstance(resp, Exception))
+
+        handle = io_loop.add_timeout(time.time() + timeout,
+                                     lambda: finish(False))
+        try:
+            cli.send_pipeline([['PING']], on_reply)
+        except Exception as e:
+            if name not in self.ejected:
+                logger.warning('Health check of node %s failed: %s', name, e)
+            io_loop.remove_timeout(handle)
+            finish(False)
+
+    def _eject(self, name):
+        logger.warning('Ejecting node %s', name)
+        self.ejected.add(name)
+        self._rebuild_ring()
+
+    def _readmit(self, name):
+        logger.warning('Re-admitting node %s', name)
+        self.ejected.discard(name)
+        self._rebuild_ring()
+
+    def _rebuild_ring(self):
+        if self._eject_mode != 'cache':
+            return
+        nodes = [n for n, cli in self.nodes if n['name'] not in self.ejected]
+        if not nodes:
+            # Nothing to route to, keep the full ring to fail on connect
+            nodes = [n for n, cli in self.nodes]
+        self._ring = self._ring_cls(nodes, self._default_replicas)
+        if self._route_cache is not None:
+            self._route_cache.clear()
+
+    def get_client(self, key, read_preference=None):
+        """
+        Return pool of the node owning the key. With ``read_preference``,
+        reads of nodes with replicas are routed by it.
+        """
+        cli = self._get_node(key)[1]
+        if read_preference is not None and isinstance(cli, ReplicaSet):
+            return cli.reader(read_preference)
+        return cli
 
     def get_info(self, key):
-        _node_hash = self._get_node_hash(key)
-        return self._hash_to_nodeinfo[_node_hash]
+        return self._get_node(key)[0]
 
     def __getitem__(self, key):
         return self.get_client(key)
 
+    def send_message(self, args, callback=None):
+        cmd = args[0]
+        if cmd in self.unroutable_commands:
+            raise ValueError('Cannot run %s over RedisNodes' % cmd)
+
+        keys = get_keys(args)
+        if not keys:
+            self._broadcast(args, callback)
+            return
+
+        n, cli = self._get_node(keys[0])
+        for key in keys[1:]:
+            if self._get_node(key)[0] is not n:
+                raise ValueError('Keys of %s are on different nodes' % cmd)
+        cli._send_message(args, _wrap_callback(callback))
+
+    def _broadcast(self, args, callback):
+        replies = {}
+        requests = []
+        for n, cli in self.nodes:
+            name = n['name']
+            if name in self.ejected:
+                if self._eject_mode == 'cache':
+                    continue
+                cli = None
+            requests.append((name, cli, [args],
+                             lambda resp, name=name: replies.update(
+                                {name: resp[0]})))
+
+        def get_result():
+            aggregator = self.broadcast_aggregators.get(args[0])
+            values = list(replies.values())
+            if aggregator is not None:
+                return aggregator(values)
+            if values and all(value == values[0] for value in values):
+                return values[0]
+            return replies
+
+        self._scatter(requests, get_result, callback)
+
+    # Multi-key commands
+    #
+    # Keys are grouped by node, every node gets one pipelined request and
+    # nodes are queried concurrently. If some nodes fail, callback gets
+    # NodesError instance with partial result instead of the result.
+    def mget(self, keys, callback=None):
+        """
+        Get the values of all the given keys, in order of the keys
+        """
+        if not isinstance(keys, (list, tuple)):
+            keys = [keys]
+        result = [None] * len(keys)
+        requests = []
+        for name, (cli, indexes, node_keys) in self._group_keys(keys).items():
+            def merge(replies, indexes=indexes):
+                for idx, value in zip(indexes, replies[0]):
+                    result[idx] = value
+            requests.append((name, cli, [['MGET'] + node_keys], merge))
+        self._scatter(requests, lambda: result, callback)
+
+    def mset(self, key_dict, callback=None):
+        """
+        Set multiple keys to multiple values
+        """
+        replies = []
+        requests = []
+        keys = list(key_dict)
+        for name, (cli, indexes, node_keys) in self._group_keys(keys).items():
+            args = ['MSET']
+            for key in node_keys:
+                args.append(key)
+                args.append(key_dict[key])
+            requests.append((name, cli, [args], replies.extend))
+        self._scatter(requests, lambda: replies[0] if replies else None,
+                      callback)
+
+    def delete(self, keys, callback=None):
+        """
+        Delete keys, result is the number of removed keys
+        """
+        if not isinstance(keys, (list, tuple)):
+            keys = [keys]
+        counts = []
+        requests = []
+        for name, (cli, indexes, node_keys) in self._group_keys(keys).items():
+            requests.append((name, cli, [['DEL'] + node_keys], counts.extend))
+        self._scatter(requests, lambda: sum(counts), callback)
+
+    def exists(self, keys, callback=None):
+        """
+        Determine if keys exist, result is a list of 0 or 1 in order of
+        keys, or 0 or 1 for a single key
+        """
+        if not isinstance(keys, (list, tuple)):
+            single = callback
+            if callback is not None:
+                callback = lambda result: single(
+                    result if isinstance(result, NodesError) else result[0])
+            keys = [keys]
+        result = [None] * len(keys)
+        requests = []
+        for name, (cli, indexes, node_keys) in self._group_keys(keys).items():
+            def merge(replies, indexes=indexes):
+                for idx, value in zip(indexes, replies):
+                    result[idx] = value
+            requests.append((name, cli, [['EXISTS', key] for key in node_keys],
+                             merge))
+        self._scatter(requests, lambda: result, callback)
+
+    def scan_iter(self, match=None, count=None, concurrency=None, rate=None,
+                  max_buffered=None, io_loop=None):
+        """
+        Return :class:`NodesScanIterator` over keys of all nodes
+
+        :param concurrency:
+            Number of nodes scanned at once, all by default
+        :param rate:
+            Optional limit of scanned keys per second for every node
+        :param max_buffered:
+            Number of batches fetched ahead, ``concurrency`` by default
+        """
+        return NodesScanIterator(self, match, count, concurrency, rate,
+                                 max_buffered, io_loop)
+
+    def _group_keys(self, keys):
+        # node name -> (pool, key indexes, keys)
+        groups = {}
+        for idx, key in enumerate(keys):
+            try:
+                n, cli = self._get_node(key)
+                name = n['name']
+            except NodeDownError as e:
+                name, cli = e.name, None
+            group = groups.get(name)
+            if group is None:
+                group = groups[name] = (cli, [], [])
+            group[1].append(idx)
+            group[2].append(key)
+        return groups
+
+    def _scatter(self, requests, get_result, callback):
+        """
+        Run commands on nodes concurrently
+
+        :param requests:
+            list of (node name, pool, list of commands, merge), commands
+            of one node are pipelined over one connection and merge is
+            called with their replies if all of them succeed
+        :param get_result:
+            returns result when all nodes replied
+        """
+        if callback is not None:
+            callback = stack_context.wrap(callback)
+        state = {'pending': len(requests), 'errors': {}}
+
+        def done():
+            state['pending'] -= 1
+            if state['pending'] == 0 and callback is not None:
+                errors = state['errors']
+                result = get_result()
+                callback(NodesError(result, errors) if errors else result)
+
+        if not requests:
+            state['pending'] = 1
+            done()
+            return
+
+        for name, pool, commands, merge in requests:
+            if pool is None:
+                state['errors'][name] = NodeDownError(name)
+                done()
+            else:
+                self._send_pipeline(name, pool, commands, merge, state, done)
+
+    def _send_pipeline(self, name, pool, commands, merge, state, done):
+        def on_replies(replies):
+            for resp in replies:
+                if resp is None or isinstance(resp, Exception):
+                    state['errors'][name] = resp
+                    break
+            else:
+                merge(replies)
+            done()
+
+        pool.send_pipeline(commands, on_replies)
+
+
+class NodesScanIterator(object):
+    """
+    SCAN over all nodes of RedisNodes, merged into one stream of batches.
+
+    Up to ``concurrency`` nodes are scanned at once, the rest wait for a
+    free slot. A node requests its next cursor as soon as a batch arrives,
+    unless ``max_buffered`` batches are not taken yet: then it pauses until
+    the caller catches up, so a slow consumer does not grow memory.
+    ``rate`` limits scanned keys per second for every node.
+
+    :meth:`next` works like :meth:`toredis.client.ScanIterator.next`:
+    when SCAN of a node fails, its error reply is raised in the callback,
+    a lost connection is raised as ``ConnectionError``. The walk goes on
+    with other nodes, so :meth:`next` may be called again. Failures and
+    ejected nodes, which are skipped, are recorded in ``errors``, mapping
+    node name to error.
+    """
+
+    def __init__(self, nodes, match=None, count=None, concurrency=None,
+                 rate=None, max_buffered=None, io_loop=None):
+        self._nodes = nodes
+        self._options = []
+        if match is not None:
+            self._options.extend(['MATCH', match])
+        if count is not None:
+            self._options.extend(['COUNT', count])
+        self._queue = deque(nodes.nodes)
+        self._concurrency = concurrency or len(self._queue)
+        self._max_buffered = max_buffered or self._concurrency
+        self._rate = rate
+        self._io_loop = io_loop or IOLoop.instance()
+
+        self._started = False
+        self._active = 0
+        self._paused = []
+        self._batches = deque()
+        self._waiting = None
+        self.errors = {}
+
+    @property
+    def finished(self):
+        return (self._started and not self._queue and self._active == 0 and
+                not self._batches)
+
+    def next(self, callback):
+        """
+        Get next batch of keys, empty list when all nodes are scanned
+        """
+        if self._waiting is not None:
+            raise ValueError('Previous batch is not received yet')
+        self._waiting = _wrap_callback(callback)
+        if not self._started:
+            self._started = True
+            self._start_nodes()
+        self._deliver()
+
+    def _start_nodes(self):
+        while self._queue and self._active < self._concurrency:
+            n, pool = self._queue.popleft()
+            if n['name'] in self._nodes.ejected:
+                self.errors[n['name']] = NodeDownError(n['name'])
+                continue
+            self._active += 1
+            self._scan(n, pool, 0)
+
+    def _scan(self, n, pool, cursor):
+        started = time.time()
+
+        def on_reply(resp):
+            if resp is None or isinstance(resp, Exception):
+                logger.error('SCAN failed on %s: %r', n['name'], resp)
+                if resp is None:
+                    resp = ConnectionError('Connection to node %s was lost' %
+                                           n['name'])
+                self.errors[n['name']] = resp
+                self._batches.append(resp)
+                self._node_done()
+                return
+            next_cursor = int(resp[0])
+            keys = resp[1]
+            if keys:
+                self._batches.append(keys)
+            if not next_cursor:
+                self._node_done()
+                return
+            delay = 0
+            if self._rate:
+                delay = len(keys) / float(self._rate) - (time.time() - started)
+            if delay > 0:
+                self._io_loop.add_timeout(
+                    time.time() + delay,
+                    lambda: self._resume(n, pool, next_cursor))
+            else:
+                self._resume(n, pool, next_cursor)
+            self._deliver()
+
+        try:
+            pool._send_message(['SCAN', cursor] + self._options, on_reply)
+        except Exception as e:
+            logger.exception('SCAN failed on %s', n['name'])
+            self.errors[n['name']] = e
+            self._batches.append(e)
+            self._node_done()
+
+    def _resume(self, n, pool, cursor):
+        if len(self._batches) >= self._max_buffered:
+            self._paused.append((n, pool, cursor))
+        else:
+            self._scan(n, pool, cursor)
+
+    def _node_done(self):
+        self._active -= 1
+        self._start_nodes()
+        self._deliver()
+
+    def _deliver(self):
+        if self._waiting is None:
+            return
+        if self._batches:
+            callback, self._waiting = self._waiting, None
+            batch = self._batches.popleft()
+            while self._paused and len(self._batches) < self._max_buffered:
+                self._scan(*self._paused.pop(0))
+            callback(batch)
+        elif not self._queue and self._active == 0:
+            callback, self._waiting = self._waiting, None
+            callback([])
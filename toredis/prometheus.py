@@ -0,0 +1,102 @@
+"""
+Prometheus text format exporter for toredis metrics.
+
+Example::
+
+    app = Application([
+        (r'/metrics', MetricsHandler, {'sources': {'main': pool}}),
+    ])
+"""
+from tornado.web import RequestHandler
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('"', '\\"'))
+                             for k, v in sorted(labels.items()))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _histogram(lines, name, snapshot, labels):
+    cumulative = 0
+    for bound, count in snapshot['buckets']:
+        cumulative += count
+        bucket_labels = dict(labels, le=_format_value(bound))
+        lines.append('%s_bucket%s %d' % (name, _labels(bucket_labels),
+                                          cumulative))
+    lines.append('%s_sum%s %s' % (name, _labels(labels),
+                                  _format_value(snapshot['sum'])))
+    lines.append('%s_count%s %d' % (name, _labels(labels), snapshot['count']))
+
+
+def format_metrics(snapshots, prefix='toredis'):
+    """
+        Render metrics snapshots in Prometheus text format
+
+        :param snapshots:
+            dictionary of source name to result of ``snapshot_metrics()``
+        :param prefix:
+            metric name prefix
+    """
+    lines = []
+
+    for key, kind in (('bytes_written', 'counter'),
+                      ('bytes_read', 'counter'),
+                      ('connects', 'counter'),
+                      ('reconnects', 'counter'),
+                      ('failures', 'counter')):
+        name = '%s_%s_total' % (prefix, key)
+        lines.append('# TYPE %s %s' % (name, kind))
+        for source, snapshot in sorted(snapshots.items()):
+            lines.append('%s%s %d' % (name, _labels({'source': source}),
+                                      snapshot[key]))
+
+    name = '%s_in_flight' % prefix
+    lines.append('# TYPE %s gauge' % name)
+    for source, snapshot in sorted(snapshots.items()):
+        for num, conn in enumerate(snapshot['connections']):
+            labels = {'source': source, 'connection': num}
+            lines.append('%s%s %d' % (name, _labels(labels),
+                                      conn['in_flight']))
+
+    name = '%s_command_latency_seconds' % prefix
+    lines.append('# TYPE %s histogram' % name)
+    for source, snapshot in sorted(snapshots.items()):
+        for cmd, hist in sorted(snapshot['commands'].items()):
+            _histogram(lines, name, hist, {'source': source, 'command': cmd})
+
+    name = '%s_pool_wait_seconds' % prefix
+    lines.append('# TYPE %s histogram' % name)
+    for source, snapshot in sorted(snapshots.items()):
+        _histogram(lines, name, snapshot['pool_wait'], {'source': source})
+
+    lines.append('')
+    return '\n'.join(lines)
+
+
+class MetricsHandler(RequestHandler):
+    """
+        Tornado handler exposing metrics of clients or pools
+    """
+    def initialize(self, sources, prefix='toredis'):
+        """
+            :param sources:
+                dictionary of source name to ``Client`` or ``ClientPool``
+        """
+        self.sources = sources
+        self.prefix = prefix
+
+    def get(self):
+        snapshots = dict((name, source.snapshot_metrics())
+                         for name, source in self.sources.items())
+        self.set_header('Content-Type', CONTENT_TYPE)
+        self.write(format_metrics(snapshots, self.prefix))
@@ -0,0 +1,179 @@
+import itertools
+import time
+
+from collections import OrderedDict
+
+from tornado import stack_context
+
+from toredis.client import _wrap_callback
+from toredis.commands import RedisCommandsMixin
+from toredis.metadata import READONLY_COMMANDS
+
+
+MASTER = 'master'
+REPLICA = 'replica'
+NEAREST = 'nearest'
+
+# Error replies of a node which can not serve reads for now
+UNAVAILABLE_ERRORS = ('LOADING', 'MASTERDOWN', 'BUSY')
+
+
+class ReplicaSet(RedisCommandsMixin):
+    """
+        Master pool with read replica pools.
+
+        Write commands always go to the master. Read-only commands are
+        routed by read preference:
+
+        * ``master`` - master only
+        * ``replica`` - replica with the lowest latency, master if there
+          are no replicas
+        * ``nearest`` - master or replica with the lowest latency
+
+        Latency is an exponentially weighted moving average of reply time
+        of reads sent to every pool, or the age of the oldest read still
+        waiting for a reply if it is longer. Preference can be set for the
+        set, per command name with ``command_preferences`` or per call
+        with :meth:`reader`.
+
+        A pool whose connection failed or which replied with a loading
+        or similar error is skipped for ``retry_interval`` seconds, then
+        it gets reads again. Reads for the ``replica`` preference go to
+        the master while all replicas are skipped.
+    """
+    def __init__(self, master, replicas=(), read_preference=MASTER,
+                 command_preferences=None, ewma_alpha=0.2,
+                 retry_interval=5.0):
+        """
+            :param master:
+                ClientPool of master
+            :param replicas:
+                ClientPool of every replica
+        """
+        self.master = master
+        self.replicas = list(replicas)
+        self.read_preference = read_preference
+        self.command_preferences = command_preferences or {}
+        self._alpha = ewma_alpha
+        self.retry_interval = retry_interval
+        pools = [master] + self.replicas
+        self._latency = dict((id(pool), 0.0) for pool in pools)
+        # Send times of reads waiting for a reply by request number
+        self._waiting = dict((id(pool), OrderedDict()) for pool in pools)
+        self._failed_at = {}
+        self._counter = itertools.count()
+
+    def reader(self, read_preference):
+        """
+            Return object with all commands, routing reads by preference
+        """
+        return _Reader(self, read_preference)
+
+    def latency(self, pool):
+        """
+            Return observed latency of master or replica pool in seconds
+        """
+        return self._latency[id(pool)]
+
+    @property
+    def metrics(self):
+        return self.master.metrics
+
+    def get_client(self):
+        return self.master.get_client()
+
+    def warm_up(self):
+        for pool in [self.master] + self.replicas:
+            pool.warm_up()
+
+    def snapshot_metrics(self):
+        return self.master.snapshot_metrics()
+
+    def send_message(self, args, callback=None):
+        self._send_message(args, _wrap_callback(callback))
+
+    def send_pipeline(self, commands, callback=None, read_preference=None):
+        pool = self.master
+        if all(args[0] in READONLY_COMMANDS for args in commands):
+            pool = self._get_read_pool(commands[0][0] if commands else None,
+                                       read_preference)
+        pool.send_pipeline(commands, callback)
+
+    def _send_message(self, args, callback, read_preference=None):
+        cmd = args[0]
+        if cmd not in READONLY_COMMANDS:
+            self.master._send_message(args, callback)
+            return
+
+        pool = self._get_read_pool(cmd, read_preference)
+        if pool is self.master and not self.replicas:
+            pool._send_message(args, callback)
+            return
+
+        key = id(pool)
+        request = next(self._counter)
+        sent = self._waiting[key][request] = time.time()
+
+        @stack_context.wrap
+        def on_reply(resp):
+            del self._waiting[key][request]
+            if self._is_failure(pool, resp):
+                self._failed_at[key] = time.time()
+            else:
+                self._failed_at.pop(key, None)
+                self._latency[key] += self._alpha * (
+                    time.time() - sent - self._latency[key])
+            if callback is not None:
+                callback(resp)
+
+        pool._send_message(args, on_reply)
+
+    def _is_failure(self, pool, resp):
+        if resp is None:
+            # Connection was lost or could not be opened
+            return pool.metrics.consecutive_failures > 0
+        return (isinstance(resp, Exception) and
+                str(resp).startswith(UNAVAILABLE_ERRORS))
+
+    def _is_available(self, pool, now):
+        failed = self._failed_at.get(id(pool))
+        return failed is None or now - failed >= self.retry_interval
+
+    def _score(self, pool, now):
+        key = id(pool)
+        waiting = self._waiting[key]
+        if waiting:
+            oldest = next(iter(waiting.values()))
+            return max(self._latency[key], now - oldest)
+        return self._latency[key]
+
+    def _get_read_pool(self, cmd, read_preference):
+        preference = (read_preference or
+                      self.command_preferences.get(cmd) or
+                      self.read_preference)
+        if preference == MASTER:
+            return self.master
+        now = time.time()
+        if preference == REPLICA:
+            candidates = [pool for pool in self.replicas
+                          if self._is_available(pool, now)] or [self.master]
+        elif preference == NEAREST:
+            candidates = [pool for pool in [self.master] + self.replicas
+                          if self._is_available(pool, now)] or [self.master]
+        else:
+            raise ValueError('Unknown read preference: %s' % preference)
+        return min(candidates, key=lambda pool: self._score(pool, now))
+
+
+class _Reader(RedisCommandsMixin):
+    def __init__(self, replica_set, read_preference):
+        self._replica_set = replica_set
+        self._read_preference = read_preference
+
+    def send_message(self, args, callback=None):
+        self._replica_set._send_message(args, _wrap_callback(callback),
+                                        self._read_preference)
+
+    def send_pipeline(self, commands, callback=None):
+        self._replica_set.send_pipeline(commands, callback,
+                                        self._read_preference)
@@ -0,0 +1,243 @@
+"""
+Serialization of values.
+
+A :class:`Serialization` given to a Client, ClientPool or RedisNodes as
+``serializer`` turns values of write commands (SET, MSET, HSET, HMSET...)
+into bytes and values in replies of read commands (GET, MGET, HGET,
+HGETALL...) back into objects. The serializer is chosen by key prefix;
+``using`` of a client, pool or nodes chooses it for single calls::
+
+    pool = ClientPool(serializer=Serialization(
+        default='json', prefixes=[('session:', 'pickle'), ('raw:', None)]))
+    pool.set('user:1', {'name': 'alice'})
+    pool.using('marshal').get('stats', callback=on_stats)
+
+Integers are stored as decimal strings, so INCR and other clients keep
+working on them. Bytes are stored as they are after a ``\\x00`` marker,
+which no serializer output starts with, and are read back as the same
+bytes. A value which cannot be deserialized is returned as an integer if
+it is a decimal number, otherwise as it is.
+
+Serialization runs before compression of :mod:`toredis.compression` on
+write and after decompression on read.
+"""
+import json
+import marshal
+import pickle
+
+from toredis.commands import RedisCommandsMixin
+from toredis.compression import WRITE_COMMANDS, READ_COMMANDS, LIST, PAIRS
+from toredis.hashing import to_bytes
+
+
+try:
+    _integer_types = (int, long)
+except NameError:
+    _integer_types = (int,)
+
+
+# Marks bytes stored without serialization
+RAW = b'\x00'
+
+
+class Serializer(object):
+    """
+    Pair of functions converting objects to bytes and back. ``loads_many``
+    deserializes a list of values, None items stay None.
+    """
+
+    def __init__(self, name, dumps, loads, loads_many=None):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        if loads_many is not None:
+            self.loads_many = loads_many
+
+    def load(self, value):
+        if value[:1] == RAW:
+            return value[1:]
+        try:
+            return self.loads(value)
+        except Exception:
+            try:
+                return int(value)
+            except ValueError:
+                return value
+
+    def loads_many(self, values):
+        load = self.load
+        return [None if value is None else load(value) for value in values]
+
+
+SERIALIZERS = {}
+
+
+def register_serializer(name, dumps, loads, loads_many=None):
+    """
+    Register serializer
+
+    :param dumps:
+        Function of an object returning bytes
+    :param loads:
+        Function of bytes returning an object
+    :param loads_many:
+        Optional faster function of a list of values, see
+        :class:`Serializer`
+    """
+    serializer = Serializer(name, dumps, loads, loads_many)
+    SERIALIZERS[name] = serializer
+    return serializer
+
+
+def _json_dumps(value):
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def _json_loads(value):
+    return json.loads(value.decode('utf-8'))
+
+
+def _json_loads_many(values):
+    # One parse of all values joined into an array instead of one per value
+    present = [value for value in values if value is not None]
+    if any(value[:1] == RAW for value in present):
+        return Serializer.loads_many(_json, values)
+    try:
+        loaded = _json_loads(b'[' + b','.join(present) + b']')
+    except ValueError:
+        loaded = None
+    if loaded is None or len(loaded) != len(present):
+        return Serializer.loads_many(_json, values)
+    loaded = iter(loaded)
+    return [None if value is None else next(loaded) for value in values]
+
+
+_json = register_serializer('json', _json_dumps, _json_loads,
+                            _json_loads_many)
+register_serializer(
+    'pickle', lambda value: pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+    pickle.loads)
+register_serializer('marshal', marshal.dumps, marshal.loads)
+
+
+def _dump(serializer, value):
+    # Fast path: bytes are stored as they are after a marker, integers
+    # as decimal strings
+    if isinstance(value, bytes):
+        return RAW + value
+    if isinstance(value, _integer_types) and not isinstance(value, bool):
+        return str(value).encode('ascii')
+    return serializer.dumps(value)
+
+
+class Prepared(list):
+    """
+    Command arguments which are already serialized
+    """
+
+
+class Serialization(object):
+    """
+    Serialization stage of Client, ClientPool and RedisNodes.
+
+    ``prefixes`` is a list of (key prefix, serializer name or None); the
+    first matching prefix wins, None stores values of matching keys as
+    they are. Other keys use ``default``.
+    """
+
+    def __init__(self, default='json', prefixes=()):
+        self.default = SERIALIZERS[default]
+        self._prefixes = [(to_bytes(prefix),
+                           SERIALIZERS[name] if name is not None else None)
+                          for prefix, name in prefixes]
+
+    def get_serializer(self, key):
+        if not self._prefixes:
+            return self.default
+        key = to_bytes(key)
+        for prefix, serializer in self._prefixes:
+            if key.startswith(prefix):
+                return serializer
+        return self.default
+
+    def encode(self, args):
+        """
+        Return arguments with values serialized
+        """
+        spec = WRITE_COMMANDS.get(args[0])
+        if spec is None:
+            return args
+        first, step, keyed = spec
+        args = list(args)
+        positions = range(first, len(args), step) if step else [first]
+        for pos in positions:
+            serializer = self.get_serializer(args[pos - 1] if keyed
+                                             else args[1])
+            if serializer is not None:
+                args[pos] = _dump(serializer, args[pos])
+        return args
+
+    def decode(self, args, resp):
+        """
+        Return reply of the command with values deserialized
+        """
+        if isinstance(resp, list):
+            kind = READ_COMMANDS[args[0]]
+            if kind == PAIRS:
+                serializer = self.get_serializer(args[1])
+                if serializer is None:
+                    return resp
+                resp = list(resp)
+                resp[1::2] = serializer.loads_many(resp[1::2])
+                return resp
+            if kind == LIST and args[0] == 'MGET':
+                serializers = [self.get_serializer(key) for key in args[1:]]
+                serializer = serializers[0]
+                if any(item is not serializer for item in serializers):
+                    return [value if item is None or value is None
+                            else item.load(value)
+                            for item, value in zip(serializers, resp)]
+            else:
+                serializer = self.get_serializer(args[1])
+            if serializer is None:
+                return resp
+            return serializer.loads_many(resp)
+        if isinstance(resp, bytes):
+            serializer = self.get_serializer(args[1])
+            if serializer is not None:
+                return serializer.load(resp)
+        return resp
+
+    def wrap_callback(self, args, callback):
+        """
+        Return callback which deserializes reply of the command
+        """
+        if callback is None or args[0] not in READ_COMMANDS:
+            return callback
+        return lambda resp: callback(self.decode(args, resp))
+
+
+class SerializerView(RedisCommandsMixin):
+    """
+    Commands of a Client, ClientPool or RedisNodes with values serialized
+    by one serializer. All commands go through ``send_message`` of the
+    target, so over RedisNodes keys of MGET and MSET must be on one node.
+    """
+
+    def __init__(self, target, serializer):
+        self._target = target
+        self._serialization = Serialization(default=serializer)
+
+    def send_message(self, args, callback=None):
+        callback = self._serialization.wrap_callback(args, callback)
+        self._target.send_message(
+            Prepared(self._serialization.encode(args)), callback)
+
+
+class SerializerMixin(object):
+    def using(self, serializer):
+        """
+        Return object with all commands, serializing values with the
+        serializer of given name instead of the configured one
+        """
+        return SerializerView(self, serializer)